@@ -0,0 +1,133 @@
+"""This class scans a resonance coarsely and then refines the scan around it.
+
+A uniform frequency scan spends most of its shots on the background. An
+AdaptiveFrequencyScan takes the coarse scan first and fits a Lorentzian with
+find_peak_lorentzian. It then takes passes of points_per_pass points spread over
+center +- span * width of the fit, until the fitted center is known to
+target_uncertainty or max_passes passes were taken. Every fit uses all points taken so
+far, and the points of every other pass are shifted by half a step so passes interleave.
+
+It is a Scan with a single frequency axis, the experiment defines scan_shot as usual and
+point[0] is the frequency. The result of the last fit is stored in the datasets
+<name>_center, <name>_center_err and <name>_width, in units of scale, and the fitted
+curve at every scan point in fit_name.
+"""
+
+import numpy as np
+from artiq.experiment import kernel, MHz, TBool, TFloat, TArray
+
+from acf.function.fit_models import lorentzian
+from acf.function.fitting import find_peak_lorentzian
+from acf.scan import Scan
+
+class AdaptiveFrequencyScan(Scan):
+
+    def __init__(self, exp, name, frequencies, samples_per_point, threshold, target_uncertainty,
+                 scale=MHz, points_per_pass=10, max_passes=5, span=2.0, fit_name="fit_signal", **kwargs):
+        """Create the scan points and datasets. Must be called in prepare().
+
+        Args:
+            exp (_ACFExperiment): The calling experiment, must define the kernel scan_shot.
+            name (str): Name of the frequency dataset, in units of scale.
+            frequencies (array[float]): Frequencies of the coarse scan in Hz.
+            samples_per_point (int): Number of shots per scan point.
+            threshold (float): Shots with counts below the threshold are dark.
+            target_uncertainty (float): Standard error of the fitted center in Hz at
+                which the scan stops.
+            scale (float): Unit of the frequency dataset and of the fit.
+            points_per_pass (int): Number of points added by every pass.
+            max_passes (int): Maximum number of passes after the coarse scan.
+            span (float): Half width of the refined range in fitted widths.
+            fit_name (str): Name of the dataset with the fitted curve.
+            kwargs: Other arguments of Scan, ex. result_name or thresholding.
+        """
+        capacity = len(frequencies) + points_per_pass * max_passes
+        Scan.__init__(self, exp, [(name, frequencies, scale)], samples_per_point, threshold,
+                      capacity=capacity, **kwargs)
+
+        self.name = name
+        self.scale = scale
+        self.target_uncertainty = target_uncertainty
+        self.points_per_pass = points_per_pass
+        self.max_passes = np.int32(max_passes)
+        self.span = span
+        self.fit_name = fit_name
+        self.min_frequency = np.min(frequencies) / scale
+        self.max_frequency = np.max(frequencies) / scale
+
+        # Number of points handed to the kernel so far and passes taken, kept on the host
+        self.host_num_points = len(frequencies)
+        self.passes = 0
+
+        self.experiment_data.set_list_dataset(fit_name, capacity, broadcast=True)
+        for suffix in ["center", "center_err", "width"]:
+            self.exp.set_dataset(f"{name}_{suffix}", np.nan, broadcast=True)
+
+        self.kernel_invariants.add("max_passes")
+
+    @kernel
+    def run(self) -> TBool:
+        """Take the coarse scan and the refining passes.
+
+        Returns: False if the ion was lost and the scan stopped early.
+        """
+        if self.take_points(0, self.num_points):
+            # The last call only fits the last pass
+            for i in range(self.max_passes + 1):
+                frequencies = self.refine()
+                if len(frequencies) == 0:
+                    break
+
+                start = self.num_points
+                for j in range(len(frequencies)):
+                    self.points[start + j] = frequencies[j]
+                self.num_points += len(frequencies)
+
+                if not self.take_points(start, self.num_points):
+                    break
+
+        self.seq.ion_store.run()
+        return not self.ion_lost
+
+    def refine(self) -> TArray(TFloat):
+        """Fit all points taken so far and get the frequencies of the next pass.
+
+        Returns: The frequencies in Hz, empty when the scan is done.
+        """
+        self.experiment_data.mutation_queue.flush()
+
+        x = np.array(self.exp.get_dataset(self.name))
+        y = np.array(self.exp.get_dataset(self.result_name))
+        taken = np.arange(len(x)) < self.host_num_points
+        valid = taken & ~np.isnan(y)
+        if np.count_nonzero(valid) < 4:
+            # Too few points for the four parameters of the Lorentzian
+            return np.zeros(0)
+
+        is_success, _, params, errors = find_peak_lorentzian(x[valid], y[valid], return_errors=True)
+        if not is_success:
+            return np.zeros(0)
+
+        amplitude, center, width, offset = params
+        width = abs(width)
+        center_err = errors[1]
+        self.exp.set_dataset(f"{self.name}_center", center, broadcast=True)
+        self.exp.set_dataset(f"{self.name}_center_err", center_err, broadcast=True)
+        self.exp.set_dataset(f"{self.name}_width", width, broadcast=True)
+
+        fit = np.where(taken, lorentzian(x, *params), np.nan)
+        self.exp.set_dataset(self.fit_name, fit, broadcast=True)
+
+        if center_err * self.scale <= self.target_uncertainty or self.passes >= self.max_passes:
+            return np.zeros(0)
+
+        self.passes += 1
+        frequencies = np.linspace(center - self.span * width, center + self.span * width, self.points_per_pass)
+        if self.passes % 2 == 0 and self.points_per_pass > 1:
+            frequencies += (frequencies[1] - frequencies[0]) / 2
+        frequencies = np.clip(frequencies, self.min_frequency, self.max_frequency)
+
+        start = self.host_num_points
+        self.host_num_points += len(frequencies)
+        self.experiment_data.insert_nd_dataset(self.name, [(start, self.host_num_points)], frequencies)
+        return frequencies * self.scale
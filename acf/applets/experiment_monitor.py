@@ -182,7 +182,9 @@ class ExperimentMonitor(pg.PlotWidget):
             # Plot fit data if available
             if self.has_fit_dataset and fit_data is not None:
                 try:
-                    self.plot(x_data, fit_data, pen='r')
+                    # Points of shuffled or adaptive scans are not sorted
+                    order = np.argsort(x_data)
+                    self.plot(x_data[order], fit_data[order], pen='r')
                 except Exception as e:
                     logger.error(f"Error plotting fit data: {str(e)}")
 
@@ -11,7 +11,6 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt
 from artiq.applets.simple import TitleApplet
-from scipy.optimize import curve_fit
 
 # ------------------------- XYPlot (plotting & fitting, with fit options) -------------------------
 class XYPlot(pyqtgraph.PlotWidget):
@@ -129,6 +128,9 @@ class XYPlot(pyqtgraph.PlotWidget):
             self.removeFit(fit_type)
             return
 
+        # Only needed once a fit is requested, keeps the applet start fast
+        from scipy.optimize import curve_fit
+
         for dataset in self.datasets:
             if fit_type in dataset['fits']:
                 self.removeFit(fit_type)
@@ -98,4 +98,8 @@ class ArgumentManager:
 	def initialize(self, exp):
 		"""Initialize the argument manager with the calling experiment class."""
 		self.exp = exp
-		self.param_mgr = ParameterManager(exp)
+		if hasattr(exp, "parameter_manager"):
+			# Share the parameter cache of ACF experiments
+			self.param_mgr = exp.parameter_manager
+		else:
+			self.param_mgr = ParameterManager(exp)
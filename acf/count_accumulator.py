@@ -0,0 +1,156 @@
+"""This class reduces PMT counts to statistics on the core device.
+
+Scans usually take many samples per scan point and only need their histogram, the
+number of bright shots and the mean. A CountAccumulator keeps these per scan point on
+the core device and sends them to the host with a single RPC when push() is called at
+the end of the point. The raw counts are only sent by a RawCountAccumulator, created
+when accumulate_counts is given samples_per_point.
+
+ExperimentData.accumulate_counts creates the datasets, for an accumulator named "pmt":
+    pmt_hist              [num_points, num_bins] histogram of each scan point
+    pmt_shots             [num_points] number of shots
+    pmt_above             [num_points] number of shots with counts >= threshold
+    pmt_sum, pmt_sumsq    [num_points] sum and sum of squares of the counts
+    pmt_mean              [num_points] mean counts
+    pmt_above_fraction    [num_points] fraction of shots with counts >= threshold
+    pmt_hist_total        [num_bins] histogram of all shots so far
+    pmt_hist_bins         [num_bins + 1] bin boundaries
+    pmt_threshold         the threshold
+The last three are the datasets plotted by acf/applets/plot_hist.py.
+"""
+
+import numpy as np
+from artiq.experiment import kernel, TFloat
+
+class CountAccumulator:
+
+    def __init__(self, experiment_data, name, num_bins, bin_width, threshold, asynchronous=True):
+        """Create a CountAccumulator. Use ExperimentData.accumulate_counts instead of calling this directly.
+
+        Args:
+            experiment_data (ExperimentData): The ExperimentData instance owning the datasets.
+            name (str): The prefix of the datasets.
+            num_bins (int): Number of histogram bins. Counts above the last bin are
+                added to the last bin.
+            bin_width (int): Width of a bin in counts.
+            threshold (float): Counts at or above the threshold are counted as bright.
+            asynchronous (bool): Push statistics with an async RPC.
+        """
+        self.experiment_data = experiment_data
+        self.name = name
+        self.num_bins = np.int32(num_bins)
+        self.bin_width = np.int32(bin_width)
+        # Counts are integers, so counts >= ceil(threshold) is counts >= threshold
+        self.threshold = np.int32(np.ceil(threshold))
+        self.asynchronous = asynchronous
+
+        # Statistics of the current scan point
+        self.hist = np.zeros(num_bins, dtype=np.int32)
+        self.shots = np.int32(0)
+        self.above = np.int32(0)
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+        # Index of the current scan point
+        self.point = np.int32(0)
+
+        self.kernel_invariants = {
+            "experiment_data", "name", "num_bins", "bin_width", "asynchronous"
+        }
+
+    @kernel
+    def set_point(self, point):
+        """Set the scan point the next shots belong to.
+
+        Only needed if points are not taken in order, push() moves to the next point.
+
+        Args:
+            point (int): The index of the scan point.
+        """
+        self.point = point
+
+    @kernel
+    def add(self, counts):
+        """Add the counts of one shot.
+
+        Args:
+            counts (int): The PMT counts.
+        """
+        bin_i = counts // self.bin_width
+        if bin_i >= self.num_bins:
+            bin_i = self.num_bins - 1
+        self.hist[bin_i] += 1
+
+        self.save_shot(counts)
+
+        self.shots += 1
+        if counts >= self.threshold:
+            self.above += 1
+        self.sum += float(counts)
+        self.sumsq += float(counts) * float(counts)
+
+    @kernel
+    def save_shot(self, counts):
+        """Keep the raw counts of a shot, only done by RawCountAccumulator."""
+        pass
+
+    @kernel
+    def flush_shots(self):
+        """Send the raw counts kept by save_shot, only done by RawCountAccumulator."""
+        pass
+
+    @kernel
+    def above_fraction(self) -> TFloat:
+        """Get the fraction of shots of the current point with counts >= threshold."""
+        if self.shots == 0:
+            return 0.0
+        return self.above / self.shots
+
+    @kernel
+    def mean(self) -> TFloat:
+        """Get the mean counts of the current point."""
+        if self.shots == 0:
+            return 0.0
+        return self.sum / self.shots
+
+    @kernel
+    def push(self):
+        """Send the statistics of the current point to the host and move to the next point."""
+        self.flush_shots()
+
+        if self.asynchronous:
+            self.experiment_data.write_counts_async(self.name, self.point, self.hist,
+                                                    self.shots, self.above, self.sum, self.sumsq)
+        else:
+            self.experiment_data.write_counts(self.name, self.point, self.hist,
+                                              self.shots, self.above, self.sum, self.sumsq)
+
+        for i in range(self.num_bins):
+            self.hist[i] = 0
+        self.shots = 0
+        self.above = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.point += 1
+
+class RawCountAccumulator(CountAccumulator):
+    """A CountAccumulator that also writes the counts of every shot to a dataset."""
+
+    def __init__(self, experiment_data, name, num_bins, bin_width, threshold, raw_buffer, asynchronous=True):
+        """Create a RawCountAccumulator. Use ExperimentData.accumulate_counts instead of calling this directly.
+
+        Args:
+            raw_buffer (DatasetBuffer): Buffer of the [num_points, samples] dataset of raw counts.
+            Other arguments as for CountAccumulator.
+        """
+        CountAccumulator.__init__(self, experiment_data, name, num_bins, bin_width, threshold, asynchronous)
+        self.raw_buffer = raw_buffer
+        self.kernel_invariants.add("raw_buffer")
+
+    @kernel
+    def save_shot(self, counts):
+        self.raw_buffer.insert([self.point, self.shots], counts)
+
+    @kernel
+    def flush_shots(self):
+        self.raw_buffer.flush()
@@ -0,0 +1,93 @@
+"""This class buffers dataset writes on the core device.
+
+Every call to ExperimentData.append_list_dataset or insert_nd_dataset from a kernel is
+one RPC to the host. A DatasetBuffer instead keeps the data in a fixed-size array on the
+core device and sends it to the host in chunks, either when the buffer is full or when
+flush() is called, e.g. at the end of each scan point.
+"""
+
+import numpy as np
+from artiq.experiment import kernel
+
+class DatasetBuffer:
+
+    def __init__(self, experiment_data, dataset, batch_size, dtype=np.float64, asynchronous=False):
+        """Create a DatasetBuffer. Use ExperimentData.buffer_dataset instead of calling this directly.
+
+        Args:
+            experiment_data (ExperimentData): The ExperimentData instance owning the dataset.
+            dataset (NDDataset): The dataset.
+            batch_size (int): Number of values held on the core device before they are sent.
+            dtype (type): Type of the values, must match the type of the data passed
+                in the kernel, ex. np.int32 for PMT counts.
+            asynchronous (bool): Send chunks with an async RPC.
+        """
+        self.experiment_data = experiment_data
+        self.name = dataset.name
+        self.batch_size = np.int32(batch_size)
+        self.asynchronous = asynchronous
+
+        # Row-major strides used to turn an n-dimensional index into a flat offset
+        self.strides = np.array(dataset.strides, dtype=np.int32)
+
+        # Flat offsets and values waiting to be sent to the host
+        self.offsets = np.zeros(batch_size, dtype=np.int32)
+        self.values = np.zeros(batch_size, dtype=dtype)
+        self.count = np.int32(0)
+
+        # Next flat offset used by append
+        self.cursor = np.int32(dataset.curr_loc)
+
+        self.kernel_invariants = {"experiment_data", "name", "batch_size", "asynchronous", "strides"}
+
+    @kernel
+    def append(self, data):
+        """Append a datapoint, see ExperimentData.append_list_dataset.
+
+        Args:
+            data (?): The datapoint to add. Must be of the buffer's dtype.
+        """
+        self.offsets[self.count] = self.cursor
+        self.values[self.count] = data
+        self.cursor += 1
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+
+    @kernel
+    def insert(self, index, data):
+        """Insert a single value, see ExperimentData.insert_nd_dataset.
+
+        Args:
+            index (list[int]): The index at which to insert the data, one entry per axis.
+            data (?): The datapoint to insert. Must be of the buffer's dtype.
+        """
+        offset = 0
+        for i in range(len(index)):
+            offset += index[i] * self.strides[i]
+        self.offsets[self.count] = offset
+        self.values[self.count] = data
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+
+    @kernel
+    def flush(self):
+        """Send all buffered values to the host."""
+        if self.count > 0:
+            if self.asynchronous:
+                self.experiment_data.write_buffered_async(self.name, self.offsets, self.values, self.count)
+            else:
+                self.experiment_data.write_buffered(self.name, self.offsets, self.values, self.count)
+            self.count = 0
+
+    def flush_host(self):
+        """Send values left in the buffer after the kernel returned.
+
+        Artiq writes modified attributes back to the host when a kernel returns, so
+        values that were buffered but never flushed (ex. when a scan loop was left
+        early) are still available here.
+        """
+        if self.count > 0:
+            self.experiment_data.write_buffered(self.name, self.offsets, self.values, self.count)
+            self.count = np.int32(0)
@@ -0,0 +1,85 @@
+"""This class switches an AD9910 DDS between preloaded single-tone profiles.
+
+Every dds.set() is an SPI write to the DDS followed by an IO update. Loops that switch
+a DDS back and forth between a few frequencies, ex. sideband cooling and optical pumping,
+can instead load each frequency/amplitude pair into one of the AD9910 single-tone
+profiles once and then switch with cpld.set_profile, a single write to the Urukul CPLD.
+
+Profile 7 is the profile used by dds.set() and dds.set_mu() by default, so it is never
+loaded here and switch_default() returns to it. Profiles 0-6 are available.
+
+On Urukul boards before proto_rev 9 the PROFILE pins are shared by all four channels of
+a board. Other channels of the same board then follow the switches, so only use profiles
+there if their profiles are loaded as well.
+"""
+
+import numpy as np
+from artiq.experiment import kernel
+
+# Profile used by AD9910.set and AD9910.set_mu
+DEFAULT_PROFILE = 7
+
+class DDSProfiles:
+
+    def __init__(self, dds):
+        """Create a DDSProfiles. Use HardwareSetup.get_dds_profiles instead of calling this directly.
+
+        Args:
+            dds (AD9910): The DDS device.
+        """
+        self.dds = dds
+        self.cpld = dds.cpld
+        self.channel = np.int32(dds.chip_select - 4)
+
+        # Frequency tuning word and amplitude scale factor loaded into each profile,
+        # -1 if the profile was not loaded in this experiment
+        self.ftw = np.full(DEFAULT_PROFILE, -1, dtype=np.int32)
+        self.asf = np.full(DEFAULT_PROFILE, -1, dtype=np.int32)
+
+        self.kernel_invariants = {"dds", "cpld", "channel"}
+
+    @kernel
+    def load_mu(self, profile, ftw, asf=0x3fff):
+        """Load a frequency and amplitude into a profile in machine units.
+
+        Nothing is written if the profile already holds these values.
+
+        Args:
+            profile (int): The profile, 0 to 6.
+            ftw (int): The frequency tuning word.
+            asf (int): The amplitude scale factor.
+        """
+        if self.ftw[profile] != ftw or self.asf[profile] != asf:
+            self.dds.set_mu(ftw, asf=asf, profile=profile)
+            self.ftw[profile] = ftw
+            self.asf[profile] = asf
+
+    @kernel
+    def load(self, profile, frequency, amplitude=1.0):
+        """Load a frequency and amplitude into a profile.
+
+        Args:
+            profile (int): The profile, 0 to 6.
+            frequency (float): The frequency in Hz.
+            amplitude (float): The amplitude, 0 to 1.
+        """
+        self.load_mu(profile, self.dds.frequency_to_ftw(frequency), self.dds.amplitude_to_asf(amplitude))
+
+    @kernel
+    def switch(self, profile):
+        """Switch the DDS output to a profile.
+
+        Args:
+            profile (int): The profile, 0 to 6, or 7 for the default profile.
+        """
+        self.cpld.set_profile(self.channel, profile)
+
+    @kernel
+    def switch_default(self):
+        """Switch back to the profile used by dds.set()."""
+        self.cpld.set_profile(self.channel, DEFAULT_PROFILE)
+
+    def invalidate(self):
+        """Write all profiles again on their next load, ex. after the DDS was initialized."""
+        self.ftw[:] = -1
+        self.asf[:] = -1
@@ -0,0 +1,104 @@
+"""This class replays a recorded pulse train with core DMA.
+
+Long pulse trains, ex. sideband cooling, are made of hundreds of nearly identical
+set/sw.on/delay/sw.off calls. Generated by the CPU for every shot they limit the number
+of cycles before the timeline underflows. A DMATrace instead records the pulse train
+once into core DMA and plays it back for every shot. The settings used for a recording
+are kept, so the trace is only recorded again when one of them changes.
+
+A trace must not contain set_att or set_att_mu. They write the whole attenuation
+register of the Urukul CPLD from its shadow on the core device, so every playback would
+set the other channels of the CPLD to their attenuations at record time, while the
+shadow no longer matches the hardware. Set the attenuations before the playback, or,
+for a pulse train that changes attenuations, get the registers it writes from
+att_register before the playback, write them with cpld.set_all_att_mu in the trace and
+add them to the settings of the trace.
+
+Usage in a kernel:
+    self.dds.set_att_mu(att_mu)
+    if self.cooling_trace.changed([freq]):
+        with self.core_dma.record(self.cooling_trace.name):
+            self.pulse_train(freq)
+        self.core.break_realtime()
+    self.cooling_trace.playback()
+"""
+
+import numpy as np
+from artiq.experiment import kernel, TBool, TInt32
+
+class DMATrace:
+
+    def __init__(self, name, num_settings):
+        """Create a DMATrace. Use Sequence.add_dma_trace to create one for a sequence.
+
+        Args:
+            name (str): The name of the trace in core DMA, unique among all traces.
+            num_settings (int): Number of values the recorded pulse train depends on.
+        """
+        self.name = name
+
+        # Settings used for the recording in core DMA, nan until a trace is recorded
+        self.settings = np.full(num_settings, np.nan)
+        self.recorded = False
+
+        ## Set in initialize
+        self.core = None
+        self.core_dma = None
+
+        self.kernel_invariants = {"name", "core", "core_dma"}
+
+    def initialize(self, exp):
+        """Get the core devices. Must be called in build().
+
+        Args:
+            exp (EnvExperiment): The calling experiment.
+        """
+        self.core = exp.core
+        self.core_dma = exp.core_dma
+
+    @kernel
+    def changed(self, settings) -> TBool:
+        """Check whether the trace needs to be recorded and store the new settings.
+
+        Args:
+            settings (list[float]): The current settings, in the same order for every call.
+
+        Returns: True if no trace was recorded in this experiment yet or a setting changed.
+        """
+        changed = not self.recorded
+        for i in range(len(settings)):
+            if settings[i] != self.settings[i]:
+                changed = True
+                self.settings[i] = settings[i]
+        self.recorded = True
+        return changed
+
+    @kernel
+    def att_register(self, dds, att) -> TInt32:
+        """Get the attenuation register of the CPLD of a DDS after setting its attenuation.
+
+        The shadow of the register on the core device is updated as by dds.set_att, but
+        nothing is written. Getting the registers in the order the trace writes them
+        leaves the shadow as the playback leaves the hardware.
+
+        Args:
+            dds (AD9910): The DDS.
+            att (float): The attenuation in dB.
+
+        Returns: The register to write with dds.cpld.set_all_att_mu.
+        """
+        channel = dds.chip_select - 4
+        register = dds.cpld.att_reg & ~(0xff << (channel * 8))
+        register |= dds.cpld.att_to_mu(att) << (channel * 8)
+        dds.cpld.att_reg = register
+        return register
+
+    @kernel
+    def playback(self):
+        """Play the recorded trace at the current time, the timeline advances by its duration."""
+        handle = self.core_dma.get_handle(self.name)
+        self.core_dma.playback_handle(handle)
+
+    def invalidate(self):
+        """Record the trace again on the next shot, ex. after changing settings on the host."""
+        self.recorded = False
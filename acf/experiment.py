@@ -1,4 +1,4 @@
-from artiq.experiment import EnvExperiment, kernel, NumberValue, delay, ms
+from artiq.experiment import EnvExperiment, kernel, NumberValue, BooleanValue, delay, ms
 from acf.hardware_setup import HardwareSetup
 from acf.experiment_data import ExperimentData
 from acf.parameter_manager import ParameterManager
@@ -7,6 +7,12 @@ from acf.parameter_manager import ParameterManager
 
 class _ACFExperiment(EnvExperiment):
 
+    def __init__(self, managers_or_parent, *args, **kwargs):
+        # build() is called by EnvExperiment.__init__
+        super().__init__(managers_or_parent, *args, **kwargs)
+        if hasattr(self, "seq"):
+            self.seq.finish_build()
+
     def setup(self, sequences):
         """Setup the experiment class.
 
@@ -16,6 +22,15 @@ class _ACFExperiment(EnvExperiment):
         self.hardware = HardwareSetup()
         self.hardware.initialize(self)
 
+        self.setattr_argument(
+            "force_urukul_init",
+            BooleanValue(False),
+            tooltip="Initialize all Urukul CPLDs and DDS channels, even if they were "
+                    "already initialized since the core device booted",
+            group="Hardware"
+        )
+        self.hardware.force_urukul_init = self.force_urukul_init
+
         self.experiment_data = ExperimentData(self)
         self.parameter_manager = ParameterManager(self)
 
@@ -33,15 +48,27 @@ class _ACFExperiment(EnvExperiment):
         self.core.break_realtime()
         delay(50*ms)
 
-        # Init CPLDs once per board, then DDS channels.
-        for cpld in self.hardware.get_all_cpld():
+        # Init CPLDs once per board, then DDS channels. Skipped if the boards were
+        # already initialized since the core device booted.
+        if self.hardware.urukul_init_required(self.core.get_rtio_counter_mu()):
+            for cpld in self.hardware.get_all_cpld():
+                self.core.break_realtime()
+                cpld.init()
+                delay(5*ms)
+            for dds in self.hardware.get_all_dds():
+                self.core.break_realtime()
+                dds.init()
+                delay(5*ms)
+            self.hardware.record_urukul_init(self.core.get_rtio_counter_mu())
             self.core.break_realtime()
-            cpld.init()
-            delay(5*ms)
-        for dds in self.hardware.get_all_dds():
+        else:
+            # A run that aborted, ex. on an underflow, may have left a CPLD on another
+            # profile. Write the configuration register the kernel assumes, one SPI
+            # transfer per board.
+            for cpld in self.hardware.get_all_cpld():
+                self.core.break_realtime()
+                cpld.cfg_write(cpld.cfg_reg)
             self.core.break_realtime()
-            dds.init()
-            delay(5*ms)
         
         # Init all devices / turn off all devices / set them to initial value
 
@@ -51,19 +78,25 @@ class _ACFExperiment(EnvExperiment):
 
         self.core.break_realtime()
 
+    def analyze(self):
+        """Write data still held in kernel-side dataset buffers and close the stream file.
+
+        Experiments that override analyze() should call self.experiment_data.close()
+        themselves.
+        """
+        self.experiment_data.close()
+
     def init_sequences(self, sequences):
         """Set up the sequences.
 
+        Sequences registered lazily are only created if the experiment refers to
+        them, so only the sequences an experiment uses read their parameters.
+
         Args:
             sequences (SequencesContainer): The sequences container.
         """
         self.seq = sequences
-        for sequence in self.seq.all_sequences:
-            sequence.initialize(self, self.seq, self.hardware)
-
-    def build_sequences(self):
-        for sequence in self.seq.all_sequences:
-            sequence.build()
+        self.seq.bind(self, self.hardware)
         
 
     def add_arg_from_param(self, param, min_value=None, max_value=None):
@@ -5,6 +5,13 @@ It uses artiq's datasets to implement data storage.
 
 import numpy as np
 from datetime import datetime
+from artiq.experiment import rpc
+
+from acf.count_accumulator import CountAccumulator, RawCountAccumulator
+from acf.dataset_buffer import DatasetBuffer
+from acf.mutation_queue import MutationQueue
+from acf.nd_dataset import NDDataset
+from acf.hdf5_stream import HDF5Stream
 
 class ExperimentData:
 
@@ -31,23 +38,36 @@ class ExperimentData:
             rid = self.exp.scheduler.rid
             self.exp_label = f"{date_str}/{hour_str}/{rid}"
 
+        # Raw data file for datasets created with stream_nd_dataset. Artiq runs
+        # experiments inside the results folder of the current hour, so this
+        # lands next to artiq's own results file.
+        if hasattr(self.exp.scheduler, "rid"):
+            stream_file = f"{self.exp.scheduler.rid:09}-raw.h5"
+        else:
+            stream_file = datetime.now().strftime("%Y%m%d_%H%M%S-raw.h5")
+        self.stream = HDF5Stream(stream_file)
+
         # Dictionary to keep track of dataset metadata
-        # Keys are dataset names, values are dictionaries of
-        # metadata related to the dataset.
-        #   curr_loc: The next spot data will be input to the dataset
-        #   broadcast: True if the data is being broadcasted, False otherwise.
-        # datasets = {
-        #               "pmt_counts": {
-        #                   curr_loc: 4,
-        #                   broadcast: True
-        #               },
-        #               "frequency": {
-        #                   curr_loc: 4,
-        #                   broadcast: True
-        #               }
-        #            }
+        # Keys are dataset names, values are NDDataset objects holding the
+        # shape, strides, broadcast flag and the flat, row-major position
+        # (curr_loc) at which the next appended value will be written.
         self.datasets = {}
 
+        # Names of datasets written to self.stream instead of artiq datasets
+        self.streamed = set()
+
+        # Kernel-side buffers created with buffer_dataset
+        self.buffers = []
+
+        # Host-side queue merging mutations sent by the *_async methods
+        self.mutation_queue = MutationQueue(self.mutate)
+
+        # Histogram of all shots of each CountAccumulator, keyed by its name
+        self.histogram_totals = {}
+
+        # Callbacks run after a dataset was written, keyed by the dataset name
+        self.watchers = {}
+
     def set_list_dataset(self, name, length, broadcast=False):
         """Add a list dataset to the experiment.
 
@@ -57,22 +77,87 @@ class ExperimentData:
             broadcast (int): Set to true to broadcast the dataset. Required for live plotting.
         """
         self.exp.set_dataset(name, np.full(length, np.nan), broadcast=broadcast)
-        self.datasets[name] = { "curr_loc": 0, "broadcast": broadcast }
+        self.datasets[name] = NDDataset(name, [length], broadcast)
     
     def set_nd_dataset(self, name, shape, broadcast=False):
         """Add a n-dimensional dataset to the experiment.
 
+        Values appended with append_nd_dataset fill the dataset in row-major
+        order, i.e. the last axis changes fastest.
+
         Args:
             name (str): The name of the list.
             shape (array[int]): Array of lengths of axes. Ex. [50, 10, 5]
             broadcast (int): Set to true to broadcast the dataset. Required for live plotting.
         """
         self.exp.set_dataset(name, np.full(shape, np.nan), broadcast=broadcast)
-        self.datasets[name] = { 
-            "curr_loc": 0, 
-            "broadcast": broadcast 
-        }
-        # TODO: How will current_loc work for this? Column/row major ordering?
+        self.datasets[name] = NDDataset(name, shape, broadcast)
+
+    def stream_nd_dataset(self, name, shape, dtype=np.float64, compression="lz4"):
+        """Add a n-dimensional dataset that is streamed to an HDF5 file.
+
+        Use this for raw per-shot data of long scans. The dataset is written to
+        disk in chunks as it arrives instead of being held by the master, and all
+        methods of this class (append, insert, buffers) work on it as usual. The
+        first axis of the file grows as data is written, up to shape[0]. The name
+        of the file is stored in the dataset "<name>_stream_file".
+
+        Entries that were not written hold nan for floats, -1 for signed and the
+        largest value for unsigned integers, see hdf5_stream.unwritten_value. The
+        value is also stored in the attribute "unwritten" of the HDF5 dataset.
+
+        Args:
+            name (str): The name of the dataset.
+            shape (array[int]): Array of lengths of axes. Ex. [50, 100]
+            dtype (type): Type of the stored values, ex. np.int32 for PMT counts.
+            compression (str): "lz4", "gzip" or None.
+        """
+        dataset = NDDataset(name, shape, broadcast=False)
+        self.datasets[name] = dataset
+        self.streamed.add(name)
+        self.stream.add_dataset(dataset, dtype, compression)
+        self.exp.set_dataset(f"{name}_stream_file", self.stream.file_name)
+
+    def mutate(self, name, index_mut, data):
+        """Write data to a dataset, either through artiq or to the stream file.
+
+        Args:
+            name (str): The name of the dataset.
+            index_mut (int or tuple): Index in the format of artiq's mutate_dataset.
+            data (?): The data.
+        """
+        if name in self.streamed:
+            self.stream.write(name, index_mut, data)
+        else:
+            self.exp.mutate_dataset(name, index_mut, data)
+
+        for callback in self.watchers.get(name, []):
+            callback(index_mut, data)
+
+    def watch(self, name, callback):
+        """Run a callback every time a dataset is written through this class.
+
+        Used for live analysis of a scan, ex. OnlineFit. The callback runs in the
+        thread writing the data, so it should return quickly.
+
+        Args:
+            name (str): The name of the dataset.
+            callback (function): Called with the index and the data of each write,
+                in the format of mutate.
+        """
+        self.watchers.setdefault(name, []).append(callback)
+
+    def get_nd_dataset(self, name):
+        """Get the NDDataset describing a dataset.
+
+        Args:
+            name (str): The name of the dataset.
+
+        Returns: The NDDataset.
+        """
+        if name not in self.datasets:
+            raise RuntimeError(f"Dataset {name} has not been created.")
+        return self.datasets[name]
 
     def append_list_dataset(self, name, data):
         """Append a datapoint to a list.
@@ -82,35 +167,241 @@ class ExperimentData:
             data (?): The datapoint to add to the list. Must be the
                       same type as the list was initialized with.
         """
-        if name not in self.datasets:
-            raise RuntimeError(f"Dataset {name} has not been created.")
+        dataset = self.get_nd_dataset(name)
+
+        self.mutation_queue.flush(name)
+        self.mutate(name, dataset.curr_loc, data)
+        dataset.curr_loc += 1
+
+    @rpc(flags={"async"})
+    def append_list_dataset_async(self, name, data):
+        """Append a datapoint to a list without blocking the kernel.
+
+        Same as append_list_dataset, but the kernel does not wait for the host.
+        Consecutive datapoints are merged into one mutation before being
+        broadcast, so the live plot may lag by up to one call.
+
+        Args:
+            name (str): The name of the list.
+            data (?): The datapoint to add to the list.
+        """
+        dataset = self.get_nd_dataset(name)
+        self.mutation_queue.push(dataset, dataset.curr_loc, data)
+        dataset.curr_loc += 1
 
-        self.exp.mutate_dataset(name, self.datasets[name]["curr_loc"], data)
-        self.datasets[name]["curr_loc"] += 1
+    def append_nd_dataset(self, name, data):
+        """Append values to a n-dimensional dataset in row-major order.
+
+        data may be a single value or an array of any length, ex. a whole row of
+        samples for one scan point, which is then written with one mutation per
+        row instead of one per value.
+
+        Args:
+            name (str): The name of the dataset.
+            data (?): The value or array of values to append.
+        """
+        dataset = self.get_nd_dataset(name)
+        values = np.ravel(data)
+        if dataset.curr_loc + len(values) > dataset.size:
+            raise RuntimeError(f"Appending {len(values)} values overflows dataset {name}.")
+
+        self.mutation_queue.flush(name)
+        for index_mut, start, stop in dataset.row_runs(dataset.curr_loc, len(values)):
+            self.mutate(name, index_mut, values[start:stop])
+        dataset.curr_loc += len(values)
     
     def insert_nd_dataset(self, name, index, data):
-        """Insert a single value into a n-dimensional dataset.
+        """Insert a value or a block of values into a n-dimensional dataset.
         
         Args:
             name (str): The name of the dataset.
-            index (array[int]): The index at which to insert the data. The length
-                of this index should match the shape with which the dataset was
-                defined. Ex. for a dataset with shape [50, 10, 5], this index could
-                be [10, 0, 0], but not [10, 0] (not enough indices) or [10, 0, 10]
-                (the last index would be out of range). (Issue !!! This is not verified API)
-            data (?): The datapoint to insert.
+            index (int or array): The index at which to insert the data. Each entry
+                is an integer or a (start, stop) pair, and axes that are left out are
+                taken whole. Ex. for a dataset with shape [50, 10, 5], [10, 0, 0]
+                selects a single value, [10] selects the [10, 5] block of scan point
+                10 and [10, (0, 2)] its first two rows. Positions out of range are
+                ignored, like numpy slices.
+            data (?): The datapoint or array to insert. Must match the shape selected
+                by index, up to broadcasting.
         """
-        if type(index) in [int, np.int32]: #1D dataset insertion: verified! 
-            index_mut = index
-        elif type(index) is list:
-            #index_mut = tuple(index)
-            assert len(index) == 2, "Only 2D dataset insertion is supported for now"
+        dataset = self.get_nd_dataset(name)
 
-            index_mut = ((np.int32(index[0]),np.int32(index[0]+1)),(np.int32(index[1]),np.int32(index[1]+1)))
+        if type(index) in [int, np.int32, np.int64] and dataset.ndim == 1:
+            index_mut = int(index)
+        elif type(index) in [int, np.int32, np.int64, list, tuple]:
+            index_mut = dataset.slice_index(index)
         else:
             raise RuntimeError("index must be int or list.")
         
-        self.exp.mutate_dataset(name, index_mut, data)
+        self.mutation_queue.flush(name)
+        self.mutate(name, index_mut, data)
+
+    @rpc(flags={"async"})
+    def insert_nd_dataset_async(self, name, index, data):
+        """Insert a single value into a n-dimensional dataset without blocking the kernel.
+
+        Same as insert_nd_dataset for a full index, but the kernel does not wait
+        for the host. Values inserted at consecutive positions of a row are merged
+        into one mutation before being broadcast.
+
+        Args:
+            name (str): The name of the dataset.
+            index (array[int]): The index at which to insert the data, one entry per axis.
+            data (?): The datapoint to insert.
+        """
+        dataset = self.get_nd_dataset(name)
+        self.mutation_queue.push(dataset, dataset.offset(np.atleast_1d(index)), data)
+
+    @rpc(flags={"async"})
+    def flush_async(self):
+        """Broadcast mutations held back by the *_async methods without blocking the kernel."""
+        self.mutation_queue.flush()
+
+    def buffer_dataset(self, name, batch_size=None, dtype=np.float64, asynchronous=False):
+        """Create a kernel-side buffer for a dataset.
+
+        The buffer has the same append / insert API as append_list_dataset and
+        insert_nd_dataset, but keeps the data on the core device and sends it to
+        the host in chunks of batch_size values, cutting the number of RPCs.
+        Call flush() on the buffer at the end of each scan point to keep live
+        plots up to date. Values still buffered when the kernel returns are
+        written by flush_buffers.
+
+        Args:
+            name (str): The name of the dataset. Must already have been created.
+            batch_size (int): Number of values sent per RPC. Defaults to the length
+                of the last axis, i.e. one row of an n-dimensional dataset.
+            dtype (type): Type of the values written from the kernel, ex. np.int32.
+            asynchronous (bool): Send chunks with an async RPC so the kernel never
+                waits for the host.
+
+        Returns: The DatasetBuffer.
+        """
+        dataset = self.get_nd_dataset(name)
+
+        if batch_size is None:
+            batch_size = dataset.row_length
+
+        buffer = DatasetBuffer(self, dataset, int(batch_size), dtype, asynchronous)
+        self.buffers.append(buffer)
+        return buffer
+
+    def write_buffered(self, name, offsets, values, count):
+        """Write a chunk of values sent by a DatasetBuffer.
+
+        Runs of consecutive offsets within the same row are written with a
+        single mutation.
+
+        Args:
+            name (str): The name of the dataset.
+            offsets (array[int]): Flat, row-major offsets of the values.
+            values (array): The values.
+            count (int): Number of valid entries in offsets and values.
+        """
+        self.mutation_queue.flush(name)
+
+        dataset = self.get_nd_dataset(name)
+        offsets = np.asarray(offsets[:count])
+        values = np.asarray(values[:count])
+
+        breaks = np.flatnonzero(
+            (np.diff(offsets) != 1) | (offsets[1:] % dataset.row_length == 0)
+        ) + 1
+        for run_offsets, run_values in zip(np.split(offsets, breaks), np.split(values, breaks)):
+            index_mut = dataset.row_slice(int(run_offsets[0]), len(run_values))
+            self.mutate(name, index_mut, run_values)
+
+        dataset.curr_loc = max(dataset.curr_loc, int(offsets[-1]) + 1)
+
+    @rpc(flags={"async"})
+    def write_buffered_async(self, name, offsets, values, count):
+        """Same as write_buffered, without blocking the kernel."""
+        self.write_buffered(name, offsets, values, count)
+
+    def accumulate_counts(self, name, num_points, threshold, num_bins=50, bin_width=1,
+                          samples_per_point=None, asynchronous=True):
+        """Create a kernel-side accumulator of PMT counts.
+
+        The accumulator keeps the histogram, the number of shots above the threshold
+        and the sum and sum of squares of the counts of each scan point, and sends them
+        with one RPC per scan point. See CountAccumulator for the created datasets.
+
+        Args:
+            name (str): The prefix of the datasets.
+            num_points (int): Number of scan points.
+            threshold (float): Counts at or above the threshold are counted as bright.
+            num_bins (int): Number of histogram bins.
+            bin_width (int): Width of a bin in counts.
+            samples_per_point (int): If given, the raw counts are also written to the
+                dataset <name> of shape [num_points, samples_per_point].
+            asynchronous (bool): Send the statistics with an async RPC.
+
+        Returns: The CountAccumulator.
+        """
+        for suffix in ["shots", "above", "sum", "sumsq", "mean", "above_fraction"]:
+            self.set_list_dataset(f"{name}_{suffix}", num_points, broadcast=True)
+        self.set_nd_dataset(f"{name}_hist", [num_points, num_bins], broadcast=True)
+        self.exp.set_dataset(f"{name}_hist_total", np.zeros(num_bins, dtype=np.int64), broadcast=True)
+        self.exp.set_dataset(f"{name}_hist_bins", np.arange(num_bins + 1) * bin_width, broadcast=True)
+        self.exp.set_dataset(f"{name}_threshold", threshold, broadcast=True)
+        self.histogram_totals[name] = np.zeros(num_bins, dtype=np.int64)
+
+        if samples_per_point is None:
+            return CountAccumulator(self, name, num_bins, bin_width, threshold, asynchronous)
+
+        self.set_nd_dataset(name, [num_points, samples_per_point], broadcast=True)
+        raw_buffer = self.buffer_dataset(name, dtype=np.int32, asynchronous=asynchronous)
+        return RawCountAccumulator(self, name, num_bins, bin_width, threshold, raw_buffer, asynchronous)
+
+    def write_counts(self, name, point, hist, shots, above, total, total_sq):
+        """Write the statistics of a scan point sent by a CountAccumulator.
+
+        Args:
+            name (str): The prefix of the datasets.
+            point (int): The index of the scan point.
+            hist (array[int]): The histogram of the scan point.
+            shots (int): Number of shots.
+            above (int): Number of shots with counts >= threshold.
+            total (float): Sum of the counts.
+            total_sq (float): Sum of the squared counts.
+        """
+        self.insert_nd_dataset(f"{name}_hist", [point], hist)
+        self.insert_nd_dataset(f"{name}_shots", point, shots)
+        self.insert_nd_dataset(f"{name}_above", point, above)
+        self.insert_nd_dataset(f"{name}_sum", point, total)
+        self.insert_nd_dataset(f"{name}_sumsq", point, total_sq)
+        if shots > 0:
+            self.insert_nd_dataset(f"{name}_mean", point, total / shots)
+            self.insert_nd_dataset(f"{name}_above_fraction", point, above / shots)
+
+        self.histogram_totals[name] += np.asarray(hist)
+        self.exp.set_dataset(f"{name}_hist_total", self.histogram_totals[name], broadcast=True)
+
+    @rpc(flags={"async"})
+    def write_counts_async(self, name, point, hist, shots, above, total, total_sq):
+        """Same as write_counts, without blocking the kernel."""
+        self.write_counts(name, point, hist, shots, above, total, total_sq)
+
+    def flush_buffers(self):
+        """Write all data still held in kernel-side buffers and in the mutation queue,
+        and flush the stream file to disk.
+
+        Called by close(). Use it to publish the data while the experiment still runs.
+        """
+        for buffer in self.buffers:
+            buffer.flush_host()
+        self.mutation_queue.flush()
+        self.stream.flush()
+
+    def close(self):
+        """Write all buffered data and close the stream file.
+
+        Called by _ACFExperiment.analyze. Experiments that override analyze()
+        should call this first, otherwise the file stays open in the worker process.
+        Streamed datasets can not be written afterwards, artiq datasets still can.
+        """
+        self.flush_buffers()
+        self.stream.close()
     '''
     def enable_experiment_monitor(self,
             y_data_name,
@@ -131,10 +422,10 @@ class ExperimentData:
             ymax (float): Maximum y value.
             pen (bool): Set to True to enable lines between sequential points.
         """
-        if not self.datasets[y_data_name]["broadcast"]:
+        if not self.datasets[y_data_name].broadcast:
             raise RuntimeError(f"Dataset {y_data_name} must have broadcast=True to display.")
 
-        if x_data_name is not None and not self.datasets[x_data_name]["broadcast"]:
+        if x_data_name is not None and not self.datasets[x_data_name].broadcast:
             raise RuntimeError(f"Dataset {x_data_name} must have broadcast=True to display.")
 
         x_data_applet_str = ""
@@ -187,10 +478,10 @@ class ExperimentData:
             ymax (float): Maximum y value.
             pen (bool): Set to True to enable lines between sequential points.
         """
-        if not self.datasets[y_data_name]["broadcast"]:
+        if not self.datasets[y_data_name].broadcast:
             raise RuntimeError(f"Dataset {y_data_name} must have broadcast=True to display.")
 
-        if x_data_name is not None and not self.datasets[x_data_name]["broadcast"]:
+        if x_data_name is not None and not self.datasets[x_data_name].broadcast:
             raise RuntimeError(f"Dataset {x_data_name} must have broadcast=True to display.")
 
         x_data_applet_str = ""
@@ -230,3 +521,17 @@ class ExperimentData:
         self.ccb.issue("create_applet", "Experiment Monitor", applet_cmd)
 
 
+    def enable_histogram_monitor(self, name):
+        """Start the histogram applet for the counts of a CountAccumulator.
+
+        Args:
+            name (str): The name the accumulator was created with in accumulate_counts.
+        """
+        if name not in self.histogram_totals:
+            raise RuntimeError(f"No count accumulator named {name} has been created.")
+
+        applet_cmd = (
+                "$python acf/applets/plot_hist.py "
+               f"{name}_hist_total --x {name}_hist_bins --threshold {name}_threshold"
+        )
+        self.ccb.issue("create_applet", f"Histogram {name}", applet_cmd)
@@ -0,0 +1,166 @@
+"""This module compares fits with analytic and finite-difference Jacobians.
+
+For every model of FIT_MODELS with an analytic Jacobian, synthetic scans are generated
+from random parameters with Gaussian noise. Each scan is fitted twice from the same
+perturbed initial guess, once with finite differences as the fits did before the models
+had Jacobians, and once with the analytic Jacobian. The report lists the mean fit time,
+the mean number of model evaluations and the fraction of fits that converged, i.e. did
+not fail and reached a reduced chi-square below 2.
+
+With --shifted-line, Lorentzian scans are instead fitted starting from the parameters of
+a line that moved by several widths since, as Fitting.fit does with the last fit of the
+same dataset. The report compares the fit from those parameters alone with
+fit_warm_started, which checks it against a fit from the data, by the fraction of fits
+that found the center within one width.
+
+Example:
+    python -m acf.function.fit_benchmark --scans 200 --points 60
+    python -m acf.function.fit_benchmark --shifted-line 5
+"""
+
+import argparse
+import time
+import numpy as np
+
+from acf.function.fit_models import FIT_MODELS
+
+def synthetic_scan(fit_type, rng, num_points):
+    """Get a synthetic scan of a model.
+
+    Args:
+        fit_type (str): Key of FIT_MODELS.
+        rng (np.random.Generator): Random number generator.
+        num_points (int): Number of scan points.
+
+    Returns: Tuple of (x, y, true parameters, noise level).
+    """
+    x = np.linspace(-1, 1, num_points)
+    center = rng.uniform(-0.3, 0.3)
+    width = rng.uniform(0.05, 0.2)
+    amplitude = rng.uniform(0.5, 1)
+    offset = rng.uniform(0, 0.2)
+    if fit_type in ('Lorentzian', 'NLorentzian', 'Gaussian'):
+        params = [amplitude, center, width, offset]
+    elif fit_type == 'Lorentzian_2_peaks':
+        params = [amplitude, center - 0.4, width, amplitude * 0.7, center + 0.4, width, offset]
+    elif fit_type == 'Sin':
+        x = np.linspace(0, 100, num_points)
+        params = [amplitude / 2, rng.uniform(0.15, 0.4), rng.uniform(0, np.pi), rng.uniform(50, 200), 0.5]
+    elif fit_type == 'Voigt':
+        params = [amplitude * width, center, width / 2, width / 2]
+    elif fit_type == 'Exp_decay':
+        x = np.linspace(0, 100, num_points)
+        params = [amplitude, rng.uniform(10, 40), offset]
+    else:
+        raise RuntimeError(f"No synthetic scan for {fit_type}")
+
+    y_true = FIT_MODELS[fit_type].function(x, *params)
+    noise = 0.03 * np.ptp(y_true)
+    return x, y_true + rng.normal(0, noise, num_points), np.array(params), noise
+
+def run_fit(model, x, y, p0, noise, jac):
+    """Fit a scan and count the model evaluations.
+
+    Returns: Tuple of (converged, duration in s, number of evaluations).
+    """
+    from scipy.optimize import curve_fit
+    evaluations = [0]
+
+    def counted(x, *params):
+        evaluations[0] += 1
+        return model.function(x, *params)
+
+    start = time.perf_counter()
+    try:
+        params, _ = curve_fit(counted, x, y, p0=p0, jac=jac)
+    except (RuntimeError, ValueError):
+        return False, time.perf_counter() - start, evaluations[0]
+    duration = time.perf_counter() - start
+
+    chi2 = np.sum((y - model.function(x, *params))**2) / noise**2 / (len(x) - len(p0))
+    return bool(chi2 < 2), duration, evaluations[0]
+
+def benchmark(fit_type, num_scans, num_points, perturbation, seed):
+    """Fit synthetic scans of a model with and without its analytic Jacobian.
+
+    Returns: Dictionary from "finite differences" and "analytic" to arrays of
+        (converged, duration, evaluations) per scan.
+    """
+    model = FIT_MODELS[fit_type]
+    rng = np.random.default_rng(seed)
+    results = {"finite differences": [], "analytic": []}
+    for _ in range(num_scans):
+        x, y, params, noise = synthetic_scan(fit_type, rng, num_points)
+        p0 = params * (1 + rng.normal(0, perturbation, len(params)))
+        results["finite differences"].append(run_fit(model, x, y, p0, noise, None))
+        results["analytic"].append(run_fit(model, x, y, p0, noise, model.jacobian))
+    return {name: np.array(result) for name, result in results.items()}
+
+def shifted_line(num_scans, num_points, shift, seed):
+    """Fit Lorentzian scans starting from the parameters of a line that moved since.
+
+    Args:
+        num_scans (int): Number of synthetic scans.
+        num_points (int): Number of points per scan.
+        shift (float): Distance the line moved, in widths.
+        seed (int): Seed of the scans.
+
+    Returns: Dictionary from "previous parameters" and "checked" to arrays of whether
+        the fitted center is within one width of the true center.
+    """
+    import contextlib
+    import io
+    from acf.function.fitting import fit_function, fit_warm_started, warm_start_bounds
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-0.2, 0.2, num_points)
+    width = 0.01
+    results = {"previous parameters": [], "checked": []}
+    for _ in range(num_scans):
+        center = rng.uniform(-0.1, 0.1)
+        params = np.array([0.8, center, width, 0.05])
+        y = FIT_MODELS['Lorentzian'].function(x, *params) + rng.normal(0, 0.02, num_points)
+        previous = params.copy()
+        previous[1] -= shift * width * rng.choice([-1, 1])
+
+        # The fit functions print their results
+        with contextlib.redirect_stdout(io.StringIO()):
+            p0, bounds = warm_start_bounds('Lorentzian', previous, x)
+            fits = {
+                "previous parameters": fit_function(x, y, 'Lorentzian', p0=p0, **bounds),
+                "checked": fit_warm_started(x, y, 'Lorentzian', p0=previous),
+            }
+        for name, (is_success, _, fitted) in fits.items():
+            results[name].append(is_success and abs(fitted[1] - center) < width)
+    return {name: np.array(result) for name, result in results.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fits with analytic and finite-difference Jacobians.")
+    parser.add_argument("--scans", type=int, default=100, help="Number of synthetic scans per model")
+    parser.add_argument("--points", type=int, default=60, help="Number of points per scan")
+    parser.add_argument("--perturbation", type=float, default=0.2,
+                        help="Relative error of the initial parameters")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shifted-line", type=float, default=None, metavar="WIDTHS",
+                        help="Check warm-started Lorentzian fits of a line that moved by this many widths")
+    args = parser.parse_args()
+
+    if args.shifted_line is not None:
+        results = shifted_line(args.scans, args.points, args.shifted_line, args.seed)
+        print(f"{'start':<22}{'center found':>13}")
+        for name, found in results.items():
+            print(f"{name:<22}{np.mean(found):>13.1%}")
+        return
+
+    print(f"{'model':<20}{'jacobian':<20}{'time (ms)':>10}{'evaluations':>13}{'converged':>11}")
+    for fit_type, model in FIT_MODELS.items():
+        if model.jacobian is None or fit_type == 'NLorentzian':
+            continue
+        results = benchmark(fit_type, args.scans, args.points, args.perturbation, args.seed)
+        for name, result in results.items():
+            converged, duration, evaluations = result.T
+            print(f"{fit_type:<20}{name:<20}{1e3 * np.mean(duration):>10.2f}"
+                  f"{np.mean(evaluations):>13.1f}{np.mean(converged):>11.1%}")
+
+if __name__ == "__main__":
+    main()
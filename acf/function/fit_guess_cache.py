@@ -0,0 +1,60 @@
+"""This class stores the parameters of successful fits to start later fits from.
+
+Calibration experiments fit the same kind of data again and again, and the last fitted
+parameters are a much better initial guess than one derived from the data. The
+parameters are stored in persistent Artiq datasets, one per experiment class, fit type
+and dataset, with the prefix __fitguess__, ex.
+    __fitguess__RabiFreqScan/Lorentzian/pmt_counts_avg
+Like __param__ datasets they survive restarts of the master.
+"""
+
+import numpy as np
+
+class FitGuessCache:
+
+    dataset_prefix = "__fitguess__"
+
+    def __init__(self, exp):
+        """Create a FitGuessCache instance.
+
+        Args:
+            exp (EnvExperiment): The calling experiment class.
+        """
+        self.exp = exp
+
+    def key(self, fit_type, dataset):
+        """Get the key of a fit of the calling experiment.
+
+        Args:
+            fit_type (str): One of FITTING_TYPES.
+            dataset (str): Name of the fitted dataset.
+
+        Returns: The key, used for get and store.
+        """
+        return f"{type(self.exp).__name__}/{fit_type}/{dataset}"
+
+    def get(self, key):
+        """Get the parameters of the last successful fit.
+
+        Args:
+            key (str): The key returned by key().
+
+        Returns: The parameters, or None if there was no successful fit yet.
+        """
+        params = self.exp.get_dataset(self.dataset_prefix + key, default=None, archive=False)
+        if params is None:
+            return None
+
+        params = np.array(params, dtype=np.float64)
+        if not np.all(np.isfinite(params)):
+            return None
+        return params
+
+    def store(self, key, params):
+        """Store the parameters of a successful fit.
+
+        Args:
+            key (str): The key returned by key().
+            params (array[float]): The fitted parameters.
+        """
+        self.exp.set_dataset(self.dataset_prefix + key, np.array(params, dtype=np.float64), persist=True)
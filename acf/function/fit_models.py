@@ -0,0 +1,128 @@
+"""Model functions of the fits in fitting.py and their analytic Jacobians.
+
+Every model takes the x values and the parameters and is vectorized over x. Its
+Jacobian returns the derivatives by each parameter as an array of shape
+[len(x), num_params], the form curve_fit expects for jac=. An analytic Jacobian costs
+about one model evaluation, curve_fit's finite differences cost one per parameter and
+are less accurate.
+
+FIT_MODELS maps each fit type of FITTING_TYPES to its FitModel. The split Voigt profile
+has no analytic Jacobian and uses finite differences.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+# jacobian is None where curve_fit should use finite differences
+FitModel = namedtuple("FitModel", ["function", "jacobian", "param_names"])
+
+SQRT_2 = np.sqrt(2)
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+def lorentzian(x, amplitude, center, width, offset):
+    return amplitude * width**2 / ((x - center)**2 + width**2) + offset
+
+def lorentzian_jac(x, amplitude, center, width, offset):
+    d = x - center
+    denominator = d**2 + width**2
+    shape = width**2 / denominator
+    jac = np.empty((len(x), 4))
+    jac[:, 0] = shape
+    jac[:, 1] = 2 * amplitude * shape * d / denominator
+    jac[:, 2] = 2 * amplitude * width * d**2 / denominator**2
+    jac[:, 3] = 1
+    return jac
+
+def double_lorentzian(x, amp1, center1, width1, amp2, center2, width2, offset):
+    return (lorentzian(x, amp1, center1, width1, 0) +
+            lorentzian(x, amp2, center2, width2, 0) +
+            offset)
+
+def double_lorentzian_jac(x, amp1, center1, width1, amp2, center2, width2, offset):
+    jac = np.empty((len(x), 7))
+    jac[:, 0:3] = lorentzian_jac(x, amp1, center1, width1, 0)[:, 0:3]
+    jac[:, 3:6] = lorentzian_jac(x, amp2, center2, width2, 0)[:, 0:3]
+    jac[:, 6] = 1
+    return jac
+
+def gaussian(x, amplitude, center, sigma, offset):
+    return amplitude * np.exp(-(x - center)**2 / (2 * sigma**2)) + offset
+
+def gaussian_jac(x, amplitude, center, sigma, offset):
+    d = x - center
+    shape = np.exp(-d**2 / (2 * sigma**2))
+    jac = np.empty((len(x), 4))
+    jac[:, 0] = shape
+    jac[:, 1] = amplitude * shape * d / sigma**2
+    jac[:, 2] = amplitude * shape * d**2 / sigma**3
+    jac[:, 3] = 1
+    return jac
+
+def sine_function(t, A, omega, phi, tau, c):
+    return A * np.sin(omega * t + phi) * np.exp(-t / tau) + c
+
+def sine_function_jac(t, A, omega, phi, tau, c):
+    phase = omega * t + phi
+    decay = np.exp(-t / tau)
+    sin_decay = np.sin(phase) * decay
+    cos_decay = np.cos(phase) * decay
+    jac = np.empty((len(t), 5))
+    jac[:, 0] = sin_decay
+    jac[:, 1] = A * cos_decay * t
+    jac[:, 2] = A * cos_decay
+    jac[:, 3] = A * sin_decay * t / tau**2
+    jac[:, 4] = 1
+    return jac
+
+def voigt(x, amplitude, center, sigma, gamma):
+    from scipy.special import wofz
+    z = ((x - center) + 1j * gamma) / (sigma * SQRT_2)
+    return amplitude * np.real(wofz(z)) / (sigma * SQRT_2PI)
+
+def voigt_jac(x, amplitude, center, sigma, gamma):
+    from scipy.special import wofz
+    z = ((x - center) + 1j * gamma) / (sigma * SQRT_2)
+    w = wofz(z)
+    # Derivative of the Faddeeva function
+    dw = -2 * z * w + 2j / np.sqrt(np.pi)
+    norm = 1 / (sigma * SQRT_2PI)
+    jac = np.empty((len(x), 4))
+    jac[:, 0] = norm * np.real(w)
+    jac[:, 1] = -amplitude * norm * np.real(dw) / (sigma * SQRT_2)
+    jac[:, 2] = -amplitude * norm * (np.real(dw * z) + np.real(w)) / sigma
+    jac[:, 3] = -amplitude * norm * np.imag(dw) / (sigma * SQRT_2)
+    return jac
+
+def smooth_transition(x, center, sigma1, sigma2, width=1):
+    return sigma1 + (sigma2 - sigma1) / (1 + np.exp(-(x - center) / width))
+
+def voigt_split(x, amplitude, center, sigma1, sigma2, gamma, transition_width):
+    from scipy.special import wofz
+    sigma = smooth_transition(x, center, sigma1, sigma2, transition_width)
+    z = ((x - center) + 1j * gamma) / (sigma * SQRT_2)
+    return amplitude * np.real(wofz(z)) / (sigma * SQRT_2PI)
+
+def exp_decay(x, amplitude, tau, offset):
+    return amplitude * np.exp(-x / tau) + offset
+
+def exp_decay_jac(x, amplitude, tau, offset):
+    decay = np.exp(-x / tau)
+    jac = np.empty((len(x), 3))
+    jac[:, 0] = decay
+    jac[:, 1] = amplitude * decay * x / tau**2
+    jac[:, 2] = 1
+    return jac
+
+FIT_MODELS = {
+    'Lorentzian': FitModel(lorentzian, lorentzian_jac, ["amplitude", "center", "width", "offset"]),
+    'Lorentzian_2_peaks': FitModel(double_lorentzian, double_lorentzian_jac,
+                                   ["amp1", "center1", "width1", "amp2", "center2", "width2", "offset"]),
+    # Fitted to the negated data
+    'NLorentzian': FitModel(lorentzian, lorentzian_jac, ["amplitude", "center", "width", "offset"]),
+    'Gaussian': FitModel(gaussian, gaussian_jac, ["amplitude", "center", "sigma", "offset"]),
+    'Sin': FitModel(sine_function, sine_function_jac, ["A", "omega", "phi", "tau", "c"]),
+    'Voigt': FitModel(voigt, voigt_jac, ["amplitude", "center", "sigma", "gamma"]),
+    'Voigt_Split': FitModel(voigt_split, None,
+                            ["amplitude", "center", "sigma1", "sigma2", "gamma", "transition_width"]),
+    'Exp_decay': FitModel(exp_decay, exp_decay_jac, ["amplitude", "tau", "offset"]),
+}
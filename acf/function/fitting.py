@@ -3,12 +3,14 @@ Fitting module for ARTIQ experiments providing various curve fitting functions.
 """
 
 import numpy as np
-from scipy.fft import fft, fftfreq
-from scipy.optimize import curve_fit
-from scipy.special import wofz
-from scipy.signal import savgol_filter, find_peaks
 from artiq.experiment import *
 
+from acf.function.fit_models import FIT_MODELS
+
+# scipy is imported inside the functions that use it. Every experiment star-imports
+# this module, so importing scipy here would slow down each worker start and every
+# argument rebuild in the dashboard, even for experiments that never fit anything.
+
 # Available fitting types
 FITTING_TYPES = [
     'Lorentzian',
@@ -29,10 +31,14 @@ class Fitting:
         """Initialize the Fitting class."""
         self.exp = None
         self.fitted_array = None
+        self.online = None
+        self.guess_cache = None
 
     def set_exp(self, exp):
         """Set the experiment instance."""
+        from acf.function.fit_guess_cache import FitGuessCache
         self.exp = exp
+        self.guess_cache = FitGuessCache(exp)
     
     def initialize(self, exp, default_func: str, default_arg: float):
         """
@@ -65,29 +71,108 @@ class Fitting:
         """Setup the fitting dataset with specified array length."""
         self.exp.experiment_data.set_list_dataset('fit_signal', array_length, broadcast=True)
     
-    def fit(self, x_data: np.ndarray, y_data: np.ndarray):
+    def fit(self, x_data: np.ndarray, y_data: np.ndarray, dataset: str = None,
+            param: str = None, param_scale: float = 1.0):
         """
         Perform fitting on the provided data.
         
+        The fit starts from the parameters of the online fit if there is one, else from
+        the last successful fit of the same experiment, fit type and dataset. That result
+        is checked against a fit from a guess derived from the data, see fit_warm_started.
+        Points where x or y is nan, ex. not taken because the scan stopped early, are left
+        out.
+        
         Args:
             x_data: X-axis data points
             y_data: Y-axis data points
+            dataset: Name of the fitted dataset, enables the fit guess cache
+            param: Parameter used as initial guess if fit_arg is not set and there is no
+                cached fit, ex. "qubit/S1_2_D3_2" for the center of a line
+            param_scale: Unit of x_data, the parameter is divided by it
             
         Returns:
-            Fitting parameters if successful
+            Fitting parameters if successful, None if not or if there are fewer valid
+            points than parameters
         """
-        is_success, fitted_array, params = fit_function(x_data, y_data, self.exp.Fit_Type, self.exp.fit_arg)
+        x_all = np.asarray(x_data, dtype=np.float64)
+        y_all = np.asarray(y_data, dtype=np.float64)
+        valid = ~(np.isnan(x_all) | np.isnan(y_all))
+        x_data = x_all[valid]
+        y_data = y_all[valid]
+
+        fit_type = self.exp.Fit_Type
+        if len(x_data) < len(FIT_MODELS[fit_type].param_names):
+            self.stop_online()
+            print(f"Only {len(x_data)} valid points, not fitting")
+            return None
+
+        key = None if dataset is None else self.guess_cache.key(fit_type, dataset)
+
+        p0 = self.stop_online()
+        if p0 is None and key is not None:
+            p0 = self.guess_cache.get(key)
+
+        guess = self.exp.fit_arg
+        if param is not None and np.abs(guess + 999) < 1e-3:
+            value = self.exp.parameter_manager.get_param(param) / param_scale
+            if np.min(x_data) <= value <= np.max(x_data):
+                guess = value
+
+        is_success, fitted_array, params = fit_warm_started(x_data, y_data, fit_type, guess, p0)
+        if is_success:
+            # The fitted curve at every point, nan where no point was taken
+            fitted_array_full = np.full(len(x_all), np.nan)
+            fitted_array_full[valid] = fitted_array
+            fitted_array = fitted_array_full
         self.fitted_array = fitted_array
 
+        if is_success and key is not None and params is not None:
+            self.guess_cache.store(key, params)
+
         if is_success:
             self.exp.set_dataset('fit_signal', fitted_array, broadcast=True)
 
         return params
 
+    def enable_online(self, x_name: str, y_name: str, every: int = 5):
+        """
+        Fit the scan in a background thread while it is being taken.
+        
+        The fitted curve is written to fit_signal, the parameters and their errors to
+        fit_params and fit_params_err. A later call to fit stops the online fit and
+        starts from its parameters. Must be called in prepare().
+        
+        Args:
+            x_name: Name of the dataset with the scanned values
+            y_name: Name of the dataset with the results
+            every: Number of new points after which the scan is fitted again
+        """
+        from acf.function.online_fit import OnlineFit
+        if self.online is not None:
+            self.online.stop()
+        # Start from the last fit of the same dataset, see fit
+        params = self.guess_cache.get(self.guess_cache.key(self.exp.Fit_Type, y_name))
+        self.online = OnlineFit(self.exp, x_name, y_name, self.exp.Fit_Type, self.exp.fit_arg, every, params=params)
+
+    def stop_online(self):
+        """
+        Stop the online fit and publish its last result.
+        
+        Returns:
+            Parameters of the last successful online fit, None if there is none
+        """
+        if self.online is None:
+            return None
+        self.online.stop()
+        params = self.online.params
+        self.online = None
+        return params
+
 # Create a global instance
 fitting_func = Fitting()
 
-def fit_function(x_data: np.ndarray, y_data: np.ndarray, fit_type: str, guess: float = None):
+def fit_function(x_data: np.ndarray, y_data: np.ndarray, fit_type: str, guess: float = None,
+                 p0: np.ndarray = None, return_errors: bool = False, **kwargs):
     """
     Main fitting function that routes to specific fitting implementations.
     
@@ -96,17 +181,24 @@ def fit_function(x_data: np.ndarray, y_data: np.ndarray, fit_type: str, guess: f
         y_data: Y-axis data points
         fit_type: Type of fitting to perform
         guess: Initial guess for fitting parameters
+        p0: Full initial parameter vector, ex. the parameters of a previous fit.
+            Replaces the guess derived from the data.
+        return_errors: Also return the standard errors of the parameters, or their
+            covariance matrix from curve_fit if 'covariance'
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds or max_nfev
         
     Returns:
-        Tuple of (success_flag, fitted_curve, parameters)
+        Tuple of (success_flag, fitted_curve, parameters), with the parameter
+        errors or covariance appended if return_errors is set
     """
-    if np.abs(guess + 999) < 1e-3:
+    if guess is not None and np.abs(guess + 999) < 1e-3:
         guess = None
         
     fit_functions = {
         'Lorentzian': find_peak_lorentzian,
         'Lorentzian_2_peaks': find_peak_lorentzian_2_peaks,
         'NLorentzian': find_peak_Nlorentzian,
+        'Gaussian': find_peak_gaussian,
         'Sin': perform_fft_and_fit,
         'Voigt': fit_voigt,
         'Voigt_Split': fit_voigt_split,
@@ -117,9 +209,286 @@ def fit_function(x_data: np.ndarray, y_data: np.ndarray, fit_type: str, guess: f
     if fit_type not in fit_functions:
         raise RuntimeError("Unsupported Fitting Type")
         
-    return fit_functions[fit_type](x_data, y_data, guess)
+    return fit_functions[fit_type](x_data, y_data, guess, p0=p0, return_errors=return_errors, **kwargs)
+
+def fit_many(data, fit_type: str, x_data: np.ndarray = None, guess: float = None,
+             max_workers: int = None) -> np.ndarray:
+    """
+    Fit many scans at once, distributed over a pool of processes.
+    
+    Each scan is fitted with fit_function, points with nan in x or y are left out.
+    Ex. a 50x60 displacement map, fitted row by row on every core:
+        results = fit_many(pmt_counts, 'Sin', x_data=rabi_t)
+        periods = 2 * np.pi / results['params'][:, 1]
+    
+    Args:
+        data: The scans, one of
+            - 2D array with one scan per row, x_data gives the x values
+            - list of (x, y) pairs
+            - list of (file, x_name, y_name) of artiq results files, read in the workers
+        fit_type: Type of fitting to perform
+        x_data: X values shared by all rows of a 2D array
+        guess: Initial guess for fitting parameters, as for fit_function
+        max_workers: Number of processes, the number of cores by default. With 1,
+            the scans are fitted in this process.
+        
+    Returns:
+        Structured array with one entry per scan and the fields success, params,
+        errors and covariance. Failed fits have success False and nan parameters.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    if fit_type not in FIT_MODELS:
+        raise RuntimeError(f"fit_many does not support fit type {fit_type}")
+
+    if isinstance(data, np.ndarray):
+        if x_data is None:
+            raise RuntimeError("x_data is required to fit the rows of an array.")
+        tasks = [(x_data, y, fit_type, guess) for y in data]
+    else:
+        tasks = [tuple(scan) + (fit_type, guess) for scan in data]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1:
+        rows = [fit_many_row(task) for task in tasks]
+    else:
+        # A few chunks per worker balance the load without sending every scan separately
+        with ProcessPoolExecutor(max_workers) as executor:
+            chunksize = max(1, len(tasks) // (4 * max_workers))
+            rows = list(executor.map(fit_many_row, tasks, chunksize=chunksize))
+
+    num_params = len(FIT_MODELS[fit_type].param_names)
+    results = np.zeros(len(rows), dtype=[
+        ('success', bool),
+        ('params', np.float64, (num_params,)),
+        ('errors', np.float64, (num_params,)),
+        ('covariance', np.float64, (num_params, num_params)),
+    ])
+    for i, (is_success, params, covariance) in enumerate(rows):
+        results['success'][i] = is_success
+        results['params'][i] = params
+        results['covariance'][i] = covariance
+        results['errors'][i] = np.sqrt(np.diag(covariance))
+    return results
+
+def fit_many_row(task: tuple) -> tuple:
+    """
+    Fit one scan of fit_many. Runs in the worker processes.
+    
+    Args:
+        task: (x, y, fit_type, guess) or (file, x_name, y_name, fit_type, guess)
+        
+    Returns:
+        Tuple of (success_flag, parameters, covariance), nan if the fit failed
+    """
+    import contextlib
+    import io
+    if len(task) == 5:
+        import h5py
+        file, x_name, y_name, fit_type, guess = task
+        with h5py.File(file, "r") as f:
+            x_data = f["datasets"][x_name][()]
+            y_data = f["datasets"][y_name][()]
+    else:
+        x_data, y_data, fit_type, guess = task
+
+    x_data = np.asarray(x_data, dtype=np.float64)
+    y_data = np.asarray(y_data, dtype=np.float64)
+    valid = ~(np.isnan(x_data) | np.isnan(y_data))
+    x_data, y_data = x_data[valid], y_data[valid]
+
+    num_params = len(FIT_MODELS[fit_type].param_names)
+    failed = (False, np.full(num_params, np.nan), np.full((num_params, num_params), np.nan))
+    # The same rule as Fitting.fit
+    if len(x_data) < num_params:
+        return failed
+
+    # The fit functions print their results, which is noise for thousands of fits
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            is_success, _, params, covariance = fit_function(x_data, y_data, fit_type, guess,
+                                                             return_errors='covariance')
+        except (RuntimeError, ValueError, TypeError, IndexError):
+            return failed
+    if not is_success or covariance is None:
+        return failed
+    return True, params, covariance
+
+def fit_result(is_success: bool, fitted_curve: np.ndarray, params: np.ndarray,
+               covariance: np.ndarray = None, return_errors: bool = False) -> tuple:
+    """
+    Build the value returned by the fit functions.
+    
+    Args:
+        is_success: Whether the fit converged
+        fitted_curve: The fitted curve, or the data if the fit failed
+        params: The fitted parameters
+        covariance: Covariance matrix of the parameters
+        return_errors: Append the standard errors of the parameters, or their
+            covariance matrix if 'covariance'
+        
+    Returns:
+        Tuple of (success_flag, fitted_curve, parameters), with the parameter
+        errors or covariance appended if return_errors is set
+    """
+    if not return_errors:
+        return is_success, fitted_curve, params
+    if return_errors == 'covariance':
+        return is_success, fitted_curve, params, covariance
+    errors = None if covariance is None else np.sqrt(np.diag(covariance))
+    return is_success, fitted_curve, params, errors
+
+def fit_curve(model, x_data: np.ndarray, y_data: np.ndarray, p0: np.ndarray,
+              return_errors: bool = False, **kwargs) -> tuple:
+    """
+    Fit a model starting from a full initial parameter vector.
+    
+    Used by the fit functions when p0 is given, ex. to warm start from a previous
+    fit, which skips deriving an initial guess from the data.
+    
+    Args:
+        model: FitModel of FIT_MODELS
+        x_data: X-axis data points
+        y_data: Y-axis data points
+        p0: Initial parameters
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit, ex. bounds
+        
+    Returns:
+        Same as fit_result
+    """
+    from scipy.optimize import curve_fit
+    try:
+        params, covariance = curve_fit(model.function, x_data, y_data, p0=p0, jac=model.jacobian, **kwargs)
+    except RuntimeError:
+        print("Fitting Failed!!")
+        return fit_result(False, y_data, None, return_errors=return_errors)
+    return fit_result(True, model.function(x_data, *params), params, covariance, return_errors)
+
+# Indices of the parameters limited by warm_start_bounds, as (centers, widths)
+WARM_START_LIMITS = {
+    'Lorentzian': ([1], [2]),
+    'Lorentzian_2_peaks': ([1, 4], [2, 5]),
+    'NLorentzian': ([1], [2]),
+    'Gaussian': ([1], [2]),
+    'Sin': ([], [1, 3]),
+    'Voigt': ([1], [2, 3]),
+    'Voigt_Split': ([1], [2, 3, 4, 5]),
+    'Exp_decay': ([], [1]),
+}
+
+def warm_start_bounds(fit_type: str, p0: np.ndarray, x_data: np.ndarray) -> tuple:
+    """
+    Get the bounds and the number of function evaluations of a fit started from known parameters.
+    
+    Centers are kept inside the scanned range and widths, rates and time constants
+    positive and widths below ten times the span of the scan. Starting close to the result,
+    the fit needs far fewer evaluations than curve_fit allows by default.
+    
+    Args:
+        fit_type: Type of fitting to perform
+        p0: Initial parameters, ex. of a previous fit
+        x_data: X-axis data points
+        
+    Returns:
+        Tuple of (p0, curve_fit keyword arguments), p0 moved inside the bounds
+    """
+    p0 = np.array(p0, dtype=np.float64)
+    lower = np.full(len(p0), -np.inf)
+    upper = np.full(len(p0), np.inf)
+
+    centers, widths = WARM_START_LIMITS.get(fit_type, ([], []))
+    x_min, x_max = np.min(x_data), np.max(x_data)
+    span = x_max - x_min
+    for i in centers:
+        lower[i], upper[i] = x_min, x_max
+    for i in widths:
+        # The angular frequency and decay time of Sin are not limited by the span
+        p0[i] = np.abs(p0[i])
+        lower[i], upper[i] = 0, np.inf if fit_type == 'Sin' else 10 * span
+
+    # Strictly inside, curve_fit rejects initial parameters on a bound
+    p0 = np.clip(p0, lower + 1e-9 * span, upper - 1e-9 * span)
+    return p0, {'bounds': (lower, upper), 'max_nfev': 50 * (len(p0) + 1)}
+
+# Indices of the peak amplitudes checked by warm_fit_plausible. The fits from the data
+# guess a peak, or a dip for NLorentzian, whose amplitude has the sign of the data.
+PEAK_AMPLITUDES = {
+    'Lorentzian': [0],
+    'Lorentzian_2_peaks': [0, 3],
+    'NLorentzian': [0],
+    'Gaussian': [0],
+    'Voigt': [0],
+    'Voigt_Split': [0],
+}
+
+def warm_fit_plausible(fit_type: str, x_data: np.ndarray, y_data: np.ndarray, params: np.ndarray) -> bool:
+    """
+    Check the parameters of a fit started from a previous fit.
+    
+    Peak amplitudes must have the sign of the peak in the data and centers must lie
+    inside the scanned range.
+    
+    Args:
+        fit_type: Type of fitting to perform
+        x_data: X-axis data points
+        y_data: Y-axis data points
+        params: Fitted parameters
+        
+    Returns:
+        False if the fit converged to something other than the line in the data
+    """
+    if fit_type == 'NLorentzian':
+        y_data = -y_data
+    # Positive if the extreme above the median is further from it than the one below
+    peak_sign = np.sign(np.max(y_data) + np.min(y_data) - 2 * np.median(y_data))
+    for i in PEAK_AMPLITUDES.get(fit_type, []):
+        if peak_sign != 0 and np.sign(params[i]) != peak_sign:
+            return False
+
+    centers, _ = WARM_START_LIMITS.get(fit_type, ([], []))
+    return all(np.min(x_data) <= params[i] <= np.max(x_data) for i in centers)
+
+def fit_warm_started(x_data: np.ndarray, y_data: np.ndarray, fit_type: str, guess: float = None,
+                     p0: np.ndarray = None, return_errors: bool = False) -> tuple:
+    """
+    Fit starting from the parameters of a previous fit, checked against a fit from the data.
+    
+    A fit started from a previous result can converge to a wrong minimum when the line
+    moved by more than its width, ex. a dip beside the scanned range. Its result is used
+    only if warm_fit_plausible accepts it and its residual is not larger than that of the
+    fit from the guess derived from the data, which is used otherwise.
+    
+    Args:
+        x_data: X-axis data points
+        y_data: Y-axis data points
+        fit_type: Type of fitting to perform
+        guess: Initial guess for fitting parameters, as for fit_function
+        p0: Parameters of a previous fit, None to fit from the data only
+        return_errors: Also return the standard errors of the parameters
+        
+    Returns:
+        Same as fit_function
+    """
+    if p0 is None:
+        return fit_function(x_data, y_data, fit_type, guess, return_errors=return_errors)
 
-def LPF_Savgol(x_data: np.ndarray, y_data: np.ndarray, guess: float = None) -> tuple[bool, np.ndarray, None]:
+    p0, bounds = warm_start_bounds(fit_type, p0, x_data)
+    warm = fit_function(x_data, y_data, fit_type, guess, p0=p0, return_errors=return_errors, **bounds)
+    try:
+        cold = fit_function(x_data, y_data, fit_type, guess, return_errors=return_errors)
+    except (RuntimeError, ValueError, TypeError, IndexError):
+        cold = fit_result(False, y_data, None, return_errors=return_errors)
+    if not warm[0] or not warm_fit_plausible(fit_type, x_data, y_data, warm[2]):
+        print("Fit from the previous parameters rejected, using the fit from the data")
+        return cold
+    if cold[0] and np.sum((y_data - cold[1])**2) < np.sum((y_data - warm[1])**2):
+        return cold
+    return warm
+
+def LPF_Savgol(x_data: np.ndarray, y_data: np.ndarray, guess: float = None,
+               p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, None]:
     """
     Apply Savitzky-Golay filter for low-pass filtering.
     
@@ -127,14 +496,19 @@ def LPF_Savgol(x_data: np.ndarray, y_data: np.ndarray, guess: float = None) -> t
         x_data: X-axis data points
         y_data: Y-axis data points
         guess: Not used in this function
+        p0: Not used in this function
+        return_errors: Append None as the parameter errors
+        kwargs: Not used in this function
         
     Returns:
         Tuple of (True, filtered_data, None)
     """
+    from scipy.signal import savgol_filter
     fitted_curve = savgol_filter(y_data, window_length=7, polyorder=3)
-    return True, fitted_curve, None
+    return fit_result(True, fitted_curve, None, return_errors=return_errors)
 
-def find_peak_lorentzian_2_peaks(x_data: np.ndarray, y_data: np.ndarray, guess: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+def find_peak_lorentzian_2_peaks(x_data: np.ndarray, y_data: np.ndarray, guess: float = None,
+                                 p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit two Lorentzian peaks with a common offset to the provided data using automatic peak detection.
     
@@ -146,18 +520,27 @@ def find_peak_lorentzian_2_peaks(x_data: np.ndarray, y_data: np.ndarray, guess:
         x_data: X-axis data points
         y_data: Y-axis data points
         guess: Not used in this function
+        p0: Initial parameters, replaces the peak detection
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
         Tuple of (success_flag, fitted_curve, parameters)
     """
+    from scipy.optimize import curve_fit
+    from scipy.signal import find_peaks
     x_data = np.array(x_data)
     y_data = np.array(y_data)
-    
+    model = FIT_MODELS['Lorentzian_2_peaks']
+
+    if p0 is not None:
+        return fit_curve(model, x_data, y_data, p0, return_errors, **kwargs)
+
     # Detect peaks in the data
     peaks, properties = find_peaks(y_data, height=0)
     if len(peaks) < 2:
         print("Less than two peaks detected. Please check your data.")
-        return False, y_data, None
+        return fit_result(False, y_data, None, return_errors=return_errors)
     
     # If more than two peaks are detected, select the two with the highest amplitudes
     if len(peaks) > 2:
@@ -180,27 +563,23 @@ def find_peak_lorentzian_2_peaks(x_data: np.ndarray, y_data: np.ndarray, guess:
                     amp2_guess, center2_guess, width_guess,
                     offset_guess]
     
-    def double_lorentzian(x, amp1, center1, width1, amp2, center2, width2, offset):
-        return (amp1 * (width1**2 / ((x - center1)**2 + width1**2)) +
-                amp2 * (width2**2 / ((x - center2)**2 + width2**2)) +
-                offset)
-    
     try:
-        params, _ = curve_fit(double_lorentzian, x_data, y_data, p0=initial_guess)
+        params, covariance = curve_fit(model.function, x_data, y_data, p0=initial_guess, jac=model.jacobian)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, y_data, None
+        return fit_result(False, y_data, None, return_errors=return_errors)
     
-    fitted_curve = double_lorentzian(x_data, *params)
+    fitted_curve = model.function(x_data, *params)
     
     print('Fitted Widths:  ', params[2], params[5])
     print('Fitted Centers: ', params[1], params[4])
     
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
 
 def find_peak_lorentzian(x_data: np.ndarray, y_data: np.ndarray, 
                         guess_peak: float = None, guess_amplitude: float = None,
-                        guess_width: float = None, guess_offset: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+                        guess_width: float = None, guess_offset: float = None,
+                        p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit a single Lorentzian peak to the data.
     
@@ -211,10 +590,21 @@ def find_peak_lorentzian(x_data: np.ndarray, y_data: np.ndarray,
         guess_amplitude: Initial guess for peak amplitude
         guess_width: Initial guess for peak width
         guess_offset: Initial guess for baseline offset
+        p0: Initial (amplitude, center, width, offset), replaces the other guesses
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
-        Tuple of (success_flag, fitted_curve, parameters)
+        Tuple of (success_flag, fitted_curve, parameters), parameters are
+        (amplitude, center, width, offset). With return_errors, a fourth entry
+        holds the standard errors of the parameters.
     """
+    from scipy.optimize import curve_fit
+    model = FIT_MODELS['Lorentzian']
+
+    if p0 is not None:
+        return fit_curve(model, x_data, y_data, p0, return_errors, **kwargs)
+
     if guess_peak is None:
         guess_peak = x_data[np.argmax(y_data)]
     if guess_amplitude is None:
@@ -236,22 +626,19 @@ def find_peak_lorentzian(x_data: np.ndarray, y_data: np.ndarray,
 
     initial_guess = [guess_amplitude, guess_peak, guess_width, guess_offset]
 
-    def lorentzian(x, amplitude, center, width, offset):
-        return amplitude * (width**2 / ((x - center)**2 + width**2)) + offset
-
     try:
-        params, _ = curve_fit(lorentzian, x_data, y_data, p0=initial_guess)
+        params, covariance = curve_fit(model.function, x_data, y_data, p0=initial_guess, jac=model.jacobian)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, y_data, params
+        return fit_result(False, y_data, None, return_errors=return_errors)
 
     fitted_amplitude, fitted_center, fitted_width, fitted_offset = params
-    fitted_curve = lorentzian(x_data, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
+    fitted_curve = model.function(x_data, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
 
     print('Fitted Width:     ', fitted_width)
     print('Fitted Frequency: ', fitted_center, ' MHz')
 
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
 
 
 
@@ -272,6 +659,7 @@ def find_peak_lorentzian_with_error(x_data: np.ndarray, y_data: np.ndarray,
     Returns:
         Tuple of (success_flag, fitted_curve, peak_position, peak_position_error)
     """
+    from scipy.optimize import curve_fit
     if guess_peak is None:
         guess_peak = x_data[np.argmax(y_data)]
     if guess_amplitude is None:
@@ -292,17 +680,15 @@ def find_peak_lorentzian_with_error(x_data: np.ndarray, y_data: np.ndarray,
         guess_offset = min(y_data)
 
     initial_guess = [guess_amplitude, guess_peak, guess_width, guess_offset]
-
-    def lorentzian(x, amplitude, center, width, offset):
-        return amplitude * (width**2 / ((x - center)**2 + width**2)) + offset
+    model = FIT_MODELS['Lorentzian']
 
     try:
-        params, covariance = curve_fit(lorentzian, x_data, y_data, p0=initial_guess)
+        params, covariance = curve_fit(model.function, x_data, y_data, p0=initial_guess, jac=model.jacobian)
         # Calculate parameter errors from covariance matrix
         param_errors = np.sqrt(np.diag(covariance))
         peak_position = params[1]  # Center parameter
         peak_position_error = param_errors[1]  # Error in the center parameter
-        fitted_curve = lorentzian(x_data, *params)
+        fitted_curve = model.function(x_data, *params)
     except RuntimeError:
         print("Fitting Failed!!")
         return False, y_data, 0.0, 0.0
@@ -331,6 +717,7 @@ def find_peak_gaussian_with_error(x_data: np.ndarray, y_data: np.ndarray,
     Returns:
         Tuple of (success_flag, fitted_curve, peak_position, peak_position_error)
     """
+    from scipy.optimize import curve_fit
     # Advanced parameter guessing for robustness
     if guess_peak is None:
         # Find peak by smoothing data first to reduce noise
@@ -371,9 +758,7 @@ def find_peak_gaussian_with_error(x_data: np.ndarray, y_data: np.ndarray,
         guess_offset = np.mean(y_sorted[:len(y_sorted)//4])  # Bottom 25%
 
     initial_guess = [guess_amplitude, guess_peak, guess_width, guess_offset]
-
-    def gaussian(x, amplitude, center, sigma, offset):
-        return amplitude * np.exp(-0.5 * ((x - center) / sigma)**2) + offset
+    model = FIT_MODELS['Gaussian']
 
     try:
         # Set reasonable bounds to improve fitting robustness
@@ -385,12 +770,13 @@ def find_peak_gaussian_with_error(x_data: np.ndarray, y_data: np.ndarray,
             [y_range * 2, np.max(x_data), x_range, np.max(y_data) + y_range]  # Upper bounds
         )
         
-        params, covariance = curve_fit(gaussian, x_data, y_data, p0=initial_guess, bounds=bounds)
+        params, covariance = curve_fit(model.function, x_data, y_data, p0=initial_guess, bounds=bounds,
+                                       jac=model.jacobian)
         # Calculate parameter errors from covariance matrix
         param_errors = np.sqrt(np.diag(covariance))
         peak_position = params[1]  # Center parameter
         peak_position_error = param_errors[1]  # Error in the center parameter
-        fitted_curve = gaussian(x_data, *params)
+        fitted_curve = model.function(x_data, *params)
     except (RuntimeError, ValueError) as e:
         print(f"Gaussian fitting failed: {e}")
         return False, y_data, 0.0, 0.0
@@ -404,7 +790,8 @@ def find_peak_gaussian_with_error(x_data: np.ndarray, y_data: np.ndarray,
 
 def find_peak_Nlorentzian(x_data: np.ndarray, y_data: np.ndarray,
                          guess_peak: float = None, guess_amplitude: float = None,
-                         guess_width: float = None, guess_offset: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+                         guess_width: float = None, guess_offset: float = None,
+                         p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit a negative Lorentzian peak to the data.
     
@@ -415,12 +802,22 @@ def find_peak_Nlorentzian(x_data: np.ndarray, y_data: np.ndarray,
         guess_amplitude: Initial guess for peak amplitude
         guess_width: Initial guess for peak width
         guess_offset: Initial guess for baseline offset
+        p0: Initial parameters of the peak fitted to -y_data, replaces the other guesses
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
-        Tuple of (success_flag, fitted_curve, parameters)
+        Tuple of (success_flag, fitted_curve, parameters), parameters are those
+        of the peak fitted to -y_data
     """
+    from scipy.optimize import curve_fit
     y_data_here = -y_data
-    
+    model = FIT_MODELS['NLorentzian']
+
+    if p0 is not None:
+        result = fit_curve(model, x_data, y_data_here, p0, return_errors, **kwargs)
+        return (result[0], -result[1]) + result[2:]
+
     if guess_peak is None:
         guess_peak = x_data[np.argmax(y_data_here)]
     if guess_amplitude is None:
@@ -442,27 +839,25 @@ def find_peak_Nlorentzian(x_data: np.ndarray, y_data: np.ndarray,
 
     initial_guess = [guess_amplitude, guess_peak, guess_width, guess_offset]
 
-    def lorentzian(x, amplitude, center, width, offset):
-        return amplitude * (width**2 / ((x - center)**2 + width**2)) + offset
-
     try:
-        params, _ = curve_fit(lorentzian, x_data, y_data_here, p0=initial_guess)
+        params, covariance = curve_fit(model.function, x_data, y_data_here, p0=initial_guess, jac=model.jacobian)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, y_data, params
+        return fit_result(False, y_data, None, return_errors=return_errors)
 
     fitted_amplitude, fitted_center, fitted_width, fitted_offset = params
     fitted_amplitude *= -1
     fitted_offset *= -1
 
-    fitted_curve = lorentzian(x_data, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
+    fitted_curve = model.function(x_data, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
 
     print('Fitted Width:     ', fitted_width)
     print('Fitted Frequency: ', fitted_center, ' MHz')
 
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
 
-def find_peak_gaussian(x_data: np.ndarray, y_data: np.ndarray, guess_peak: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+def find_peak_gaussian(x_data: np.ndarray, y_data: np.ndarray, guess_peak: float = None,
+                       p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit a Gaussian peak to the data.
     
@@ -470,10 +865,19 @@ def find_peak_gaussian(x_data: np.ndarray, y_data: np.ndarray, guess_peak: float
         x_data: X-axis data points
         y_data: Y-axis data points
         guess_peak: Initial guess for peak position
+        p0: Initial (amplitude, center, sigma, offset), replaces the other guesses
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
         Tuple of (success_flag, fitted_curve, parameters)
     """
+    from scipy.optimize import curve_fit
+    model = FIT_MODELS['Gaussian']
+
+    if p0 is not None:
+        return fit_curve(model, x_data, y_data, p0, return_errors, **kwargs)
+
     if guess_peak is None:
         guess_peak = x_data[np.argmax(y_data)]
 
@@ -490,22 +894,19 @@ def find_peak_gaussian(x_data: np.ndarray, y_data: np.ndarray, guess_peak: float
     guess_width = fwhm_guess / 2.355
     initial_guess = [guess_amplitude, guess_peak, guess_width, guess_offset]
 
-    def gaussian(x, a, x0, sigma, offset):
-        return a * np.exp(-(x - x0) ** 2 / (2 * sigma ** 2)) + offset
-
     try:
-        params, _ = curve_fit(gaussian, x_data, y_data, p0=initial_guess)
+        params, covariance = curve_fit(model.function, x_data, y_data, p0=initial_guess, jac=model.jacobian)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, y_data, None
+        return fit_result(False, y_data, None, return_errors=return_errors)
 
     fitted_amplitude, fitted_center, fitted_width, fitted_offset = params
-    fitted_curve = gaussian(x_data, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
+    fitted_curve = model.function(x_data, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
 
     print('Fitted Width:     ', fitted_width)
     print('Fitted Frequency: ', fitted_center, ' MHz')
 
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
 
 def low_pass_filter_time_domain(data: np.ndarray, dt: float) -> np.ndarray:
     """
@@ -528,7 +929,8 @@ def low_pass_filter_time_domain(data: np.ndarray, dt: float) -> np.ndarray:
     
     return filtered_data.real
 
-def perform_fft_and_fit(time: np.ndarray, signal: np.ndarray, guess: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+def perform_fft_and_fit(time: np.ndarray, signal: np.ndarray, guess: float = None,
+                        p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Perform FFT analysis and fit a damped sine wave to the data.
     
@@ -536,10 +938,20 @@ def perform_fft_and_fit(time: np.ndarray, signal: np.ndarray, guess: float = Non
         time: Time points
         signal: Signal values
         guess: Initial phase guess
+        p0: Initial (A, omega, phi, tau, c), replaces the FFT estimate
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
         Tuple of (success_flag, fitted_curve, parameters)
     """
+    from scipy.fft import fft, fftfreq
+    from scipy.optimize import curve_fit
+    model = FIT_MODELS['Sin']
+
+    if p0 is not None:
+        return fit_curve(model, time, signal, p0, return_errors, **kwargs)
+
     smoothed_signal = low_pass_filter_time_domain(signal, time[1]-time[0])
     
     if guess is None:
@@ -558,9 +970,6 @@ def perform_fft_and_fit(time: np.ndarray, signal: np.ndarray, guess: float = Non
 
     print("Estimated Dominant Frequency: ", dominant_frequency, 'MHz')
 
-    def sine_function(t, A, omega, phi, tau, c):
-        return A * np.sin(omega * t + phi) * np.exp(-t / tau) + c
-
     initial_guess = [
         np.ptp(smoothed_signal) / 2,
         2 * np.pi * dominant_frequency,
@@ -570,10 +979,10 @@ def perform_fft_and_fit(time: np.ndarray, signal: np.ndarray, guess: float = Non
     ]
 
     try:
-        params, _ = curve_fit(sine_function, time, signal, p0=initial_guess)
+        params, covariance = curve_fit(model.function, time, signal, p0=initial_guess, jac=model.jacobian)
         fitted_amplitude, fitted_omega, fitted_phase, fitted_tau, fitted_offset = params
         fitted_frequency = fitted_omega / (2 * np.pi)
-        fitted_signal = sine_function(time, fitted_amplitude, fitted_omega, fitted_phase, fitted_tau, fitted_offset)
+        fitted_signal = model.function(time, fitted_amplitude, fitted_omega, fitted_phase, fitted_tau, fitted_offset)
 
         print('Fitted Amplitude: ', fitted_amplitude)
         print('Fitted Frequency: ', fitted_frequency, ' MHz')
@@ -581,12 +990,13 @@ def perform_fft_and_fit(time: np.ndarray, signal: np.ndarray, guess: float = Non
         print('PI time:          ', 1 / fitted_frequency / 2, ' us')
         print('Tau:              ', fitted_tau, ' us')
 
-        return True, fitted_signal, params
+        return fit_result(True, fitted_signal, params, covariance, return_errors)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, None, None
+        return fit_result(False, None, None, return_errors=return_errors)
 
-def fit_voigt(time: np.ndarray, signal: np.ndarray, guess_peak: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+def fit_voigt(time: np.ndarray, signal: np.ndarray, guess_peak: float = None,
+              p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit a Voigt profile to the data.
     
@@ -594,36 +1004,41 @@ def fit_voigt(time: np.ndarray, signal: np.ndarray, guess_peak: float = None) ->
         time: Time points
         signal: Signal values
         guess_peak: Initial guess for peak position
+        p0: Initial (amplitude, center, sigma, gamma), replaces the other guesses
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
         Tuple of (success_flag, fitted_curve, parameters)
     """
+    from scipy.optimize import curve_fit
     print("Fitting Voigt!")
+    model = FIT_MODELS['Voigt']
+
+    if p0 is not None:
+        return fit_curve(model, time, signal, p0, return_errors, **kwargs)
 
     if guess_peak is None:
         guess_peak = time[np.argmax(signal)]
 
-    def voigt(x, amplitude, center, sigma, gamma):
-        z = ((x - center) + 1j*gamma) / (sigma * np.sqrt(2))
-        return amplitude * np.real(wofz(z)) / (sigma * np.sqrt(2*np.pi))
-
     initial_guess = [np.max(signal), time[np.argmax(signal)], 1, 1]
 
     try:
-        params, _ = curve_fit(voigt, time, signal, p0=initial_guess)
+        params, covariance = curve_fit(model.function, time, signal, p0=initial_guess, jac=model.jacobian)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, signal, None
+        return fit_result(False, signal, None, return_errors=return_errors)
 
     fitted_amplitude, fitted_center, fitted_width, fitted_offset = params
-    fitted_curve = voigt(time, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
+    fitted_curve = model.function(time, fitted_amplitude, fitted_center, fitted_width, fitted_offset)
 
     print('Fitted Width:     ', fitted_width)
     print('Fitted Frequency: ', fitted_center, ' MHz')
 
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
 
-def fit_voigt_split(time: np.ndarray, signal: np.ndarray, guess_peak: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+def fit_voigt_split(time: np.ndarray, signal: np.ndarray, guess_peak: float = None,
+                    p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit a split Voigt profile to the data.
     
@@ -631,40 +1046,42 @@ def fit_voigt_split(time: np.ndarray, signal: np.ndarray, guess_peak: float = No
         time: Time points
         signal: Signal values
         guess_peak: Initial guess for peak position
+        p0: Initial (amplitude, center, sigma1, sigma2, gamma, transition_width),
+            replaces the other guesses
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
         Tuple of (success_flag, fitted_curve, parameters)
     """
+    from scipy.optimize import curve_fit
     print("Fitting Splitted Voigt!")
+    model = FIT_MODELS['Voigt_Split']
+
+    if p0 is not None:
+        return fit_curve(model, time, signal, p0, return_errors, **kwargs)
 
     if guess_peak is None:
         guess_peak = time[np.argmax(signal)]
-    
-    def smooth_transition(x, center, sigma1, sigma2, width=1):
-        return sigma1 + (sigma2 - sigma1) / (1 + np.exp(-(x - center) / width))
-
-    def voigt(x, amplitude, center, sigma1, sigma2, gamma, transition_width):
-        sigma = smooth_transition(x, center, sigma1, sigma2, transition_width)
-        z = ((x - center) + 1j * gamma) / (sigma * np.sqrt(2))
-        return amplitude * np.real(wofz(z)) / (sigma * np.sqrt(2 * np.pi))
 
     initial_guess = [np.max(signal), time[np.argmax(signal)], 1, 1, 1, 0.1]
 
     try:
-        params, _ = curve_fit(voigt, time, signal, p0=initial_guess)
+        params, covariance = curve_fit(model.function, time, signal, p0=initial_guess)
     except RuntimeError:
         print("Fitting Failed!!")
-        return False, signal, None
+        return fit_result(False, signal, None, return_errors=return_errors)
 
     fitted_amplitude, fitted_center, fitted_width1, fitted_width2, fitted_gamma, fitted_tr = params
-    fitted_curve = voigt(time, fitted_amplitude, fitted_center, fitted_width1, fitted_width2, fitted_gamma, fitted_tr)
+    fitted_curve = model.function(time, fitted_amplitude, fitted_center, fitted_width1, fitted_width2, fitted_gamma, fitted_tr)
 
     print('Fitted Width:     ', fitted_width1, ' ', fitted_width2)
     print('Fitted Frequency: ', fitted_center, ' MHz')
 
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
 
-def fit_exp_decay(time: np.ndarray, signal: np.ndarray, guess_tau: float = None) -> tuple[bool, np.ndarray, np.ndarray]:
+def fit_exp_decay(time: np.ndarray, signal: np.ndarray, guess_tau: float = None,
+                  p0: np.ndarray = None, return_errors: bool = False, **kwargs) -> tuple[bool, np.ndarray, np.ndarray]:
     """
     Fit an exponential decay to the data.
     
@@ -672,11 +1089,19 @@ def fit_exp_decay(time: np.ndarray, signal: np.ndarray, guess_tau: float = None)
         time: Time points
         signal: Signal values
         guess_tau: Initial guess for decay time constant
+        p0: Initial (amplitude, tau, offset), replaces the other guesses
+        return_errors: Also return the standard errors of the parameters
+        kwargs: Passed to curve_fit when p0 is given, ex. bounds
         
     Returns:
         Tuple of (success_flag, fitted_curve, parameters)
     """
+    from scipy.optimize import curve_fit
     print("Fitting Exponential Decay!")
+    model = FIT_MODELS['Exp_decay']
+
+    if p0 is not None:
+        return fit_curve(model, time, signal, p0, return_errors, **kwargs)
 
     if guess_tau is None:
         offset_guess = np.min(signal)
@@ -686,21 +1111,18 @@ def fit_exp_decay(time: np.ndarray, signal: np.ndarray, guess_tau: float = None)
         guess_tau = time[idx] if time[idx] > 0 else 20
         print("Estimated guess_tau:", guess_tau)
 
-    def exp_decay(x, amplitude, tau, offset):
-        return amplitude * np.exp(-x / tau) + offset
-
     initial_guess = [np.max(signal) - np.min(signal), guess_tau, np.min(signal)]
 
     try:
-        params, _ = curve_fit(exp_decay, time, signal, p0=initial_guess)
+        params, covariance = curve_fit(model.function, time, signal, p0=initial_guess, jac=model.jacobian)
     except RuntimeError:
         print("Fitting Failed!!!!!!!!!")
-        return False, signal, None
+        return fit_result(False, signal, None, return_errors=return_errors)
 
     fitted_amplitude, fitted_tau, fitted_offset = params
-    fitted_curve = exp_decay(time, fitted_amplitude, fitted_tau, fitted_offset)
+    fitted_curve = model.function(time, fitted_amplitude, fitted_tau, fitted_offset)
 
     print('Fitted Tau:     ', fitted_tau)
     print('Fitted Offset:  ', fitted_offset)
 
-    return True, fitted_curve, params
+    return fit_result(True, fitted_curve, params, covariance, return_errors)
@@ -0,0 +1,151 @@
+"""This class fits a scan in a background thread while it is being taken.
+
+An OnlineFit watches the result dataset of a scan. Whenever every new valid points were
+written, the x and y datasets are copied and handed to a worker thread, which fits them
+with fit_warm_started. Every fit starts from the parameters of the previous successful
+fit, or of an earlier scan for the first one, so refitting a slightly larger scan takes a
+few iterations only. That result is checked against a fit from the data, so a fit that
+converged to a wrong minimum is replaced and not carried into the next refits.
+
+The fit never runs in the thread handling the RPCs of the kernel. The worker thread only
+stores its result, the datasets are written from the thread that writes the scan data,
+the next time the watched dataset changes, as artiq datasets must not be written from
+other threads. The results are stored in the datasets:
+    fit_signal        the fitted curve at every taken point, nan elsewhere
+    fit_params        the fitted parameters
+    fit_params_err    the standard errors of the fitted parameters
+    fit_points        the number of points of the last fit
+
+Use Fitting.enable_online instead of creating an OnlineFit directly.
+"""
+
+import threading
+import numpy as np
+
+from acf.function.fitting import fit_warm_started
+
+class OnlineFit:
+
+    def __init__(self, exp, x_name, y_name, fit_type, guess=None, every=5, fit_name="fit_signal", params=None):
+        """Create an OnlineFit and start its worker thread.
+
+        Args:
+            exp (_ACFExperiment): The calling experiment.
+            x_name (str): Name of the dataset with the scanned values.
+            y_name (str): Name of the dataset with the results, nan for points not taken.
+            fit_type (str): One of FITTING_TYPES.
+            guess (float): The fit argument passed to fit_function.
+            every (int): Number of new points after which the scan is fitted again.
+            fit_name (str): Name of the dataset with the fitted curve.
+            params (array[float]): Initial parameters of the first fit, ex. of an earlier scan.
+        """
+        self.exp = exp
+        self.x_name = x_name
+        self.y_name = y_name
+        self.fit_type = fit_type
+        self.guess = guess
+        self.every = max(1, int(every))
+        self.fit_name = fit_name
+
+        # Parameters of the last successful fit, the initial parameters of the next one
+        self.params = params
+        self.errors = None
+
+        # Number of valid points when the last fit was requested
+        self.requested_points = 0
+
+        # (x, y) waiting to be fitted and the finished result waiting to be published,
+        # both replaced by newer ones and guarded by lock
+        self.lock = threading.Lock()
+        self.pending = None
+        self.result = None
+
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.work, name=f"OnlineFit {y_name}", daemon=True)
+        self.thread.start()
+
+        self.exp.experiment_data.watch(y_name, self.data_changed)
+
+    def data_changed(self, index_mut, data):
+        """Publish the last finished fit and request a new one if enough points were added.
+
+        Called by ExperimentData after every write to the watched dataset, the whole
+        dataset is read as points may be written in any order.
+        """
+        self.publish()
+
+        y = np.array(self.exp.get_dataset(self.y_name), dtype=np.float64)
+        valid = ~np.isnan(y)
+        num_points = np.count_nonzero(valid)
+        if num_points - self.requested_points < self.every or self.stopped:
+            return
+
+        self.requested_points = num_points
+        x = np.array(self.exp.get_dataset(self.x_name), dtype=np.float64)
+        with self.lock:
+            self.pending = (x, y, valid)
+        self.wake.set()
+
+    def work(self):
+        """Fit the latest requested data until stopped. Runs in the worker thread."""
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if self.stopped:
+                return
+
+            with self.lock:
+                pending, self.pending = self.pending, None
+            if pending is None:
+                continue
+
+            x, y, valid = pending
+            try:
+                is_success, fitted_curve, params, errors = fit_warm_started(
+                    x[valid], y[valid], self.fit_type, self.guess,
+                    p0=self.params, return_errors=True
+                )
+            except (RuntimeError, ValueError, TypeError) as e:
+                # Ex. fewer points than parameters
+                print(f"Online fit failed: {e}")
+                is_success = False
+
+            if not is_success:
+                # The previous parameters may be far off, start the next fit from scratch
+                self.params = None
+                continue
+
+            self.params = params
+            self.errors = errors
+            curve = np.full(len(x), np.nan)
+            curve[valid] = fitted_curve
+            with self.lock:
+                self.result = (curve, params, errors, np.count_nonzero(valid))
+
+    def publish(self):
+        """Write the last finished fit to the datasets, if there is a new one."""
+        with self.lock:
+            result, self.result = self.result, None
+        if result is None:
+            return
+
+        curve, params, errors, num_points = result
+        self.exp.set_dataset(self.fit_name, curve, broadcast=True)
+        if params is not None:
+            self.exp.set_dataset("fit_params", np.array(params), broadcast=True)
+        if errors is not None:
+            self.exp.set_dataset("fit_params_err", np.array(errors), broadcast=True)
+        self.exp.set_dataset("fit_points", num_points, broadcast=True)
+
+    def stop(self):
+        """Stop fitting and publish the last finished fit.
+
+        Waits for a fit that is still running, so its parameters can start the final fit.
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+        self.publish()
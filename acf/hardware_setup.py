@@ -1,11 +1,21 @@
 """This class provides a single place to make all hardware definitions,
 which can then be used in all experiments."""
-from artiq.experiment import kernel
+from artiq.experiment import kernel, rpc, TBool
 from acf.utils import get_config_dir
+from acf.dds_profiles import DDSProfiles
 import json
+import time
 
 class HardwareSetup:
 
+    # Persistent dataset recording when the Urukul boards were last initialized
+    urukul_init_dataset = "__urukul_init__"
+
+    # Allowed difference in seconds between two estimates of the core device boot time,
+    # plus the allowed drift of the core device clock relative to the host clock
+    boot_time_tolerance = 1.0
+    clock_drift = 20e-6
+
     def __init__(self):
         """Create a HardwareSetup instance for a given hardware setup.
 
@@ -93,7 +103,14 @@ class HardwareSetup:
         self.dds_devices = []
         self.cpld_devices = []
 
+        # DDSProfiles shared by all sequences, keys are DDS names
+        self.dds_profiles = {}
+
+        # Initialize the Urukul boards in setup_run even if they were initialized before
+        self.force_urukul_init = False
+
         self.exp.setattr_device("core")
+        self.exp.setattr_device("core_dma")
         self.exp.setattr_device("scheduler")
         for board_num in sorted(self.urukul_boards):
             cpld_name = f"urukul{board_num}_cpld"
@@ -110,6 +127,13 @@ class HardwareSetup:
             if self.hardware[device_name]["type"] == "dds":
                 self.dds_devices.append(self.get_device(device_name))
 
+        # State of the last initialization, see urukul_init_required
+        self.urukul_device_names = sorted(
+            [f"urukul{board_num}_cpld" for board_num in self.urukul_boards]
+            + [device["device_str"] for device in self.hardware.values() if device["type"] == "dds"]
+        )
+        self.urukul_init_state = self.exp.get_dataset(self.urukul_init_dataset, default=None, archive=False)
+
 
     def get_device(self, name):
         """Get a particular device.
@@ -121,6 +145,23 @@ class HardwareSetup:
         """
         return getattr(self.exp, self.hardware[name]["device_str"])
 
+    def get_dds_profiles(self, name):
+        """Get the profile manager of a DDS.
+
+        All sequences share one DDSProfiles per DDS, so they know which profiles
+        were already loaded by another sequence.
+
+        Args:
+            name (str): The name of the DDS, ex. "dds_729_dp".
+
+        Returns: The DDSProfiles instance.
+        """
+        if self.hardware[name]["type"] != "dds":
+            raise RuntimeError(f"Device '{name}' is not a dds.")
+        if name not in self.dds_profiles:
+            self.dds_profiles[name] = DDSProfiles(self.get_device(name))
+        return self.dds_profiles[name]
+
     def add_device_attributes(self, obj):
         """Add all of the device objects as attributes to another object.
 
@@ -144,6 +185,61 @@ class HardwareSetup:
         """Get all CPLD devices for Urukul boards."""
         return self.cpld_devices
 
+    def boot_time(self, rtio_counter):
+        """Estimate the host time at which the core device booted.
+
+        The RTIO counter starts at zero when the core device boots and is not reset by
+        core.reset(), so the boot time stays the same until the next reboot.
+
+        Args:
+            rtio_counter (int): The RTIO counter read from the core device.
+
+        Returns: The boot time in seconds since the epoch.
+        """
+        return time.time() - self.exp.core.mu_to_seconds(rtio_counter)
+
+    def urukul_init_required(self, rtio_counter) -> TBool:
+        """Check whether the Urukul CPLDs and DDS channels need to be initialized.
+
+        The boards keep their configuration until the core device reboots, so they are
+        only initialized if the core device booted since the last initialization, the
+        Urukul devices in the hardware config changed or force_urukul_init is set.
+        Otherwise setup_run only writes the CPLD configuration registers, which a run
+        that aborted may have left on another profile.
+
+        Args:
+            rtio_counter (int): The RTIO counter read from the core device.
+
+        Returns: True if the boards need to be initialized.
+        """
+        state = self.urukul_init_state
+        if (self.force_urukul_init or state is None
+                or state["devices"] != self.urukul_device_names):
+            return True
+
+        # Allow for the drift of the core device clock since the state was recorded
+        boot_time = self.boot_time(rtio_counter)
+        tolerance = self.boot_time_tolerance + self.clock_drift * (time.time() - state["time"])
+        if abs(boot_time - state["boot_time"]) > tolerance:
+            return True
+
+        self.record_urukul_init(rtio_counter)
+        return False
+
+    @rpc(flags={"async"})
+    def record_urukul_init(self, rtio_counter):
+        """Record that the Urukul boards are initialized for the running core device.
+
+        Args:
+            rtio_counter (int): The RTIO counter read from the core device.
+        """
+        self.urukul_init_state = {
+            "boot_time": self.boot_time(rtio_counter),
+            "time": time.time(),
+            "devices": self.urukul_device_names
+        }
+        self.exp.set_dataset(self.urukul_init_dataset, self.urukul_init_state, persist=True, archive=False)
+
     def shutdown(self):
         """Turn off output on all of the hardware."""
         pass
@@ -0,0 +1,145 @@
+"""This class streams raw data to an HDF5 file while the experiment runs.
+
+Datasets created with ExperimentData.stream_nd_dataset are not kept as artiq datasets.
+Their data is written chunk by chunk to an extensible, compressed HDF5 dataset and the
+file is flushed regularly, so long scans neither hold all raw shots in memory nor lose
+them if the experiment crashes. The master only holds the summary datasets.
+
+The file is written next to artiq's own results file, ex.
+results/2025-05-24/00/000012345-raw.h5, and its name is stored in the dataset
+"<name>_stream_file" of every streamed dataset.
+"""
+
+import time
+import numpy as np
+
+def unwritten_value(dtype):
+    """Get the value of the entries of a streamed dataset that were not written.
+
+    nan for floats, -1 for signed and the largest value for unsigned integers, so
+    a count of 0 is not mistaken for a missing shot.
+
+    Args:
+        dtype (type): Type of the stored values.
+
+    Returns: The fill value of the HDF5 dataset.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return np.nan
+    if np.issubdtype(dtype, np.signedinteger):
+        return -1
+    if np.issubdtype(dtype, np.unsignedinteger):
+        return np.iinfo(dtype).max
+    return 0
+
+class HDF5Stream:
+
+    def __init__(self, file_name, flush_interval=5.0):
+        """Create a HDF5Stream. The file is opened when the first dataset is added.
+
+        Args:
+            file_name (str): Path of the HDF5 file.
+            flush_interval (float): Time in seconds between flushes of the file to disk.
+        """
+        self.file_name = file_name
+        self.flush_interval = flush_interval
+        self.file = None
+        self.last_flush = time.monotonic()
+
+        # HDF5 datasets and their full shapes, keys are dataset names
+        self.datasets = {}
+        self.shapes = {}
+
+    def add_dataset(self, dataset, dtype=np.float64, compression="lz4", chunk_rows=None):
+        """Create an extensible HDF5 dataset.
+
+        The first axis grows as data arrives, the remaining axes have the size given
+        by the NDDataset.
+
+        Args:
+            dataset (NDDataset): The dataset.
+            dtype (type): Type of the stored values.
+            compression (str): "lz4", "gzip" or None. lz4 needs the hdf5plugin package
+                and falls back to gzip when it is not installed.
+            chunk_rows (int): Number of entries of the first axis per HDF5 chunk.
+                Defaults to enough rows for about 64 kB per chunk.
+        """
+        # h5py and hdf5plugin are only imported once something is streamed, so
+        # experiments without streamed datasets do not pay for them at start
+        import h5py
+        try:
+            # Registers the lz4 filter with HDF5
+            import hdf5plugin
+        except ImportError:
+            hdf5plugin = None
+
+        if self.file is None:
+            self.file = h5py.File(self.file_name, "a")
+
+        row_shape = dataset.shape[1:]
+        row_size = int(np.prod(row_shape))
+        if chunk_rows is None:
+            chunk_rows = max(1, 65536 // (row_size * np.dtype(dtype).itemsize))
+
+        if compression == "lz4" and hdf5plugin is not None:
+            compression_args = dict(hdf5plugin.LZ4())
+        elif compression in ["lz4", "gzip"]:
+            compression_args = { "compression": "gzip", "compression_opts": 4 }
+        else:
+            compression_args = {}
+
+        fillvalue = unwritten_value(dtype)
+        self.datasets[dataset.name] = self.file.create_dataset(
+            dataset.name,
+            shape=(0,) + row_shape,
+            maxshape=(None,) + row_shape,
+            chunks=(chunk_rows,) + row_shape,
+            dtype=dtype,
+            fillvalue=fillvalue,
+            **compression_args
+        )
+        self.datasets[dataset.name].attrs["shape"] = dataset.shape
+        self.datasets[dataset.name].attrs["unwritten"] = fillvalue
+        self.shapes[dataset.name] = dataset.shape
+
+    def write(self, name, index_mut, data):
+        """Write data, growing the first axis as needed.
+
+        Args:
+            name (str): The name of the dataset.
+            index_mut (int or tuple): Index in the format of artiq's mutate_dataset,
+                i.e. an integer or a tuple of (start, stop) pairs.
+            data (?): The value or array of values.
+        """
+        h5_dataset = self.datasets[name]
+
+        if not isinstance(index_mut, tuple):
+            index_mut = ((int(index_mut), int(index_mut) + 1),)
+
+        stop = min(index_mut[0][1], self.shapes[name][0])
+        if stop > h5_dataset.shape[0]:
+            h5_dataset.resize(stop, axis=0)
+
+        target = tuple(slice(*e) for e in index_mut)
+        target_shape = tuple(
+            len(range(*s.indices(n))) for s, n in zip(target, h5_dataset.shape)
+        ) + h5_dataset.shape[len(target):]
+        if 0 not in target_shape:
+            h5_dataset[target] = np.broadcast_to(data, target_shape)
+
+        if time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Flush all written data to disk."""
+        if self.file is not None:
+            self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """Flush and close the file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.datasets = {}
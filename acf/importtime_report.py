@@ -0,0 +1,180 @@
+"""This module reports the cold-start import cost of experiment files.
+
+Every experiment file is imported in a fresh interpreter started with
+python -X importtime, the same way the artiq worker imports it when the dashboard
+rebuilds arguments or an experiment is submitted. The report lists the total import
+time of each file and the top-level packages that cost the most.
+
+A report can be saved as JSON and used as the baseline of a later run, files that got
+slower by more than the given tolerance are marked so regressions are visible.
+
+Example:
+    python -m acf.importtime_report repository --save importtime.json
+    python -m acf.importtime_report repository --baseline importtime.json
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Written to stderr by the child right before the file is executed
+START_MARKER = "importtime_report: start"
+
+# Line of -X importtime output: "import time: <self us> | <cumulative us> | <indent><name>"
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$")
+
+# Executed in the child interpreter. Imports the file as artiq's file_import does:
+# the directory of the file is put on the path and the file is run as a new module.
+IMPORT_SCRIPT = """
+import importlib.util, sys, time
+path = sys.argv[1]
+sys.path.insert(0, sys.argv[2])
+sys.path.insert(0, sys.argv[3])
+spec = importlib.util.spec_from_file_location("file_import_report", path)
+module = importlib.util.module_from_spec(spec)
+sys.stderr.write("%s\\n" % sys.argv[4])
+sys.stderr.flush()
+start = time.perf_counter()
+spec.loader.exec_module(module)
+print(time.perf_counter() - start)
+"""
+
+def parse_importtime(output):
+    """Parse the output of python -X importtime.
+
+    Args:
+        output (str): The stderr of the interpreter.
+
+    Returns: List of (name, level, self time, cumulative time), times in seconds.
+    """
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((name, len(indent) // 2, int(self_us) * 1e-6, int(cumulative_us) * 1e-6))
+    return imports
+
+def measure_file(path, repo_dir, python=sys.executable):
+    """Import a file in a fresh interpreter and measure its import time.
+
+    Args:
+        path (Path): The experiment file.
+        repo_dir (Path): The root of the repository, put on the path so acf imports work.
+        python (str): The interpreter to use.
+
+    Returns: Dictionary with the wall time of the import in seconds ("total"), the
+        cumulative time per top-level package ("packages") and the error message if
+        the import failed ("error").
+    """
+    process = subprocess.run(
+        [python, "-X", "importtime", "-c", IMPORT_SCRIPT,
+         str(path), str(repo_dir), str(path.parent), START_MARKER],
+        capture_output=True, text=True, cwd=repo_dir
+    )
+
+    # Only imports made while the file is executed are counted, not those of the
+    # interpreter start up
+    imports = parse_importtime(process.stderr.partition(START_MARKER)[2])
+    packages = {}
+    for name, level, _, cumulative in imports:
+        if level == 0:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + cumulative
+
+    result = { "packages": packages, "error": None }
+    if process.returncode != 0:
+        result["total"] = None
+        error_lines = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        result["error"] = error_lines[-1] if error_lines else f"exit code {process.returncode}"
+    else:
+        result["total"] = float(process.stdout.strip().splitlines()[-1])
+    return result
+
+def find_experiment_files(paths):
+    """Find the python files to measure.
+
+    Args:
+        paths (list[str]): Files or folders, folders are searched recursively.
+
+    Returns: Sorted list of paths.
+    """
+    files = set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.update(p for p in path.rglob("*.py") if "__pycache__" not in p.parts)
+        else:
+            files.add(path)
+    return sorted(p.resolve() for p in files)
+
+def report(paths, repo_dir, repeat=1, top=5, baseline=None, tolerance=0.2):
+    """Measure all files and print the report.
+
+    Args:
+        paths (list[str]): Files or folders to measure.
+        repo_dir (Path): The root of the repository.
+        repeat (int): Number of fresh interpreters per file, the median time is reported.
+        top (int): Number of most expensive packages listed per file.
+        baseline (dict): A report saved by an earlier run, used to flag regressions.
+        tolerance (float): Relative slow down above which a file is flagged.
+
+    Returns: Dictionary of file paths relative to repo_dir to their results.
+    """
+    results = {}
+    for path in find_experiment_files(paths):
+        name = os.path.relpath(path, repo_dir)
+        runs = [measure_file(path, repo_dir) for _ in range(repeat)]
+        totals = [run["total"] for run in runs if run["total"] is not None]
+        result = runs[-1]
+        result["total"] = statistics.median(totals) if totals else None
+        results[name] = result
+
+        if result["total"] is None:
+            print(f"{name}\n    failed: {result['error']}")
+            continue
+
+        line = f"{name}\n    {result['total']*1e3:8.1f} ms"
+        if baseline is not None and baseline.get(name, {}).get("total"):
+            old = baseline[name]["total"]
+            change = (result["total"] - old) / old
+            line += f"  ({change:+.0%} vs {old*1e3:.1f} ms)"
+            if change > tolerance:
+                line += "  REGRESSION"
+        print(line)
+
+        packages = sorted(result["packages"].items(), key=lambda item: -item[1])[:top]
+        for package, cumulative in packages:
+            print(f"        {cumulative*1e3:8.1f} ms  {package}")
+
+    measured = [result["total"] for result in results.values() if result["total"] is not None]
+    if measured:
+        print(f"\n{len(measured)} files, median {statistics.median(measured)*1e3:.1f} ms, "
+              f"max {max(measured)*1e3:.1f} ms")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the cold-start import time of experiment files.")
+    parser.add_argument("paths", nargs="*", default=["repository"], help="Experiment files or folders")
+    parser.add_argument("--repo-dir", default=".", help="Root of the repository")
+    parser.add_argument("--repeat", type=int, default=1, help="Fresh interpreters per file")
+    parser.add_argument("--top", type=int, default=5, help="Most expensive packages listed per file")
+    parser.add_argument("--save", default=None, help="Save the report as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slow down flagged as regression")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = report(args.paths, Path(args.repo_dir).resolve(), args.repeat, args.top, baseline, args.tolerance)
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
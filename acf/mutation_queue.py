@@ -0,0 +1,75 @@
+"""This class coalesces dataset mutations on the host before they are broadcast.
+
+Asynchronous dataset RPCs from a kernel arrive on the host one value at a time. Instead
+of forwarding each of them as its own mutation, consecutive writes to neighbouring
+positions of the same dataset are merged and sent as a single slice mutation.
+"""
+
+import time
+import numpy as np
+
+class MutationQueue:
+
+    def __init__(self, mutate, max_pending=100, max_delay=0.2):
+        """Create a MutationQueue.
+
+        Args:
+            mutate (function): Called as mutate(name, index, values) to send a
+                mutation, ex. EnvExperiment.mutate_dataset.
+            max_pending (int): Maximum number of values merged into one mutation.
+            max_delay (float): Maximum time in seconds values are held back. Checked
+                whenever a new value arrives.
+        """
+        self.mutate = mutate
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+
+        # Mutations being built, one per dataset. Keys are dataset names, values are
+        # dictionaries with the NDDataset, the flat start offset, the values and
+        # the time the first value arrived.
+        self.pending = {}
+
+    def push(self, dataset, offset, value):
+        """Queue a single value.
+
+        Args:
+            dataset (NDDataset): The dataset.
+            offset (int): Flat, row-major offset of the value.
+            value (?): The value.
+        """
+        name = dataset.name
+        mutation = self.pending.get(name)
+        if mutation is not None:
+            end = mutation["start"] + len(mutation["values"])
+            if offset != end or offset % dataset.row_length == 0:
+                self.flush(name)
+                mutation = None
+
+        if mutation is None:
+            mutation = {
+                "dataset": dataset,
+                "start": offset,
+                "values": [],
+                "first_time": time.monotonic()
+            }
+            self.pending[name] = mutation
+
+        mutation["values"].append(value)
+
+        if (len(mutation["values"]) >= self.max_pending
+                or time.monotonic() - mutation["first_time"] > self.max_delay):
+            self.flush(name)
+
+    def flush(self, name=None):
+        """Send pending mutations.
+
+        Args:
+            name (str): Only send the mutation of this dataset. Set to None to send all.
+        """
+        names = list(self.pending) if name is None else [name]
+        for name in names:
+            mutation = self.pending.pop(name, None)
+            if mutation is None:
+                continue
+            index_mut = mutation["dataset"].row_slice(mutation["start"], len(mutation["values"]))
+            self.mutate(name, index_mut, np.array(mutation["values"]))
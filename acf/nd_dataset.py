@@ -0,0 +1,118 @@
+"""This class describes the layout of a list or n-dimensional dataset.
+
+ExperimentData keeps one NDDataset per dataset it creates. The NDDataset holds the shape,
+the row-major strides and a flat cursor for appending, and turns indices into the
+(start, stop) tuples used by artiq's mutate_dataset.
+"""
+
+import numpy as np
+
+class NDDataset:
+
+    def __init__(self, name, shape, broadcast=False):
+        """Create a NDDataset.
+
+        Args:
+            name (str): The name of the dataset.
+            shape (array[int]): Array of lengths of axes. Ex. [50, 10, 5]
+            broadcast (bool): True if the data is being broadcasted.
+        """
+        self.name = name
+        self.shape = tuple(int(n) for n in shape)
+        self.ndim = len(self.shape)
+        self.size = int(np.prod(self.shape))
+        self.broadcast = broadcast
+
+        # Number of elements to skip to move one step along each axis
+        self.strides = tuple(int(np.prod(self.shape[i + 1:])) for i in range(self.ndim))
+
+        # Flat, row-major offset at which the next appended value is written
+        self.curr_loc = 0
+
+    @property
+    def row_length(self):
+        """Length of the last axis."""
+        return self.shape[-1]
+
+    def offset(self, index):
+        """Get the flat, row-major offset of an element.
+
+        Args:
+            index (array[int]): One index per axis.
+
+        Returns: The offset.
+        """
+        return sum(int(i) * s for i, s in zip(index, self.strides))
+
+    def unravel(self, offset):
+        """Get the index of an element from its flat, row-major offset.
+
+        Args:
+            offset (int): The offset.
+
+        Returns: Tuple with one index per axis.
+        """
+        index = []
+        for stride in self.strides:
+            index.append(offset // stride)
+            offset %= stride
+        return tuple(index)
+
+    def slice_index(self, index):
+        """Build a mutate_dataset index from an index of any rank.
+
+        Each entry of index is either an integer, selecting a single position along
+        its axis, or a (start, stop) pair. Axes after the last entry are taken whole,
+        so for a dataset with shape [50, 10, 5] the index [3] selects a [10, 5] block
+        and [3, (2, 6)] selects a [4, 5] block.
+
+        Args:
+            index (int or array): The index.
+
+        Returns: Tuple of (start, stop) pairs, one per given axis.
+        """
+        if not isinstance(index, (list, tuple, np.ndarray)):
+            index = [index]
+        if len(index) > self.ndim:
+            raise RuntimeError(f"Index {index} has more axes than dataset {self.name}.")
+
+        index_mut = []
+        for i in index:
+            if isinstance(i, slice):
+                index_mut.append(i.indices(self.shape[len(index_mut)])[:2])
+            elif isinstance(i, (list, tuple, np.ndarray)):
+                index_mut.append((int(i[0]), int(i[1])))
+            else:
+                index_mut.append((int(i), int(i) + 1))
+        return tuple(index_mut)
+
+    def row_slice(self, offset, length):
+        """Build a mutate_dataset index for consecutive values that lie in a single row.
+
+        Args:
+            offset (int): Flat, row-major offset of the first value.
+            length (int): Number of consecutive values.
+
+        Returns: Tuple of (start, stop) pairs, one per axis.
+        """
+        start = self.unravel(offset)
+        index_mut = tuple((i, i + 1) for i in start[:-1])
+        return index_mut + ((start[-1], start[-1] + length),)
+
+    def row_runs(self, offset, length):
+        """Split a range of consecutive values at row boundaries.
+
+        Args:
+            offset (int): Flat, row-major offset of the first value.
+            length (int): Number of consecutive values.
+
+        Returns: List of (index_mut, start, stop), where index_mut is the row_slice of
+            the run and start, stop delimit the run within the range.
+        """
+        runs = []
+        start = 0
+        while start < length:
+            stop = min(length, start + self.row_length - (offset + start) % self.row_length)
+            runs.append((self.row_slice(offset + start, stop - start), start, stop))
+            start = stop
+        return runs
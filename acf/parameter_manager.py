@@ -21,6 +21,48 @@ class ParameterManager:
             exp (EnvExperiment): The calling experiment class.
         """
         self.exp = exp
+
+        # Snapshot of parameters read so far. Keys are parameter names without the
+        # prefix, values are (value, metadata) tuples.
+        self.cache = {}
+
+    def load(self, names):
+        """Read a set of parameters and their metadata into the cache in one pass.
+
+        Artiq has no call to list all datasets from an experiment, so the names are
+        given by the caller, ex. all parameters used by the registered sequences.
+        Parameters that do not exist are skipped and raise on get_param.
+
+        Args:
+            names (iterable[str]): Parameter names. Do not include the __param__ prefix.
+        """
+        for name in set(names):
+            if name not in self.cache:
+                self._fetch(name)
+
+    def _fetch(self, name, if_archive=False):
+        """Read a parameter and its metadata from the dataset database into the cache.
+
+        Returns: The (value, metadata) tuple, or None if the parameter does not exist.
+        """
+        key = self.dataset_prefix + name
+        value = self.exp.get_dataset(key, default=None, archive=if_archive)
+        if value is None:
+            return None
+
+        self.cache[name] = (value, self.exp.get_dataset_metadata(key) or {})
+        return self.cache[name]
+
+    def invalidate(self, name=None):
+        """Drop a parameter from the cache so it is read again on next use.
+
+        Args:
+            name (str): The name of the parameter. Set to None to drop all parameters.
+        """
+        if name is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(name, None)
     
     def get_param(self, name, if_archive=False):
         """Get a parameter.
@@ -30,14 +72,16 @@ class ParameterManager:
         
         Args:
             name (str): The name of the parameter. Do not include the __param__ prefix.
+            if_archive (bool): Read from the dataset database and archive the value
+                with the results, instead of using the cache.
         
         Returns: The value of the parameter.
         """
-        param_dataset = self.exp.get_dataset(self.dataset_prefix + name, default=None, archive=if_archive)
-        if param_dataset is None:
-        	raise RuntimeError(f"parameter {name} does not exist.")
+        if if_archive or name not in self.cache:
+            if self._fetch(name, if_archive) is None:
+                raise RuntimeError(f"parameter {name} does not exist.")
         
-        return param_dataset
+        return self.cache[name][0]
     
     def get_float_param(self, name, if_archive=False)->float:
         """Get a parameter.
@@ -50,11 +94,7 @@ class ParameterManager:
         
         Returns: The value of the parameter.
         """
-        param_dataset = self.exp.get_dataset(self.dataset_prefix + name, default=None, archive=if_archive)
-        if param_dataset is None:
-        	raise RuntimeError(f"parameter {name} does not exist.")
-        
-        return param_dataset
+        return self.get_param(name, if_archive)
     
     def get_param_units(self, name):
         """Get the units for a parameter.
@@ -64,8 +104,11 @@ class ParameterManager:
         
         Returns: The units of the parameter.
         """
-        param_metadata = self.exp.get_dataset_metadata(self.dataset_prefix + name)
-        return param_metadata.get("unit")
+        if name not in self.cache:
+            if self._fetch(name) is None:
+                return self.exp.get_dataset_metadata(self.dataset_prefix + name).get("unit")
+
+        return self.cache[name][1].get("unit")
     
     def set_param(self, name, value, units=None):
         """Set a parameter.
@@ -76,4 +119,4 @@ class ParameterManager:
             units (str): The Artiq units for the parameter.
         """
         self.exp.set_dataset(self.dataset_prefix + name, value, unit=units, persist=True)
-
+        self.invalidate(name)
@@ -0,0 +1,391 @@
+"""This module maintains an SQLite index of the HDF5 files in the artiq results folder.
+
+Every results file is indexed once by RID with its experiment class, start time, scalar
+arguments, scanned argument ranges, the names and shapes of its datasets and the
+__param__ values archived with it. Queries run against the index only and return
+ResultRecord objects that open their file lazily, so finding a set of runs does not
+walk the results folder.
+
+Example:
+    index = ResultsIndex("results")
+    index.update()
+    week_ago = time.time() - 7*24*3600
+    runs = index.query(class_name="RabiFreqScan", since=week_ago,
+                       covers=("scan_freq_729_dp", index.param_value(-1, "qubit/S1_2_D3_2")))
+    frequencies = runs[0].load("frequencies_MHz")
+
+The index can also be updated from the command line:
+    python -m acf.results_index results
+
+Nothing updates the index automatically. Artiq writes the results file after analyze()
+returns, so an experiment can not index its own run; call update() or run the command
+above, ex. periodically, before querying recent runs.
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import h5py
+
+try:
+    from sipyco import pyon
+except ImportError:
+    pyon = None
+
+# Results files are named {rid:09}-{class_name}.h5 in results/{date}/{hour}/
+RESULTS_FILE_RE = re.compile(r"^(\d+)-(.+)\.h5$")
+
+PARAM_PREFIX = "__param__"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    rid INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    class_name TEXT,
+    file TEXT,
+    start_time REAL,
+    run_time REAL
+);
+CREATE TABLE IF NOT EXISTS arguments (
+    rid INTEGER, name TEXT, value REAL, text TEXT
+);
+CREATE TABLE IF NOT EXISTS scans (
+    rid INTEGER, name TEXT, ty TEXT, start REAL, stop REAL, npoints INTEGER
+);
+CREATE TABLE IF NOT EXISTS params (
+    rid INTEGER, name TEXT, value REAL
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    rid INTEGER, name TEXT, shape TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_class ON runs (class_name, start_time);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (start_time);
+CREATE INDEX IF NOT EXISTS arguments_rid ON arguments (rid, name);
+CREATE INDEX IF NOT EXISTS scans_name ON scans (name, rid);
+CREATE INDEX IF NOT EXISTS params_name ON params (name, rid);
+CREATE INDEX IF NOT EXISTS datasets_rid ON datasets (rid, name);
+"""
+
+def _decode(value):
+    """Decode a pyon string as written by artiq, ex. the expid."""
+    if isinstance(value, bytes):
+        value = value.decode()
+    if pyon is not None:
+        return pyon.decode(value)
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+def _read_meta(f, key):
+    """Read a run attribute, stored as an attribute or a dataset depending on the artiq version."""
+    if key in f.attrs:
+        return f.attrs[key]
+    if key in f:
+        return f[key][()]
+    return None
+
+def _walk(f, group):
+    """List (name, dataset) of all datasets below a group, including nested groups."""
+    found = []
+    if group in f:
+        f[group].visititems(
+            lambda name, item: found.append((name, item)) if isinstance(item, h5py.Dataset) else None
+        )
+    return found
+
+def _as_float(value):
+    """Convert a scalar to float, or return None if it is not a number."""
+    if isinstance(value, (bool, np.bool_)):
+        return float(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return None
+
+class ResultRecord:
+
+    def __init__(self, rid, path, class_name, start_time, run_time):
+        """A run found by ResultsIndex.query. The file is only opened when data is loaded.
+
+        Args:
+            rid (int): The RID of the run.
+            path (str): Path of the results file.
+            class_name (str): The experiment class.
+            start_time (float): Unix time at which the run started.
+            run_time (float): Unix time at which the run method finished.
+        """
+        self.rid = rid
+        self.path = path
+        self.class_name = class_name
+        self.start_time = start_time
+        self.run_time = run_time
+
+    def __repr__(self):
+        return f"ResultRecord(rid={self.rid}, class_name={self.class_name!r}, path={self.path!r})"
+
+    def open(self):
+        """Open the results file read-only.
+
+        Returns: The h5py File. Close it when done, ex. with a with statement.
+        """
+        return h5py.File(self.path, "r")
+
+    def load(self, name, group="datasets", mmap=True):
+        """Load a dataset.
+
+        Contiguous, uncompressed datasets (the artiq default) are memory-mapped
+        instead of read, so only the parts that are used are loaded from disk.
+
+        Args:
+            name (str): The name of the dataset.
+            group (str): "datasets" or "archive".
+            mmap (bool): Set to False to always read the data into memory.
+
+        Returns: The data as a numpy array, or a scalar.
+        """
+        with self.open() as f:
+            h5_dataset = f[group][name]
+            offset = h5_dataset.id.get_offset()
+            if (mmap and offset is not None and h5_dataset.chunks is None
+                    and h5_dataset.shape and h5_dataset.dtype.kind in "biuf"):
+                return np.memmap(self.path, dtype=h5_dataset.dtype, mode="r",
+                                 offset=offset, shape=h5_dataset.shape)
+            return h5_dataset[()]
+
+class ResultsIndex:
+
+    def __init__(self, results_dir="results", index_file=None):
+        """Create or open a ResultsIndex.
+
+        Args:
+            results_dir (str): The artiq results folder.
+            index_file (str): Path of the SQLite file. Defaults to index.sqlite in
+                the results folder.
+        """
+        self.results_dir = Path(results_dir)
+        if index_file is None:
+            index_file = self.results_dir / "index.sqlite"
+        self.db = sqlite3.connect(str(index_file))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """Close the index."""
+        self.db.close()
+
+    def update(self, full=False):
+        """Index new and modified results files.
+
+        Only the hour folders of the last indexed day and later are searched, unless
+        full is set.
+
+        Args:
+            full (bool): Search the whole results folder.
+
+        Returns: Number of files indexed.
+        """
+        known = dict(self.db.execute("SELECT path, mtime FROM runs"))
+
+        last_day = None
+        if not full and known:
+            last_day = max(Path(path).parent.parent.name for path in known)
+
+        num_indexed = 0
+        for day_dir in sorted(self.results_dir.iterdir()):
+            if not day_dir.is_dir() or (last_day is not None and day_dir.name < last_day):
+                continue
+            for hour_dir in sorted(day_dir.iterdir()):
+                if not hour_dir.is_dir():
+                    continue
+                for entry in os.scandir(hour_dir):
+                    match = RESULTS_FILE_RE.match(entry.name)
+                    if match is None or entry.name.endswith("-raw.h5"):
+                        continue
+                    mtime = entry.stat().st_mtime
+                    if known.get(entry.path) == mtime:
+                        continue
+                    try:
+                        self.add_file(entry.path, mtime)
+                    except (OSError, KeyError) as e:
+                        print(f"Could not index {entry.path}: {e}")
+                        continue
+                    num_indexed += 1
+        self.db.commit()
+        return num_indexed
+
+    def add_file(self, path, mtime=None):
+        """Index a single results file, replacing earlier entries for its RID.
+
+        Args:
+            path (str): Path of the results file.
+            mtime (float): Modification time of the file.
+        """
+        if mtime is None:
+            mtime = os.stat(path).st_mtime
+
+        with h5py.File(path, "r") as f:
+            rid = int(_read_meta(f, "rid"))
+            expid = _read_meta(f, "expid")
+            expid = _decode(expid) if expid is not None else {}
+
+            run_row = (
+                rid, str(path), mtime,
+                expid.get("class_name", RESULTS_FILE_RE.match(Path(path).name).group(2)),
+                expid.get("file"),
+                _as_float(_read_meta(f, "start_time")),
+                _as_float(_read_meta(f, "run_time"))
+            )
+
+            argument_rows = []
+            scan_rows = []
+            for name, value in expid.get("arguments", {}).items():
+                if isinstance(value, dict) and "selected" in value:
+                    scan = value.get(value["selected"], {})
+                    if value["selected"] == "NoScan":
+                        start = stop = scan.get("value")
+                    elif value["selected"] == "ExplicitScan":
+                        sequence = scan.get("sequence") or [None]
+                        start, stop = min(sequence), max(sequence)
+                    elif value["selected"] == "CenterScan":
+                        center, span = _as_float(scan.get("center")), _as_float(scan.get("span"))
+                        start = stop = None
+                        if center is not None and span is not None:
+                            start, stop = center - span / 2, center + span / 2
+                    else:
+                        start, stop = scan.get("start"), scan.get("stop")
+                    scan_rows.append((rid, name, value["selected"], _as_float(start),
+                                      _as_float(stop), scan.get("npoints", scan.get("repetitions"))))
+                else:
+                    argument_rows.append((rid, name, _as_float(value), str(value)))
+
+            # Dataset names with slashes, like all parameters, are stored as nested groups
+            param_rows = []
+            for name, h5_dataset in _walk(f, "archive"):
+                if name.startswith(PARAM_PREFIX) and h5_dataset.shape == ():
+                    param_rows.append((rid, name[len(PARAM_PREFIX):], _as_float(h5_dataset[()])))
+
+            dataset_rows = []
+            for name, h5_dataset in _walk(f, "datasets"):
+                dataset_rows.append((rid, name, json.dumps(h5_dataset.shape)))
+
+        for table in ["runs", "arguments", "scans", "params", "datasets"]:
+            self.db.execute(f"DELETE FROM {table} WHERE rid = ?", (rid,))
+        self.db.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)", run_row)
+        self.db.executemany("INSERT INTO arguments VALUES (?, ?, ?, ?)", argument_rows)
+        self.db.executemany("INSERT INTO scans VALUES (?, ?, ?, ?, ?, ?)", scan_rows)
+        self.db.executemany("INSERT INTO params VALUES (?, ?, ?)", param_rows)
+        self.db.executemany("INSERT INTO datasets VALUES (?, ?, ?)", dataset_rows)
+
+    def query(self,
+            class_name=None,
+            since=None,
+            until=None,
+            arguments=None,
+            covers=None,
+            params=None,
+            has_dataset=None,
+            limit=None):
+        """Find runs matching all of the given conditions.
+
+        Args:
+            class_name (str): Experiment class name, ex. "RabiFreqScan".
+            since (float): Earliest start time, unix time.
+            until (float): Latest start time, unix time.
+            arguments (dict): Argument names and the values they must have.
+            covers (tuple): (argument name, value). The scan of the argument must
+                include the value, ex. ("scan_freq_729_dp", 233.7*MHz).
+            params (dict): Parameter names and (min, max) ranges their archived
+                values must lie in.
+            has_dataset (str): Name of a dataset the run must contain.
+            limit (int): Maximum number of runs returned.
+
+        Returns: List of ResultRecord, newest first.
+        """
+        conditions = []
+        values = []
+        if class_name is not None:
+            conditions.append("class_name = ?")
+            values.append(class_name)
+        if since is not None:
+            conditions.append("start_time >= ?")
+            values.append(since)
+        if until is not None:
+            conditions.append("start_time <= ?")
+            values.append(until)
+        for name, value in (arguments or {}).items():
+            if _as_float(value) is not None:
+                conditions.append("rid IN (SELECT rid FROM arguments WHERE name = ? AND value = ?)")
+                values += [name, _as_float(value)]
+            else:
+                conditions.append("rid IN (SELECT rid FROM arguments WHERE name = ? AND text = ?)")
+                values += [name, str(value)]
+        if covers is not None:
+            conditions.append(
+                "rid IN (SELECT rid FROM scans WHERE name = ? "
+                "AND min(start, stop) <= ? AND max(start, stop) >= ?)"
+            )
+            values += [covers[0], covers[1], covers[1]]
+        for name, (low, high) in (params or {}).items():
+            conditions.append("rid IN (SELECT rid FROM params WHERE name = ? AND value BETWEEN ? AND ?)")
+            values += [name, low, high]
+        if has_dataset is not None:
+            conditions.append("rid IN (SELECT rid FROM datasets WHERE name = ?)")
+            values.append(has_dataset)
+
+        sql = "SELECT rid, path, class_name, start_time, run_time FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY start_time DESC, rid DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            values.append(limit)
+
+        return [ResultRecord(*row) for row in self.db.execute(sql, values)]
+
+    def param_value(self, rid, name):
+        """Get the archived value of a parameter.
+
+        Args:
+            rid (int): The RID of the run, or -1 for the newest run that archived
+                the parameter.
+            name (str): The name of the parameter. Do not include the __param__ prefix.
+
+        Returns: The value, or None if it was not archived.
+        """
+        if rid < 0:
+            row = self.db.execute(
+                "SELECT value FROM params WHERE name = ? ORDER BY rid DESC LIMIT 1", (name,)
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                "SELECT value FROM params WHERE rid = ? AND name = ?", (rid, name)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def arguments(self, rid):
+        """Get the scalar arguments of a run.
+
+        Args:
+            rid (int): The RID of the run.
+
+        Returns: Dictionary of argument names to values (floats where possible).
+        """
+        rows = self.db.execute("SELECT name, value, text FROM arguments WHERE rid = ?", (rid,))
+        return { name: text if value is None else value for name, value, text in rows }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the index of the artiq results folder.")
+    parser.add_argument("results_dir", nargs="?", default="results", help="The artiq results folder")
+    parser.add_argument("--index-file", default=None, help="Path of the SQLite index")
+    parser.add_argument("--full", action="store_true", help="Search the whole results folder")
+    args = parser.parse_args()
+
+    index = ResultsIndex(args.results_dir, args.index_file)
+    print(f"Indexed {index.update(full=args.full)} files.")
+    index.close()
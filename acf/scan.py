@@ -0,0 +1,408 @@
+"""This class runs a thresholded PMT scan over a list of N-dimensional scan points.
+
+Scan experiments all take the same steps for every scan point: a number of shots, the
+collision detection and ion rescue when a shot is dark, and the statistics of the point
+sent to the host. A Scan does these steps, the experiment only defines one shot as a
+kernel method
+
+    @kernel
+    def scan_shot(self, point) -> TInt32:
+
+which runs the pulse sequence for the scan point and returns the PMT counts of the
+readout. point holds the value of every axis of the scan point, in the order the axes
+were given. A shot that should not be counted, ex. when the line trigger timed out,
+returns -1 and is repeated.
+
+The statistics of every point are kept on the core device by a CountAccumulator and sent
+with one RPC per point. The datasets are written by scan point index, so the points can
+be taken in any order:
+    "sequential"   in the order given
+    "shuffled"     in a random order, slow drifts do not show up as features of the scan
+    "interleaved"  every n-th point in n passes over the scan with n = sqrt(num_points),
+                   a coarse picture of the whole scan is available early on
+
+With adaptive sampling a thresholded scan stops taking shots at a point once the
+confidence interval of its dark fraction is narrower than target_width, after at least
+min_samples shots. Points near 0 or 1 then need far fewer shots than points near 0.5.
+The shots saved are kept in a budget that later points may use, up to
+max_samples_factor * samples_per_point shots each, so the scan never takes more shots
+than num_points * samples_per_point.
+
+Usage:
+    def build(self):
+        add_scan_arguments(self)
+
+    def prepare(self):
+        self.scan = Scan(self, [("rabi_t", self.scan_rabi_t.sequence, us)],
+                         self.samples_per_time, self.threshold_pmt_count,
+                         result_name="pmt_counts_avg_thresholded",
+                         order=self.scan_order,
+                         target_width=self.target_width if self.adaptive_sampling else None,
+                         interval=self.confidence_interval)
+
+    @kernel
+    def run(self):
+        self.setup_run()
+        self.scan.run()
+"""
+
+import numpy as np
+from artiq.experiment import kernel, delay, s, ms, us, TBool, TFloat
+from artiq.experiment import BooleanValue, EnumerationValue, NumberValue
+
+# Orders in which the scan points can be taken
+SCAN_ORDERS = ["sequential", "shuffled", "interleaved"]
+
+# Confidence intervals of the dark fraction used for adaptive sampling. The Jeffreys
+# interval uses the quantiles of the Beta posterior, tabulated on the host.
+CONFIDENCE_INTERVALS = ["wilson", "jeffreys"]
+
+def add_scan_arguments(exp, group="Scan"):
+    """Add the arguments scan_order, adaptive_sampling, target_width, confidence_interval and track_threshold.
+
+    Args:
+        exp (_ACFExperiment): The calling experiment.
+        group (str): The argument group.
+    """
+    exp.setattr_argument("scan_order", EnumerationValue(SCAN_ORDERS, default="sequential"), group=group)
+    exp.setattr_argument(
+        "adaptive_sampling", BooleanValue(False), group=group,
+        tooltip="Stop sampling a scan point once its dark fraction is known to target_width"
+    )
+    exp.setattr_argument(
+        "target_width",
+        NumberValue(default=0.1, min=0.001, max=1.0, precision=3),
+        tooltip="Full width of the confidence interval of the dark fraction",
+        group=group
+    )
+    exp.setattr_argument("confidence_interval", EnumerationValue(CONFIDENCE_INTERVALS, default="wilson"), group=group)
+    exp.setattr_argument(
+        "track_threshold", BooleanValue(False), group=group,
+        tooltip="Estimate the readout threshold from all shots and update readout/threshold when it moves"
+    )
+
+def scan_order(num_points, order="sequential", seed=None):
+    """Get the order in which the scan points are taken.
+
+    Args:
+        num_points (int): Number of scan points.
+        order (str): One of SCAN_ORDERS.
+        seed (int): Seed of the shuffled order, random if None.
+
+    Returns: Array of the scan point indices in the order they are taken.
+    """
+    if order == "sequential":
+        return np.arange(num_points, dtype=np.int32)
+    if order == "shuffled":
+        return np.random.default_rng(seed).permutation(num_points).astype(np.int32)
+    if order == "interleaved":
+        stride = max(1, int(np.ceil(np.sqrt(num_points))))
+        return np.concatenate([np.arange(k, num_points, stride) for k in range(stride)]).astype(np.int32)
+    raise RuntimeError(f"Unknown scan order {order}, must be one of {SCAN_ORDERS}.")
+
+def jeffreys_stop_table(max_samples, target_width, z=1.96):
+    """Get the number of dark shots up to which a point is done with the Jeffreys interval.
+
+    The equal-tailed interval of the Beta(k + 1/2, n - k + 1/2) posterior is used, with
+    the bound at 0 for k = 0 and at 1 for k = n. Its width is symmetric in k and n - k, so
+    a point with n shots and k dark shots is done when min(k, n - k) <= table[n].
+
+    Args:
+        max_samples (int): Largest number of shots of a point.
+        target_width (float): Full width of the interval at which a point is done.
+        z (float): Width of the interval in standard deviations, 1.96 for 95%.
+
+    Returns: Array of max_samples + 1 entries, -1 where no point is done.
+    """
+    from scipy.stats import beta, norm
+
+    tail = norm.sf(z)
+    table = np.full(max_samples + 1, -1, dtype=np.int32)
+    for n in range(1, max_samples + 1):
+        k = np.arange(n // 2 + 1)
+        lower = np.where(k > 0, beta.ppf(tail, k + 0.5, n - k + 0.5), 0.0)
+        upper = np.where(k < n, beta.isf(tail, k + 0.5, n - k + 0.5), 1.0)
+        # Only the leading run of narrow intervals, the point is never done past a wide one
+        narrow = np.cumprod(upper - lower <= target_width)
+        table[n] = np.count_nonzero(narrow) - 1
+    return table
+
+class Scan:
+
+    def __init__(self, exp, axes, samples_per_point, threshold,
+                 result_name="pmt_counts_avg_thresholded",
+                 counts_name="pmt_counts",
+                 grid=True,
+                 order="sequential",
+                 seed=None,
+                 thresholding=True,
+                 negate_mean=False,
+                 collision_detection=False,
+                 max_rescue_tries=60,
+                 save_samples=True,
+                 target_width=None,
+                 interval="wilson",
+                 z=1.96,
+                 min_samples=20,
+                 max_samples_factor=2.0,
+                 capacity=None,
+                 track_threshold=False,
+                 threshold_tolerance=1.0):
+        """Create the scan points and datasets. Must be called in prepare().
+
+        Args:
+            exp (_ACFExperiment): The calling experiment, must define the kernel scan_shot.
+            axes (list): (dataset name, values, scale) per axis, scale is optional. The
+                dataset <name> holds the value of the axis divided by scale for every
+                scan point, ex. ("rabi_t", times, us).
+            samples_per_point (int): Number of shots per scan point.
+            threshold (float): Shots with counts below the threshold are dark.
+            result_name (str): Name of the dataset with the result of each point.
+            counts_name (str): Prefix of the CountAccumulator datasets.
+            grid (bool): Scan every combination of the axis values. If False all axes
+                must have the same length and their values are scanned together.
+            order (str): Order of the scan points, one of SCAN_ORDERS.
+            seed (int): Seed of the shuffled order.
+            thresholding (bool): The result is the fraction of dark shots. Otherwise it
+                is the mean counts.
+            negate_mean (bool): Store the negative mean counts if not thresholding, so
+                that dark resonances are peaks.
+            collision_detection (bool): Check the ion after every dark shot and rescue
+                it if it is gone. The dark shot is then repeated.
+            max_rescue_tries (int): Number of rescue attempts before the scan stops.
+            save_samples (bool): Also save the counts of every shot in <counts_name>.
+            target_width (float): Full width of the confidence interval of the dark
+                fraction at which a point is done. None to take samples_per_point
+                shots at every point.
+            interval (str): Confidence interval, one of CONFIDENCE_INTERVALS. "jeffreys"
+                tabulates the exact Beta quantiles with scipy in prepare().
+            z (float): Width of the interval in standard deviations, 1.96 for 95%.
+            min_samples (int): Number of shots before a point can stop early.
+            max_samples_factor (float): Points may use saved shots up to this many
+                times samples_per_point.
+            capacity (int): Number of scan points the datasets are created for, for
+                scans that add points while running. Defaults to the number of points.
+            track_threshold (bool): Estimate the threshold from the histogram of all
+                shots while scanning and set the parameter readout/threshold when it
+                differs by more than threshold_tolerance. The scan itself keeps using
+                threshold.
+            threshold_tolerance (float): See track_threshold, in counts.
+        """
+        self.exp = exp
+        self.core = exp.core
+        self.seq = exp.seq
+        self.experiment_data = exp.experiment_data
+
+        names = [axis[0] for axis in axes]
+        values = [np.asarray(axis[1], dtype=float) for axis in axes]
+        scales = [axis[2] if len(axis) > 2 else 1.0 for axis in axes]
+
+        if grid:
+            points = np.stack(np.meshgrid(*values, indexing="ij"), axis=-1).reshape(-1, len(axes))
+        else:
+            if len(set(len(v) for v in values)) != 1:
+                raise RuntimeError("All axes of a scan that is not a grid must have the same length.")
+            points = np.stack(values, axis=-1)
+
+        if capacity is None:
+            capacity = len(points)
+        if capacity < len(points):
+            raise RuntimeError(f"Scan capacity {capacity} is smaller than the number of points {len(points)}.")
+        self.capacity = np.int32(capacity)
+        self.num_points = np.int32(len(points))
+        self.num_axes = np.int32(len(axes))
+        # Flat, row-major [capacity, num_axes] values of the scan points
+        self.points = np.full(capacity * len(axes), np.nan)
+        self.points[:points.size] = points.ravel()
+        self.order = np.arange(capacity, dtype=np.int32)
+        self.order[:len(points)] = scan_order(len(points), order, seed)
+        # Values of the scan point currently taken, passed to scan_shot
+        self.point = np.zeros(len(axes))
+
+        self.samples_per_point = np.int32(samples_per_point)
+        self.threshold = float(threshold)
+        self.result_name = result_name
+        self.thresholding = thresholding
+        self.negate_mean = negate_mean
+        self.collision_detection = collision_detection
+        self.max_rescue_tries = np.int32(max_rescue_tries)
+
+        # Set when the ion could not be rescued
+        self.ion_lost = False
+
+        self.adaptive = target_width is not None
+        if self.adaptive and not thresholding:
+            raise RuntimeError("Adaptive sampling requires thresholding.")
+        if interval not in CONFIDENCE_INTERVALS:
+            raise RuntimeError(f"Unknown confidence interval {interval}, must be one of {CONFIDENCE_INTERVALS}.")
+        self.target_width = float(target_width) if self.adaptive else 0.0
+        self.jeffreys = interval == "jeffreys"
+        self.z = float(z)
+        self.min_samples = np.int32(min_samples)
+        self.max_samples = np.int32(samples_per_point)
+        if self.adaptive:
+            self.max_samples = np.int32(max(samples_per_point, int(samples_per_point * max_samples_factor)))
+        # The Beta quantiles are not available on the core device
+        self.jeffreys_max_dark = np.zeros(1, dtype=np.int32)
+        if self.adaptive and self.jeffreys:
+            self.jeffreys_max_dark = jeffreys_stop_table(int(self.max_samples), self.target_width, self.z)
+        # Shots saved by points that stopped early and not yet used by later points
+        self.spare_shots = np.int32(0)
+
+        # Axis values are known in advance, only the results are sent during the scan
+        self.axis_names = names
+        self.axis_scales = scales
+        for i, (name, scale) in enumerate(zip(names, scales)):
+            self.experiment_data.set_list_dataset(name, capacity, broadcast=True)
+            self.exp.set_dataset(name, self.points[i::len(axes)] / scale, broadcast=True)
+        self.experiment_data.set_list_dataset(result_name, capacity, broadcast=True)
+        self.exp.set_dataset(f"{counts_name}_order", self.order[:len(points)])
+
+        num_bins = 50
+        self.counts = self.experiment_data.accumulate_counts(
+            counts_name, capacity, threshold, num_bins=num_bins,
+            samples_per_point=int(self.max_samples) if save_samples else None
+        )
+
+        self.threshold_estimator = None
+        if track_threshold:
+            from utils_func.otsu import StreamingThreshold
+            self.threshold_estimator = StreamingThreshold(
+                num_bins, parameter_manager=exp.parameter_manager, tolerance=threshold_tolerance
+            )
+            self.threshold_estimator.watch_histograms(self.experiment_data, f"{counts_name}_hist")
+
+        self.kernel_invariants = {
+            "exp", "core", "seq", "experiment_data", "capacity", "num_axes", "axis_names", "axis_scales",
+            "samples_per_point", "threshold", "result_name", "thresholding", "negate_mean",
+            "collision_detection", "max_rescue_tries", "counts", "adaptive", "target_width",
+            "jeffreys", "jeffreys_max_dark", "z", "min_samples", "max_samples"
+        }
+
+    @kernel
+    def run(self) -> TBool:
+        """Take all scan points.
+
+        Returns: False if the ion was lost and the scan stopped early.
+        """
+        self.take_points(0, self.num_points)
+        self.seq.ion_store.run()
+        return not self.ion_lost
+
+    @kernel
+    def take_points(self, start, stop) -> TBool:
+        """Take the scan points from position start to stop of the scan order.
+
+        Args:
+            start (int): First position in the scan order.
+            stop (int): Position after the last point taken.
+
+        Returns: False if the ion was lost.
+        """
+        for i in range(start, stop):
+            point_i = self.order[i]
+            for j in range(self.num_axes):
+                self.point[j] = self.points[point_i * self.num_axes + j]
+            self.counts.set_point(point_i)
+
+            self.core.break_realtime()
+            self.seq.ion_store.run()
+            delay(500*us)
+
+            ion_good = self.take_samples()
+
+            # Also reached when the ion was lost, so the shots taken are kept
+            self.push_point(point_i)
+            if not ion_good:
+                print("Ion Lost!!!")
+                self.ion_lost = True
+                return False
+            delay(1*ms)
+        return True
+
+    @kernel
+    def take_samples(self) -> TBool:
+        """Take the shots of the current scan point.
+
+        Returns: False if the ion was lost.
+        """
+        sample_num = 0
+        max_samples = min(self.samples_per_point + self.spare_shots, self.max_samples)
+        while sample_num < max_samples:
+            if self.adaptive and sample_num >= self.min_samples:
+                if self.interval_done():
+                    break
+
+            num_pmt_pulses = self.exp.scan_shot(self.point)
+            if num_pmt_pulses < 0:
+                continue
+
+            if self.collision_detection and num_pmt_pulses < self.threshold:
+                if not self.ion_present():
+                    if not self.rescue_ion():
+                        return False
+                    continue
+
+            self.counts.add(num_pmt_pulses)
+            sample_num += 1
+
+        self.spare_shots += self.samples_per_point - sample_num
+        return True
+
+    @kernel
+    def interval_done(self) -> TBool:
+        """Check whether the confidence interval of the dark fraction of the current point is within target_width."""
+        if self.jeffreys:
+            n = self.counts.shots
+            k = n - self.counts.above
+            return min(k, n - k) <= self.jeffreys_max_dark[n]
+        return self.wilson_width() <= self.target_width
+
+    @kernel
+    def wilson_width(self) -> TFloat:
+        """Get the full width of the Wilson score interval of the dark fraction of the current point."""
+        n = float(self.counts.shots)
+        k = n - float(self.counts.above)
+        z2 = self.z * self.z
+        p = k / n
+        return 2.0 * self.z * (p * (1.0 - p) / n + z2 / (4.0 * n * n))**0.5 / (1.0 + z2 / n)
+
+    @kernel
+    def ion_present(self) -> TBool:
+        """Check whether the ion is still bright after a dark shot."""
+        self.seq.repump_854.run()
+        self.seq.doppler_cool.run()
+        num_pmt_pulses = self.seq.readout_397.run()
+        self.seq.ion_store.run()
+        delay(20*us)
+        return num_pmt_pulses >= self.threshold
+
+    @kernel
+    def rescue_ion(self) -> TBool:
+        """Cool the ion until it is bright again.
+
+        Returns: False if it is still dark after max_rescue_tries attempts.
+        """
+        for i in range(self.max_rescue_tries):
+            self.seq.ion_store.run()
+            delay(0.2*s)
+            self.seq.doppler_cool.run()
+            if self.seq.readout_397.run() >= self.threshold:
+                return True
+        return False
+
+    @kernel
+    def push_point(self, point_i):
+        """Send the result and statistics of a scan point to the host.
+
+        Args:
+            point_i (int): The index of the scan point.
+        """
+        if self.thresholding:
+            result = 1.0 - self.counts.above_fraction()
+        elif self.negate_mean:
+            result = -self.counts.mean()
+        else:
+            result = self.counts.mean()
+        self.experiment_data.insert_nd_dataset_async(self.result_name, [point_i], result)
+        self.counts.push()
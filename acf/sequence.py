@@ -1,7 +1,9 @@
 # A class representing a sequence of actions to control hardware
 
-from artiq.experiment import kernel, HasEnvironment
+from artiq.experiment import kernel, HasEnvironment, now_mu, at_mu, TInt64
 from artiq.language import NumberValue
+from acf.dma_trace import DMATrace
+import numpy as np
 
 class Sequence:
 
@@ -19,6 +21,20 @@ class Sequence:
         # Group name for arguments to the GUI
         self.group_name = self.__class__.__name__
 
+        # Attributes converted to DDS machine units on the host, see add_mu_setting
+        self.mu_settings = []
+
+        # Pulse trains replayed with core DMA, see add_dma_trace
+        self.dma_traces = []
+
+        # DDSs switched with preloaded profiles, see add_dds_profiles
+        self.profile_dds_names = []
+
+        # Timeline budget seen by ensure_slack: the smallest slack in machine units and
+        # the number of times the timeline had to be moved forward
+        self.min_slack_mu = np.int64(2**62)
+        self.slack_resyncs = np.int32(0)
+
         ## Class attributes to be set in initialize
         # The running experiment
         self.exp = None
@@ -68,6 +84,93 @@ class Sequence:
     
 
 
+    @kernel
+    def ensure_slack(self, min_slack_mu: TInt64 = 125000):
+        """Make sure the timeline is at least min_slack_mu ahead of the RTIO counter.
+
+        Unlike core.break_realtime followed by a delay, this keeps any slack already
+        accumulated and only moves the timeline forward when less than min_slack_mu
+        is left. The smallest slack seen and the number of moves are kept in
+        min_slack_mu and slack_resyncs to tune the margin.
+
+        Args:
+            min_slack_mu (int): Minimum slack in machine units.
+        """
+        counter = self.core.get_rtio_counter_mu()
+        slack = now_mu() - counter
+        if slack < self.min_slack_mu:
+            self.min_slack_mu = slack
+        if slack < min_slack_mu:
+            at_mu(counter + min_slack_mu)
+            self.slack_resyncs += 1
+
+    def add_mu_setting(self, name, dds_name, kind="frequency"):
+        """Precompute the machine units of a frequency, amplitude or attenuation.
+
+        The attribute <name>_mu is set on the host to the frequency tuning word,
+        amplitude scale factor or attenuation register value of the attribute name, so
+        kernels can call dds.set_mu and dds.set_att_mu instead of converting the float
+        on the core device for every pulse. The value is recomputed whenever the
+        attribute is set from a parameter or an argument. If a kernel changes the
+        attribute it must update <name>_mu itself.
+
+        Args:
+            name (str): The attribute, ex. "frequency_866_cooling".
+            dds_name (str): The DDS the value is used with, ex. "dds_866_dp".
+            kind (str): "frequency", "amplitude" or "attenuation".
+        """
+        if kind not in ["frequency", "amplitude", "attenuation"]:
+            raise RuntimeError(f"Unknown machine unit setting '{kind}' for '{name}'.")
+        self.mu_settings.append((name, dds_name, kind))
+
+    def add_dma_trace(self, name, num_settings):
+        """Add a pulse train that is recorded once and replayed with core DMA.
+
+        Args:
+            name (str): Name of the trace, prefixed with the group name of the sequence.
+            num_settings (int): Number of values the recorded pulse train depends on.
+
+        Returns: The DMATrace.
+        """
+        trace = DMATrace(f"{self.group_name}_{name}", num_settings)
+        self.dma_traces.append(trace)
+        return trace
+
+    def add_dds_profiles(self, dds_name):
+        """Use preloaded AD9910 profiles for a DDS.
+
+        The sequence gets the attribute <dds_name>_profiles holding the DDSProfiles
+        of the DDS, ex. self.dds_729_dp_profiles.
+
+        Args:
+            dds_name (str): The name of the DDS, ex. "dds_729_dp".
+        """
+        self.profile_dds_names.append(dds_name)
+
+    def set_mu_settings(self):
+        """Convert the attributes added with add_mu_setting to machine units."""
+        for name, dds_name, kind in self.mu_settings:
+            dds = getattr(self, dds_name)
+            value = getattr(self, name)
+            if kind == "frequency":
+                value_mu = dds.frequency_to_ftw(value)
+            elif kind == "amplitude":
+                value_mu = dds.amplitude_to_asf(value)
+            else:
+                value_mu = dds.cpld.att_to_mu(value)
+            setattr(self, name + "_mu", np.int32(value_mu))
+
+    def parameter_names(self):
+        """Get the names of all parameters read by the sequence.
+
+        Returns: List of parameter names, including those used as argument defaults.
+        """
+        names = list(self.parameters)
+        for arg_dict in self.arguments:
+            if arg_dict["default_parameter"] is not None:
+                names.append(arg_dict["default_parameter"])
+        return names
+
     def initialize(self, exp, seq, hardware):
         """Initialize the sequence. Must be called in build().
 
@@ -79,10 +182,16 @@ class Sequence:
         self.exp = exp
         self.seq = seq
         self.core=exp.core
+        self.core_dma=exp.core_dma
         self.experiment_data=self.exp.experiment_data
         self.parameter_manager=self.exp.parameter_manager
         self.set_param_and_arg_defaults()
         hardware.add_device_attributes(self)
+        self.set_mu_settings()
+        for trace in self.dma_traces:
+            trace.initialize(exp)
+        for dds_name in self.profile_dds_names:
+            setattr(self, dds_name + "_profiles", hardware.get_dds_profiles(dds_name))
 
     def set_param_and_arg_defaults(self):
         """Set parameters and arguments to their default values.
@@ -159,5 +268,7 @@ class Sequence:
                 setattr(self, arg_dict["name"], getattr(self.exp, group_param_name))
                 #setattr(self, param.replace("/", "_"), getattr(self.exp, group_param_name))
 
+        self.set_mu_settings()
+
     # Default methds for run and sequence??
 
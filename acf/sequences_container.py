@@ -1,10 +1,28 @@
 # This is a class to hold all the user defined sequences and pass them to the experiment.
 
+import importlib
+import inspect
+import re
+
 class SequencesContainer:
 
     def __init__(self):
         self.all_sequences = []
 
+        # Sequences registered with add_lazy_sequence that have not been used yet.
+        # Keys are attribute names, values are (module name, class name).
+        self.lazy_sequences = {}
+
+        ## Set in bind
+        # The running experiment
+        self.exp = None
+
+        # The HardwareSetup instance
+        self.hardware = None
+
+        # True while the experiment is in build(), sequences can only be created then
+        self.building = False
+
     def add_sequence(self, name, seq):
         """Add a sequence.
 
@@ -14,3 +32,122 @@ class SequencesContainer:
         """
         self.all_sequences.append(seq)
         setattr(self, name, seq)
+
+    def add_lazy_sequence(self, name, module, class_name):
+        """Register a sequence that is only created when it is first used.
+
+        The module is imported, the sequence instantiated and, if the container is
+        bound to an experiment, initialized with its parameters and built on the first
+        access to the attribute, ex. self.seq.readout_397. Sequences the experiment
+        refers to in its source are created by bind, others must be accessed in build(),
+        not first in a kernel or after build().
+
+        Args:
+            name (str): The name of the attribute that the sequence will be set to.
+            module (str): The module defining the sequence, ex. "acf_sequences.readout.readout397".
+            class_name (str): The name of the Sequence class, ex. "ReadOut397".
+        """
+        self.lazy_sequences[name] = (module, class_name)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set, i.e. sequences not created yet
+        lazy_sequences = self.__dict__.get("lazy_sequences", {})
+        if name not in lazy_sequences:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+        if self.exp is not None and not self.building:
+            raise RuntimeError(f"Sequence '{name}' was first used after build(), ex. in a kernel. "
+                               f"Access self.seq.{name} in build() so it is initialized with the experiment.")
+
+        seq = self.create_sequence(name)
+        if self.exp is not None:
+            self.exp.parameter_manager.load(seq.parameter_names())
+            self.initialize_sequence(seq)
+        return seq
+
+    def create_sequence(self, name):
+        """Import and instantiate a lazily registered sequence without initializing it.
+
+        Args:
+            name (str): The name of the attribute that the sequence will be set to.
+
+        Returns: The sequence.
+        """
+        module, class_name = self.lazy_sequences.pop(name)
+        seq = getattr(importlib.import_module(module), class_name)()
+        self.add_sequence(name, seq)
+        return seq
+
+    def referenced_sequences(self, modules):
+        """Get the lazily registered sequences that the source of modules refers to.
+
+        Args:
+            modules (list): Modules to search for self.seq.<name>, ex. self.exp.seq.<name>.
+
+        Returns: Set of names of sequences not created yet.
+        """
+        names = set()
+        for module in modules:
+            try:
+                source = inspect.getsource(module)
+            except (OSError, TypeError):
+                continue
+            names.update(re.findall(r"\bseq\.(\w+)", source))
+        return names & set(self.lazy_sequences)
+
+    def bind(self, exp, hardware):
+        """Create the sequences used by an experiment and initialize them. Call in build().
+
+        Every lazily registered sequence that the module of the experiment, the acf
+        modules it imports or the modules of the sequences refer to is created, so that
+        sequences used only in kernels are initialized and built with the experiment and
+        not while a kernel is compiled. The parameters of all of them are read at once.
+        Call finish_build at the end of build().
+
+        Args:
+            exp (EnvExperiment): The calling experiment.
+            hardware (HardwareSetup): The HardwareSetup instance.
+        """
+        self.exp = exp
+        self.hardware = hardware
+        self.building = True
+
+        exp_module = inspect.getmodule(type(exp))
+        modules = [exp_module] + [inspect.getmodule(cls) for cls in type(exp).__mro__]
+        if exp_module is not None:
+            modules += [inspect.getmodule(value) for value in vars(exp_module).values()]
+        modules = [module for module in set(modules)
+                   if module is not None and (module is exp_module or module.__name__.startswith("acf."))]
+
+        names = self.referenced_sequences(modules)
+        while names:
+            created = [self.create_sequence(name) for name in names]
+            names = self.referenced_sequences({inspect.getmodule(type(seq)) for seq in created})
+
+        # Read every parameter used by the sequences once, later lookups hit the cache
+        self.exp.parameter_manager.load(self.parameter_names())
+        for sequence in self.all_sequences:
+            self.initialize_sequence(sequence)
+
+    def finish_build(self):
+        """Stop creating sequences, later first accesses raise. Called after build()."""
+        self.building = False
+
+    def initialize_sequence(self, seq):
+        """Initialize a sequence and build it. Its parameters must be loaded.
+
+        Args:
+            seq (Sequence): The sequence.
+        """
+        seq.initialize(self.exp, self, self.hardware)
+        seq.build()
+
+    def parameter_names(self):
+        """Get the names of all parameters read by the sequences created so far.
+
+        Returns: Set of parameter names.
+        """
+        names = set()
+        for sequence in self.all_sequences:
+            names.update(sequence.parameter_names())
+        return names
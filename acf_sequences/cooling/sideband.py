@@ -38,6 +38,22 @@ class SideBandCool(Sequence):
         self.add_parameter("optical_pumping/att_397_sigma")
         self.add_argument_from_parameter("optical_pumping_freq_397_sigma", "frequency/397_resonance")
         self.add_parameter("frequency/397_resonance")
+
+        # Settings that stay the same during the cooling loop, converted on the host
+        self.add_mu_setting("frequency_866_cooling", "dds_866_dp")
+        self.add_mu_setting("frequency_854_dp", "dds_854_dp")
+        self.add_mu_setting("frequency_397_resonance", "dds_397_sigma")
+        self.add_mu_setting("optical_pumping_freq_397_sigma", "dds_397_sigma")
+        self.add_mu_setting("sideband_att_729", "dds_729_dp", "attenuation")
+        self.add_mu_setting("sideband_att_854", "dds_854_dp", "attenuation")
+        self.add_mu_setting("sideband_att_866", "dds_866_dp", "attenuation")
+        self.add_mu_setting("optical_pumping_att_397_sigma", "dds_397_sigma", "attenuation")
+        self.add_mu_setting("Op_pump_att_729_dp", "dds_729_dp", "attenuation")
+        self.add_mu_setting("Op_pump_att_854", "dds_854_dp", "attenuation")
+        self.add_mu_setting("Op_pump_att_866", "dds_866_dp", "attenuation")
+
+        # 729 profiles for optical pumping and sideband cooling, see SideBandCoolingCW
+        self.add_dds_profiles("dds_729_dp")
       
 
     @kernel
@@ -53,14 +69,18 @@ class SideBandCool(Sequence):
             #mainly for outside scan
             if (att_854_here/dB)>0.0:
                 self.sideband_att_854=att_854_here
+                self.sideband_att_854_mu=self.dds_854_dp.cpld.att_to_mu(att_854_here)
             if (freq_offset/MHz)>0.0:
                 self.sideband_vib_freq=freq_offset
             if (att_729_here/dB)>0.0:
                 self.sideband_att_729=att_729_here
+                self.sideband_att_729_mu=self.dds_729_dp.cpld.att_to_mu(att_729_here)
             if (att_866_here/dB)>0.0:
                 self.sideband_att_866=att_866_here
+                self.sideband_att_866_mu=self.dds_866_dp.cpld.att_to_mu(att_866_here)
             if (att_397_sigma_here/dB)>0.0:
                 self.optical_pumping_att_397_sigma=att_397_sigma_here
+                self.optical_pumping_att_397_sigma_mu=self.dds_397_sigma.cpld.att_to_mu(att_397_sigma_here)
             
             self.SideBandCoolingCW(self.SideBandCool_729_dp_sideband+freq_diff_dp, self.Op_pump_freq_729_dp+freq_diff_dp*7.0/5.0,  self.sideband_vib_freq)
 
@@ -262,8 +282,8 @@ class SideBandCool(Sequence):
 
     @kernel
     def OP_Sigma(self):
-        self.dds_397_sigma.set(self.optical_pumping_freq_397_sigma)
-        self.dds_397_sigma.set_att(self.optical_pumping_att_397_sigma)
+        self.dds_397_sigma.set_mu(self.optical_pumping_freq_397_sigma_mu)
+        self.dds_397_sigma.set_att_mu(self.optical_pumping_att_397_sigma_mu)
        
         self.dds_397_sigma.sw.on()
         delay(self.optical_pumping_pump_time_sigma)
@@ -280,22 +300,32 @@ class SideBandCool(Sequence):
         # print("continuous cooling WWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWWww", sbc_freq+freq_offset*0.5)
         # self.core.break_realtime()
 
-        att_729 = self.sideband_att_729
-        att_866 = self.sideband_att_866
-        att_854 = self.sideband_att_854
+        # Convert the frequencies once and load them into the 729 profiles, the loop
+        # below switches profiles instead of writing the frequency every cycle.
+        # Profiles are only written again when a frequency changed.
+        op_ftw = self.dds_729_dp.frequency_to_ftw(op_freq)
+        sbc_ftw_2nd = self.dds_729_dp.frequency_to_ftw(sbc_freq+freq_offset)
+        sbc_ftw_1st = self.dds_729_dp.frequency_to_ftw(sbc_freq+0.5*freq_offset)
+        self.dds_729_dp_profiles.load_mu(0, op_ftw)
+        self.dds_729_dp_profiles.load_mu(1, sbc_ftw_2nd)
+        self.dds_729_dp_profiles.load_mu(2, sbc_ftw_1st)
+
+        att_729 = self.sideband_att_729_mu
+        att_866 = self.sideband_att_866_mu
+        att_854 = self.sideband_att_854_mu
         
 
         #set laser power & frequency
-        self.dds_729_dp.set(op_freq)
-        self.dds_866_dp.set(self.frequency_866_cooling)
-        self.dds_854_dp.set(self.frequency_854_dp)
+        self.dds_729_dp.set_mu(op_ftw)
+        self.dds_866_dp.set_mu(self.frequency_866_cooling_mu)
+        self.dds_854_dp.set_mu(self.frequency_854_dp_mu)
 
-        self.dds_729_dp.set_att(att_729)
-        self.dds_854_dp.set_att(att_854)
-        self.dds_866_dp.set_att(att_866)
+        self.dds_729_dp.set_att_mu(att_729)
+        self.dds_854_dp.set_att_mu(att_854)
+        self.dds_866_dp.set_att_mu(att_866)
 
-        self.dds_397_sigma.set(self.frequency_397_resonance)
-        self.dds_397_sigma.set_att(self.optical_pumping_att_397_sigma)
+        self.dds_397_sigma.set_mu(self.frequency_397_resonance_mu)
+        self.dds_397_sigma.set_att_mu(self.optical_pumping_att_397_sigma_mu)
         
 
         delay(5*us)
@@ -305,36 +335,43 @@ class SideBandCool(Sequence):
         self.dds_397_sigma.sw.off()
         delay(5*us)
 
+        # Profile the 729 is switched to, the default profile holds op_ftw
+        sbc_profile = 7
+
         for i in range(self.SideBandCool_num_cycle):
 
             if self.optical_pumping=="397_op": # and i < self.SideBandCool_num_cycle/5*4:
                 
                 self.dds_729_dp.sw.off()
                 delay(1.0*us)
+                # dds_397_sigma is on the same Urukul board as dds_729_dp and follows
+                # its profile pins, so it needs the default profile while it pumps
+                self.dds_729_dp_profiles.switch_default()
                 self.OP_Sigma()
+                self.dds_729_dp_profiles.switch(sbc_profile)
                 self.dds_729_dp.sw.on()
 
             else:
 
                 ##GS pumping
-                self.dds_729_dp.set(op_freq)
-                self.dds_729_dp.set_att(self.Op_pump_att_729_dp)
-                self.dds_854_dp.set_att(att_854)
-                self.dds_866_dp.set_att(att_866)
+                self.dds_729_dp_profiles.switch(0)
+                self.dds_729_dp.set_att_mu(self.Op_pump_att_729_dp_mu)
+                self.dds_854_dp.set_att_mu(att_854)
+                self.dds_866_dp.set_att_mu(att_866)
                 delay(300*us)
 
             
-            self.dds_854_dp.set_att(att_854)
-            self.dds_866_dp.set_att(att_866)
-            self.dds_729_dp.set_att(att_729)
+            self.dds_854_dp.set_att_mu(att_854)
+            self.dds_866_dp.set_att_mu(att_866)
+            self.dds_729_dp.set_att_mu(att_729)
             #continous 2nd red sideband cooling 
             if i < self.SideBandCool_num_cycle/5:
-                self.dds_729_dp.set(sbc_freq+freq_offset)
-                delay(200*us)
+                sbc_profile = 1
             else:
                 #continous red sideband cooling 
-                self.dds_729_dp.set(sbc_freq+0.5*freq_offset)
-                delay(200*us)
+                sbc_profile = 2
+            self.dds_729_dp_profiles.switch(sbc_profile)
+            delay(200*us)
         
 
 
@@ -342,6 +379,7 @@ class SideBandCool(Sequence):
         self.dds_866_dp.sw.off()
         self.dds_729_dp.sw.off()
         self.dds_397_sigma.sw.off()
+        self.dds_729_dp_profiles.switch_default()
 
         # for i in range(10):
         #     #self.dds_729_dp.set(sbc_freq+freq_offset*0.5)
@@ -360,8 +398,8 @@ class SideBandCool(Sequence):
   
 
         #upper state clean up
-        self.dds_729_dp.set(op_freq)
-        self.dds_729_dp.set_att(self.Op_pump_att_729_dp)
+        self.dds_729_dp.set_mu(op_ftw)
+        self.dds_729_dp.set_att_mu(self.Op_pump_att_729_dp_mu)
 
         self.OP_Sigma()
 
@@ -373,8 +411,8 @@ class SideBandCool(Sequence):
             delay(10*us)
             self.dds_729_dp.sw.off()
 
-            self.dds_854_dp.set_att(self.Op_pump_att_854)
-            self.dds_866_dp.set_att(self.Op_pump_att_866)
+            self.dds_854_dp.set_att_mu(self.Op_pump_att_854_mu)
+            self.dds_866_dp.set_att_mu(self.Op_pump_att_866_mu)
             self.dds_854_dp.sw.on()
             self.dds_866_dp.sw.on()
             delay(10*us)
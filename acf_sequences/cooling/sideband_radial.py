@@ -40,6 +40,13 @@ class SideBandCool_Radial(Sequence):
         self.add_parameter("optical_pumping/att_397_sigma")
         self.add_argument_from_parameter("optical_pumping_freq_397_sigma", "frequency/397_resonance")
         self.add_parameter("frequency/397_resonance")
+
+        # Attenuation of the 854 during the repump pulses of the pulsed cooling
+        self.repump_att_854 = 15*dB
+
+        # Cooling pulse train, depends on the sideband and optical pumping frequencies.
+        # The attenuations are set before it is played back.
+        self.cooling_trace = self.add_dma_trace("cooling", 2)
       
 
     @kernel
@@ -49,37 +56,65 @@ class SideBandCool_Radial(Sequence):
             att_729_here=-1.0*dB, 
             att_866_here=-1.0*dB, 
             freq_diff_dp=0.0*MHz):      
-        if self.SideBandCool_Cooling_Type == "cw":
-
-            #mainly for outside scan
-            if (att_854_here/dB)>0.0:
-                self.sideband_att_854=att_854_here
-            if (att_729_here/dB)>0.0:
-                self.sideband_att_729=att_729_here
-            if (att_866_here/dB)>0.0:
-                self.sideband_att_866=att_866_here
-            
-            self.SideBandCoolingCW(self.SideBandCool_729_dp_sideband+freq_diff_dp, self.Op_pump_freq_729_dp+freq_diff_dp*7.0/5.0)#,  self.sideband_vib_freq)
-
+        #mainly for outside scan
+        if (att_854_here/dB)>0.0:
+            self.sideband_att_854=att_854_here
+        if (att_729_here/dB)>0.0:
+            self.sideband_att_729=att_729_here
+        if (att_866_here/dB)>0.0:
+            self.sideband_att_866=att_866_here
+
+        sbc_freq = self.SideBandCool_729_dp_sideband+freq_diff_dp
+        op_freq = self.Op_pump_freq_729_dp+freq_diff_dp*7.0/5.0
+
+        self.set_cooling_attenuations()
+
+        if self.optical_pumping == "397_op":
+            # Record the pulse train on the first shot and when a setting changed, then replay it
+            if self.cooling_trace.changed([sbc_freq, op_freq]):
+                with self.core_dma.record(self.cooling_trace.name):
+                    self.cooling_pulses(sbc_freq, op_freq)
+                self.core.break_realtime()
+            self.cooling_trace.playback()
         else:
-            #mainly for outside scan
-            if (att_854_here/dB)>0.0:
-                self.sideband_att_854=att_854_here
-            if (att_729_here/dB)>0.0:
-                self.sideband_att_729=att_729_here
-            if (att_866_here/dB)>0.0:
-                self.sideband_att_866=att_866_here
-            
-            self.SideBandCooling_Pulse(self.SideBandCool_729_dp_sideband+freq_diff_dp, self.Op_pump_freq_729_dp+freq_diff_dp*7.0/5.0)#,  self.sideband_vib_freq)
+            # Optical pumping with the 729 switches its attenuation in every cycle,
+            # which cannot be recorded
+            self.cooling_pulses(sbc_freq, op_freq)
 
+        self.upper_state_cleanup(op_freq)
 
         delay(5*us)
 
+    @kernel
+    def set_cooling_attenuations(self):
+        """Set the attenuations used by the cooling pulse train.
+
+        set_att writes the whole attenuation register of the CPLD from its shadow on the
+        core device. Recorded into the trace, every playback would reset the other
+        channels of the CPLD to their attenuations at record time, so the trace only
+        holds frequency, switch and delay events and the attenuations are set here.
+        """
+        if self.SideBandCool_Cooling_Type == "cw":
+            self.dds_854_dp.set_att_mu(self.dds_854_dp.cpld.att_to_mu(self.sideband_att_854))
+        else:
+            # The 854 is only on in the repump pulses
+            self.dds_854_dp.set_att_mu(self.dds_854_dp.cpld.att_to_mu(self.repump_att_854))
+        self.dds_866_dp.set_att_mu(self.dds_866_dp.cpld.att_to_mu(self.sideband_att_866))
+        self.dds_729_radial_dp.set_att_mu(self.dds_729_radial_dp.cpld.att_to_mu(self.sideband_att_729))
+        self.dds_397_sigma.set_att_mu(self.dds_397_sigma.cpld.att_to_mu(self.optical_pumping_att_397_sigma))
+
+    @kernel
+    def cooling_pulses(self, sbc_freq, op_freq):
+        if self.SideBandCool_Cooling_Type == "cw":
+            self.SideBandCoolingCW(sbc_freq, op_freq)#,  self.sideband_vib_freq)
+        else:
+            self.SideBandCooling_Pulse(sbc_freq, op_freq)#,  self.sideband_vib_freq)
+
 
     @kernel
     def OP_Sigma(self):
+        # The attenuation is set by set_cooling_attenuations
         self.dds_397_sigma.set(self.optical_pumping_freq_397_sigma)
-        self.dds_397_sigma.set_att(self.optical_pumping_att_397_sigma)
        
         self.dds_397_sigma.sw.on()
         delay(self.optical_pumping_pump_time_sigma)
@@ -94,22 +129,15 @@ class SideBandCool_Radial(Sequence):
         ):
 
         att_729 = self.sideband_att_729
-        att_866 = self.sideband_att_866
-        att_854 = self.sideband_att_854
 
 
-        #set laser power & frequency
+        #set laser frequency, the attenuations are set by set_cooling_attenuations
         self.dds_866_dp.set(self.frequency_866_cooling)
         self.dds_854_dp.set(self.frequency_854_dp)
 
-        self.dds_854_dp.set_att(att_854)
-        self.dds_866_dp.set_att(att_866)
-
         self.dds_729_radial_dp.set(op_freq)
-        self.dds_729_radial_dp.set_att(att_729)
 
         self.dds_397_sigma.set(self.frequency_397_resonance)
-        self.dds_397_sigma.set_att(self.optical_pumping_att_397_sigma)
         
 
         delay(5*us)
@@ -130,18 +158,11 @@ class SideBandCool_Radial(Sequence):
 
             else:
 
-                ##GS pumping
+                ##GS pumping, not recorded
                 self.dds_729_radial_dp.set(op_freq)
                 self.dds_729_radial_dp.set_att(self.Op_pump_att_729_dp)
-                self.dds_854_dp.set_att(att_854)
-                self.dds_866_dp.set_att(att_866)
                 delay(300*us)
-
-            
-            self.dds_854_dp.set_att(att_854)
-            self.dds_866_dp.set_att(att_866)
-
-            self.dds_729_radial_dp.set_att(att_729)
+                self.dds_729_radial_dp.set_att(att_729)
 
 
             # if i < self.SideBandCool_num_cycle/4:
@@ -167,38 +188,10 @@ class SideBandCool_Radial(Sequence):
         self.dds_854_dp.sw.off()
         self.dds_866_dp.sw.off()
         delay(2*us)
-        
-        #upper state clean up
-        self.dds_729_dp.set(op_freq)
-        self.dds_729_dp.set_att(self.Op_pump_att_729_dp)
-
-        self.OP_Sigma()
-
-        for i in range(5):
-            self.dds_729_dp.sw.on()
-            delay(10*us)
-            self.dds_729_dp.sw.off()
-
-            self.dds_854_dp.set_att(self.Op_pump_att_854)
-            self.dds_866_dp.set_att(self.Op_pump_att_866)
-            self.dds_854_dp.sw.on()
-            self.dds_866_dp.sw.on()
-            delay(10*us)
-            self.dds_854_dp.sw.off()
-            self.dds_866_dp.sw.off()
-        
-        self.dds_729_dp.sw.off()
-        self.dds_854_dp.sw.off()
-        self.dds_866_dp.sw.off()
-
-        delay(5*us)
-
-
 
     @kernel
     def repump(self):
-        
-        self.dds_854_dp.set_att(15*dB)
+        # The attenuation is set to repump_att_854 by set_cooling_attenuations
         self.dds_866_dp.sw.on()
         self.dds_854_dp.sw.on()
         delay(10.0*us)
@@ -213,22 +206,15 @@ class SideBandCool_Radial(Sequence):
         ):
 
         att_729 = self.sideband_att_729
-        att_866 = self.sideband_att_866
-        att_854 = self.sideband_att_854
 
 
-        #set laser power & frequency
+        #set laser frequency, the attenuations are set by set_cooling_attenuations
         self.dds_866_dp.set(self.frequency_866_cooling)
         self.dds_854_dp.set(self.frequency_854_dp)
 
-        self.dds_854_dp.set_att(att_854)
-        self.dds_866_dp.set_att(att_866)
-
         self.dds_729_radial_dp.set(op_freq)
-        self.dds_729_radial_dp.set_att(att_729)
 
         self.dds_397_sigma.set(self.frequency_397_resonance)
-        self.dds_397_sigma.set_att(self.optical_pumping_att_397_sigma)
         
 
         delay(5*us)
@@ -248,15 +234,11 @@ class SideBandCool_Radial(Sequence):
                 self.dds_866_dp.sw.off()
             else:
 
-                ##GS pumping
+                ##GS pumping, not recorded
                 self.dds_729_radial_dp.set(op_freq)
                 self.dds_729_radial_dp.set_att(self.Op_pump_att_729_dp)
-                self.dds_854_dp.set_att(att_854)
-                self.dds_866_dp.set_att(att_866)
                 delay(300*us)
-
-            
-            self.dds_729_radial_dp.set_att(att_729)
+                self.dds_729_radial_dp.set_att(att_729)
 
 
 
@@ -301,17 +283,16 @@ class SideBandCool_Radial(Sequence):
         self.dds_854_dp.sw.off()
         self.dds_866_dp.sw.off()
         delay(2*us)
-        
-        #upper state clean up
+
+    @kernel
+    def upper_state_cleanup(self, op_freq):
+        """Pump to the ground state after cooling. Not recorded, it changes attenuations."""
         self.dds_729_dp.set(op_freq)
         self.dds_729_dp.set_att(self.Op_pump_att_729_dp)
 
         self.OP_Sigma()
 
         for i in range(5):
-
-            # ground state optical pumping
-
             self.dds_729_dp.sw.on()
             delay(10*us)
             self.dds_729_dp.sw.off()
@@ -36,6 +36,12 @@ class SideBandCool2Mode(Sequence):
         self.add_argument_from_parameter("optical_pumping_att_866", "attenuation/866")
         self.add_argument_from_parameter("optical_pumping_freq_854", "frequency/854_dp")
         self.add_argument_from_parameter("optical_pumping_att_854", "attenuation/854_dp")
+
+        # Cooling pulse train with optical pumping by the 397 sigma, depends on the
+        # sideband and pumping frequencies, the pump time and the attenuation registers
+        # of the first and of the following cycles, see fill_cooling_registers
+        self.cooling_trace = self.add_dma_trace("cooling", 15)
+        self.cooling_registers = np.zeros(12, dtype=np.int32)
     
 
       
@@ -190,6 +196,52 @@ class SideBandCool2Mode(Sequence):
 
    
 
+    @kernel
+    def fill_cooling_registers(self):
+        """Get the attenuation registers written by the recorded cooling cycles.
+
+        A cycle writes six registers, in the order of cooling_cycle. The first cycle
+        starts from the attenuations of set_OP, the following ones from those of the
+        cycle before, so the registers of both are kept, the first cycle at offset 0
+        and the following ones at offset 6. The CPLD shadows are left as the playback
+        leaves the hardware.
+        """
+        for offset in [0, 6]:
+            self.cooling_registers[offset] = self.cooling_trace.att_register(
+                self.dds_397_sigma, self.optical_pumping_att_397_sigma)
+            self.cooling_registers[offset + 1] = self.cooling_trace.att_register(
+                self.dds_854_dp, self.sideband2mode_att_854-1.0*dB)
+            self.cooling_registers[offset + 2] = self.cooling_trace.att_register(
+                self.dds_866_dp, self.sideband2mode_att_866)
+            self.cooling_registers[offset + 3] = self.cooling_trace.att_register(
+                self.dds_729_dp, self.sideband2mode_att_729_dp-1.0*dB)
+            self.cooling_registers[offset + 4] = self.cooling_trace.att_register(
+                self.dds_729_dp, self.sideband2mode_att_729_dp)
+            self.cooling_registers[offset + 5] = self.cooling_trace.att_register(
+                self.dds_854_dp, self.sideband2mode_att_854)
+
+    @kernel
+    def cooling_cycle(self, offset):
+        """One cycle of the cw cooling with optical pumping by the 397 sigma, recorded into the trace.
+
+        The attenuations are written as the full registers from fill_cooling_registers
+        at offset, in the same order and with the same timing as by set_att.
+        """
+        self.dds_729_dp.sw.off()
+        self.dds_397_sigma.set(self.optical_pumping_freq_397_sigma)
+        self.dds_397_sigma.cpld.set_all_att_mu(self.cooling_registers[offset])
+        self.dds_397_sigma.sw.on()
+        delay(self.optical_pumping_pump_time_sigma)
+        self.dds_397_sigma.sw.off()
+        self.dds_729_dp.sw.on()
+
+        self.dds_854_dp.cpld.set_all_att_mu(self.cooling_registers[offset + 1])
+        self.dds_866_dp.cpld.set_all_att_mu(self.cooling_registers[offset + 2])
+        self.dds_729_dp.set(self.sideband2mode_freq_729_dp)
+        self.dds_729_dp.cpld.set_all_att_mu(self.cooling_registers[offset + 3])
+        self.dds_729_dp.cpld.set_all_att_mu(self.cooling_registers[offset + 4])
+        self.dds_854_dp.cpld.set_all_att_mu(self.cooling_registers[offset + 5])
+
     @kernel
     def SideBandCoolingCW2mode(self):
 
@@ -204,30 +256,42 @@ class SideBandCool2Mode(Sequence):
         self.dds_866_dp.sw.on()
         self.dds_729_dp.sw.on()
         ##############################################################################################################################       
-        for i in range(self.SideBandCool_num_cycle):
-            
-            ########################################################################################################################### 
-            if self.optical_pumping=="397_op": #and i < self.SideBandCool_num_cycle/5*4:
-                self.dds_729_dp.sw.off()
-                self.OP_Sigma()
-                self.dds_729_dp.sw.on()
-
-            else:
+        if self.optical_pumping=="397_op":
+            # Record the cycles on the first shot and when a setting changed, then replay them
+            if self.SideBandCool_num_cycle > 0:
+                r = self.cooling_registers
+                self.fill_cooling_registers()
+                if self.cooling_trace.changed([
+                        self.sideband2mode_freq_729_dp,
+                        self.optical_pumping_freq_397_sigma,
+                        self.optical_pumping_pump_time_sigma,
+                        float(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]),
+                        float(r[6]), float(r[7]), float(r[8]), float(r[9]), float(r[10]), float(r[11])]):
+                    with self.core_dma.record(self.cooling_trace.name):
+                        self.cooling_cycle(0)
+                        for i in range(self.SideBandCool_num_cycle - 1):
+                            self.cooling_cycle(6)
+                    self.core.break_realtime()
+                self.cooling_trace.playback()
+
+        else:
+            # set_OP sets the attenuations from the shadows in every cycle, not recorded
+            for i in range(self.SideBandCool_num_cycle):
 
                 ##GS pumping
                 self.set_OP()
                 delay(300*us)
 
-            ###########################################################################################################################
-            self.dds_854_dp.set_att(self.sideband2mode_att_854-1.0*dB)
-            self.dds_866_dp.set_att(self.sideband2mode_att_866)
-            self.dds_729_dp.set(self.sideband2mode_freq_729_dp)
+                ###########################################################################################################################
+                self.dds_854_dp.set_att(self.sideband2mode_att_854-1.0*dB)
+                self.dds_866_dp.set_att(self.sideband2mode_att_866)
+                self.dds_729_dp.set(self.sideband2mode_freq_729_dp)
 
-            self.dds_729_dp.set_att(self.sideband2mode_att_729_dp-1.0*dB) 
+                self.dds_729_dp.set_att(self.sideband2mode_att_729_dp-1.0*dB) 
 
-            
-            self.dds_729_dp.set_att(self.sideband2mode_att_729_dp)
-            self.dds_854_dp.set_att(self.sideband2mode_att_854)
+                
+                self.dds_729_dp.set_att(self.sideband2mode_att_729_dp)
+                self.dds_854_dp.set_att(self.sideband2mode_att_854)
 
 
         #################################
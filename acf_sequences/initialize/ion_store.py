@@ -31,24 +31,21 @@ class Ion_Storage(Sequence):
     @kernel
     def run(self):
 
-        self.core.break_realtime()
+        # The delays below keep adding slack, one check at the start is enough
+        self.ensure_slack()
         # self.dds_854_dp.sw.off()
         delay(200*us)
         self.dds_854_dp.set(self.frequency_854_dp)
-        self.core.break_realtime()
         delay(200*us)
         self.dds_854_dp.set_att(self.attenuation_854_dp)
-        self.core.break_realtime()
         delay(20*us)
         self.dds_854_dp.sw.on()
-        self.core.break_realtime()
         delay(20*us)
         
         #set attenuation
         self.dds_397_dp.set_att(self.attenuation_397)
         #self.dds_397_far_detuned.set_att(self.attenuation_397_far_detuned)
         self.dds_866_dp.set_att(self.attenuation_866)
-        self.core.break_realtime()
         delay(20*us)
 
         #set frequency
@@ -56,7 +53,6 @@ class Ion_Storage(Sequence):
        # self.dds_397_far_detuned.set(self.frequency_397_far_detuned)
         self.dds_866_dp.set(self.frequency_866_cooling)
 
-        self.core.break_realtime()
         delay(20*us)
 
         self.dds_866_dp.sw.on()
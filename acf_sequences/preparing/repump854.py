@@ -22,11 +22,9 @@ class Repump854(Sequence):
 
     @kernel
     def run(self):
-        # Ensure sufficient timeline slack before any RTIO activity
-        self.core.break_realtime()
-        delay(1*ms)
-        # Explicitly move the software timeline into the future relative to hardware time
-        at_mu(self.core.get_rtio_counter_mu() + 500000)
+        # Ensure sufficient timeline slack before any RTIO activity. Slack left by
+        # the previous sequences is kept instead of resetting the timeline.
+        self.ensure_slack(500000)
 
         # Turn off potentially conflicting outputs first
         self.dds_729_dp.sw.off()
@@ -34,10 +32,6 @@ class Repump854(Sequence):
         self.dds_397_far_detuned.sw.off()
         delay(2*us)
 
-        # Add additional slack before issuing SPI-heavy DDS configuration
-        self.core.break_realtime()
-        delay(1*ms)
-        at_mu(self.core.get_rtio_counter_mu() + 500000)
         # 854 repump
         self.dds_854_dp.set(self.frequency_854_dp)
         delay(200*us)
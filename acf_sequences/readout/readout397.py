@@ -1,6 +1,6 @@
 from acf.sequence import Sequence
 
-from artiq.experiment import kernel, delay, s, dB, us, NumberValue, MHz, ms
+from artiq.experiment import kernel, delay, s, dB, us, NumberValue, MHz, ms, at_mu, TInt32, TFloat, TBool
 
 import numpy as np
 class ReadOut397(Sequence):
@@ -14,7 +14,42 @@ class ReadOut397(Sequence):
         self.add_parameter("attenuation/866")
         self.add_parameter("frequency/397_resonance")
         self.add_parameter("frequency/866_cooling")
-        
+
+        self.add_mu_setting("attenuation_397", "dds_397_dp", "attenuation")
+        self.add_mu_setting("attenuation_866", "dds_866_dp", "attenuation")
+        self.add_mu_setting("frequency_397_resonance", "dds_397_dp")
+        self.add_mu_setting("frequency_866_cooling", "dds_866_dp")
+
+        # Slack needed for the DDS writes before the PMT gate opens
+        self.readout_slack_mu = np.int64(50000)
+
+        # Count boundaries of run_early_termination, set by configure_early_termination
+        self.num_slices = 0
+        self.dark_upto = np.full(1, -1, dtype=np.int32)
+        self.bright_from = np.zeros(1, dtype=np.int32)
+        self.slice_time_mu = np.int64(0)
+        # Slack to reopen the gate after the counts of a slice were read
+        self.slice_slack_mu = np.int64(5000)
+        # Counts and number of slices of the last run_early_termination
+        self.early_counts = 0
+        self.early_slices = 0
+
+    def configure_early_termination(self, readout, num_slices=10, error=1e-3):
+        """Set the count boundaries of run_early_termination. Call in prepare().
+
+        Args:
+            readout (PoissonReadout): Count distributions of the dark and bright ion
+                in a readout window of readout_pmt_sampling_time.
+            num_slices (int): Number of slices the readout window is split into.
+            error (float): Largest probability of the other state at which a slice decides.
+
+        Returns: Tuple of (mean fraction of the window read, error), each of the dark
+            and the bright state.
+        """
+        self.dark_upto, self.bright_from = readout.early_termination(num_slices, error)
+        self.num_slices = num_slices
+        self.slice_time_mu = np.int64(self.core.seconds_to_mu(self.readout_pmt_sampling_time / num_slices))
+        return readout.early_termination_performance(self.dark_upto, self.bright_from)
 
     @kernel
     def run(self, 
@@ -22,23 +57,73 @@ class ReadOut397(Sequence):
          freq_866_dp=-1.0*MHz,
          turn_off_866=False)-> np.int32:
 
-        if freq_397_dp < 0.0:
-            freq_397_dp = self.frequency_397_resonance
+        self.lasers_on(freq_397_dp, turn_off_866)
 
-        self.core.break_realtime()
-        delay(10*us)
+        num_pmt_pulses = self.ttl_pmt_input.count(
+            self.ttl_pmt_input.gate_rising(self.readout_pmt_sampling_time)
+        )
+        self.lasers_off()
 
-        self.dds_397_dp.set_att(self.attenuation_397)
-        self.dds_397_dp.set(freq_397_dp)
+        return num_pmt_pulses
 
-        self.core.break_realtime()
-        delay(10*us)
+    @kernel
+    def run_early_termination(self, freq_397_dp=-1.0*MHz, turn_off_866=False) -> TInt32:
+        """Read out a single ion, stopping once its state is decisive.
+
+        The readout window is split into slices. After each slice the counts so far are
+        compared to the boundaries set by configure_early_termination, and the readout
+        stops as soon as they decide the state. The TTL counter can only be read after
+        its gate closed, so the gate is reopened for every slice, slice_slack_mu after
+        the counts were read.
+
+        Args:
+            freq_397_dp (float): Frequency of the 397 double pass, the parameter if negative.
+            turn_off_866 (bool): Keep the 866 off, ex. to read out a dark ion.
+
+        Returns: 1 if the ion is bright, 0 if it is dark. The counts and the number of
+            slices read are kept in early_counts and early_slices.
+        """
+        if self.num_slices == 0:
+            raise ValueError("configure_early_termination was not called")
+
+        self.lasers_on(freq_397_dp, turn_off_866)
+
+        num_pmt_pulses = 0
+        state = -1
+        slice_i = 0
+        while state < 0:
+            num_pmt_pulses += self.ttl_pmt_input.count(
+                self.ttl_pmt_input.gate_rising_mu(self.slice_time_mu)
+            )
+            if num_pmt_pulses >= self.bright_from[slice_i]:
+                state = 1
+            elif num_pmt_pulses <= self.dark_upto[slice_i]:
+                state = 0
+            else:
+                slice_i += 1
+                at_mu(self.core.get_rtio_counter_mu() + self.slice_slack_mu)
+
+        self.lasers_off()
+        self.early_counts = num_pmt_pulses
+        self.early_slices = slice_i + 1
+        return state
 
-        self.dds_866_dp.set(self.frequency_866_cooling)
-        self.dds_866_dp.set_att(self.attenuation_866)
+    @kernel
+    def lasers_on(self, freq_397_dp: TFloat, turn_off_866: TBool):
+        """Set the 397 and 866 DDS and switch them on before the PMT gate opens."""
+        ftw_397 = self.frequency_397_resonance_mu
+        if freq_397_dp >= 0.0:
+            ftw_397 = self.dds_397_dp.frequency_to_ftw(freq_397_dp)
 
-        self.core.break_realtime()
-        delay(10*us)
+        # One check of the timeline budget covers all DDS writes below, accumulated
+        # slack from the previous sequences is kept
+        self.ensure_slack(self.readout_slack_mu)
+
+        self.dds_397_dp.set_att_mu(self.attenuation_397_mu)
+        self.dds_397_dp.set_mu(ftw_397)
+
+        self.dds_866_dp.set_mu(self.frequency_866_cooling_mu)
+        self.dds_866_dp.set_att_mu(self.attenuation_866_mu)
 
         self.dds_729_dp.sw.off()
         self.dds_397_dp.sw.on()
@@ -47,17 +132,14 @@ class ReadOut397(Sequence):
         else:
             self.dds_866_dp.sw.on()
 
-        self.core.break_realtime()
         delay(10*us)
 
-        num_pmt_pulses = self.ttl_pmt_input.count(
-            self.ttl_pmt_input.gate_rising(self.readout_pmt_sampling_time)
-        )
+    @kernel
+    def lasers_off(self):
+        """Switch off the 397 and 866 after the PMT gate closed."""
         with sequential:
             delay(20*us)
             self.dds_397_dp.sw.off()
             self.dds_866_dp.sw.off()
         
         delay(20*us)
-
-        return num_pmt_pulses
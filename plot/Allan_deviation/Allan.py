@@ -1,89 +1,320 @@
+"""
+Allan deviation of frequencies logged by the drift tracker.
+
+The overlapping Allan deviation, the modified Allan deviation and the time deviation
+are computed from prefix sums of the fractional frequencies, in O(N) per averaging
+time. Non-uniformly sampled frequencies are first averaged in bins of a fixed
+length tau0. Short runs of empty bins, left by jitter of the sampling, are
+interpolated. Longer runs are outages, terms of the estimators that span one are
+left out.
+
+Example:
+    python Allan.py --data-file drift_tracker_motion_20250527_222814.json --deviation adev mdev
+"""
+
 import numpy as np
 import matplotlib.pyplot as plt
 import json
 from scipy import signal
 import argparse
 
+DEVIATIONS = ['adev', 'mdev', 'tdev']
+
+def load_frequency_log(data_file, mode):
+    """
+    Load the times and frequencies of a mode from a drift tracker log.
+
+    Args:
+        data_file: Path to the JSON file written by the drift tracker, or to a binary
+            .npz log holding the arrays <mode>_times and <mode>_freqs
+        mode: Name of the mode, ex. 'mode1'
+
+    Returns:
+        times: Array of timestamps in s, or None if the mode is not in the log
+        freqs: Array of frequencies
+    """
+    if data_file.endswith('.npz'):
+        with np.load(data_file) as data:
+            if f'{mode}_times' not in data:
+                return None, None
+            return data[f'{mode}_times'], data[f'{mode}_freqs']
+
+    with open(data_file, 'r') as f:
+        data = json.load(f)
+    if mode not in data:
+        return None, None
+    return np.array(data[mode]['times']), np.array(data[mode]['freqs'])
+
+def bin_time_series(times, values, tau0=None, max_gap=None):
+    """
+    Average a non-uniformly sampled time series in bins of equal length.
+
+    With jittered or random sampling some bins stay empty for any bin length. Empty
+    bins are filled by linear interpolation between the neighboring bins, unless the
+    run of empty bins is longer than max_gap. Such runs are outages and stay gaps.
+
+    Args:
+        times: Array of timestamps
+        values: Array of values
+        tau0: Length of a bin. If None, uses the 90th percentile of the time steps,
+            so that few bins are empty.
+        max_gap: Longest run of empty bins that is interpolated, in the units of
+            times. If None, uses 20 times the median time step.
+
+    Returns:
+        binned: Array of the mean value in each bin, nan for gaps
+        tau0: Length of a bin
+    """
+    order = np.argsort(times)
+    times = np.asarray(times, dtype=np.float64)[order]
+    values = np.asarray(values, dtype=np.float64)[order]
+    steps = np.diff(times)
+    if tau0 is None:
+        tau0 = np.quantile(steps, 0.9)
+    if max_gap is None:
+        max_gap = 20 * np.median(steps)
+
+    bins = ((times - times[0]) / tau0).astype(np.int64)
+    counts = np.bincount(bins)
+    sums = np.bincount(bins, weights=values)
+    occupied = counts > 0
+    binned = np.full(len(counts), np.nan)
+    binned[occupied] = sums[occupied] / counts[occupied]
+
+    # Length of the run of empty bins each empty bin belongs to
+    index = np.arange(len(counts))
+    previous = np.maximum.accumulate(np.where(occupied, index, -1))
+    following = np.minimum.accumulate(np.where(occupied, index, len(counts))[::-1])[::-1]
+    fill = ~occupied & ((following - previous - 1) * tau0 <= max_gap)
+    binned[fill] = np.interp(index[fill], index[occupied], binned[occupied])
+    return binned, tau0
+
+def averaging_factors(num_bins, num_taus=50, max_factor=None):
+    """
+    Get logarithmically spaced averaging factors m, the averaging times are m * tau0.
+
+    Args:
+        num_bins: Number of bins of the time series
+        num_taus: Largest number of averaging times
+        max_factor: Largest factor. If None, uses a quarter of the bins.
+
+    Returns:
+        Array of distinct factors
+    """
+    if max_factor is None:
+        max_factor = num_bins // 4
+    max_factor = max(1, min(max_factor, (num_bins - 1) // 2))
+    return np.unique(np.logspace(0, np.log10(max_factor), num_taus).astype(np.int64))
+
+def window_sums(prefix, start, length):
+    """Sums of the windows [start, start + length) of the series with prefix sums prefix."""
+    return prefix[start + length] - prefix[start]
+
+def overlapping_adev(y, m):
+    """
+    Overlapping Allan deviation of fractional frequencies for an averaging factor.
+
+    The averages of all windows of m bins come from one prefix sum, so the variance
+    of the differences of adjacent averages is computed in O(N).
+
+    Args:
+        y: Array of fractional frequencies, nan for gaps
+        m: Averaging factor
+
+    Returns:
+        deviation: Allan deviation, nan if no term is free of gaps
+        terms: Number of terms averaged
+    """
+    m = int(m)
+    valid = ~np.isnan(y)
+    prefix = np.concatenate(([0], np.cumsum(np.where(valid, y, 0))))
+    prefix_valid = np.concatenate(([0], np.cumsum(valid)))
+
+    start = np.arange(len(y) - 2*m + 1)
+    differences = (window_sums(prefix, start + m, m) - window_sums(prefix, start, m)) / m
+    complete = window_sums(prefix_valid, start, 2*m) == 2*m
+    terms = np.count_nonzero(complete)
+    if terms == 0:
+        return np.nan, 0
+    return np.sqrt(np.sum(differences[complete]**2) / (2 * terms)), terms
+
+def modified_adev(y, m):
+    """
+    Modified Allan deviation of fractional frequencies for an averaging factor.
+
+    The phase is the prefix sum of the frequencies and the sums of its second
+    differences over m adjacent starts come from a second prefix sum, so the
+    deviation is computed in O(N).
+
+    Args:
+        y: Array of fractional frequencies, nan for gaps
+        m: Averaging factor
+
+    Returns:
+        deviation: Modified Allan deviation, nan if no term is free of gaps
+        terms: Number of terms averaged
+    """
+    m = int(m)
+    valid = ~np.isnan(y)
+    # Phase in units of tau0, gaps add no phase but the terms spanning them are dropped
+    x = np.concatenate(([0], np.cumsum(np.where(valid, y, 0))))
+    prefix = np.concatenate(([0], np.cumsum(x)))
+    prefix_valid = np.concatenate(([0], np.cumsum(valid)))
+
+    start = np.arange(len(x) - 3*m + 1)
+    second_differences = (window_sums(prefix, start + 2*m, m) - 2 * window_sums(prefix, start + m, m)
+                          + window_sums(prefix, start, m))
+    complete = window_sums(prefix_valid, start, 3*m - 1) == 3*m - 1
+    terms = np.count_nonzero(complete)
+    if terms == 0:
+        return np.nan, 0
+    variance = np.sum(second_differences[complete]**2) / (2 * float(m)**4 * terms)
+    return np.sqrt(variance), terms
+
+def confidence_interval(deviation, edf, confidence=0.683):
+    """
+    Chi-square confidence interval of a deviation.
+
+    Args:
+        deviation: Estimated deviation
+        edf: Equivalent number of degrees of freedom of its variance
+        confidence: Probability that the interval contains the true deviation
+
+    Returns:
+        low, high: Bounds of the interval
+    """
+    from scipy.stats import chi2
+    alpha = 1 - confidence
+    low = deviation * np.sqrt(edf / chi2.ppf(1 - alpha / 2, edf))
+    high = deviation * np.sqrt(edf / chi2.ppf(alpha / 2, edf))
+    return low, high
+
+def allan_edf(num_phase, m):
+    """Degrees of freedom of the overlapping Allan variance for white frequency noise (Howe)."""
+    return max(1.0, (3 * (num_phase - 1) / (2 * m) - 2 * (num_phase - 2) / num_phase) * 4 * m**2 / (4 * m**2 + 5))
+
+def calculate_deviations(times, freqs, tau0=None, num_taus=50, tau_max=None, confidence=0.683):
+    """
+    Calculate the Allan, modified Allan and time deviation of a frequency log.
+
+    The fractional frequencies are the frequencies relative to their mean, averaged in
+    bins of length tau0. The confidence intervals assume white frequency noise. For the
+    Allan deviation the equivalent degrees of freedom are those of Howe et al. for the
+    overlapping estimator, for the modified Allan and the time deviation the number of
+    terms divided by m.
+
+    Args:
+        times: Array of timestamps in s
+        freqs: Array of frequencies
+        tau0: Length of a bin in s. If None, uses the 90th percentile of the time steps.
+        num_taus: Largest number of averaging times
+        tau_max: Largest averaging time in s. If None, uses a quarter of the total time.
+        confidence: Probability of the confidence intervals
+
+    Returns:
+        Dictionary of arrays over the averaging times:
+            'taus', and for each of 'adev', 'mdev' and 'tdev' the deviation, the
+            bounds '<deviation>_low', '<deviation>_high' and the number of terms
+            '<deviation>_terms'
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    y, tau0 = bin_time_series(times, freqs / np.mean(freqs) - 1, tau0)
+    max_factor = None if tau_max is None else int(tau_max / tau0)
+    factors = averaging_factors(len(y), num_taus, max_factor)
+    taus = factors * tau0
+
+    result = {'taus': taus}
+    for name in DEVIATIONS:
+        for suffix in ['', '_low', '_high']:
+            result[name + suffix] = np.full(len(factors), np.nan)
+        result[name + '_terms'] = np.zeros(len(factors), dtype=np.int64)
+
+    for i, m in enumerate(factors):
+        adev, adev_terms = overlapping_adev(y, m)
+        mdev, mdev_terms = modified_adev(y, m)
+        # The time deviation is the modified Allan deviation scaled to a time error
+        tdev = taus[i] / np.sqrt(3) * mdev
+        estimates = [
+            ('adev', adev, adev_terms, allan_edf(adev_terms + 2*m, m)),
+            ('mdev', mdev, mdev_terms, max(1.0, mdev_terms / m)),
+            ('tdev', tdev, mdev_terms, max(1.0, mdev_terms / m)),
+        ]
+        for name, deviation, terms, edf in estimates:
+            if terms == 0:
+                continue
+            result[name][i] = deviation
+            result[name + '_terms'][i] = terms
+            result[name + '_low'][i], result[name + '_high'][i] = confidence_interval(deviation, edf, confidence)
+
+    missing = np.count_nonzero(np.isnan(result['adev']))
+    if missing > len(factors) // 4:
+        print(f"Warning: No Allan deviation for {missing} of {len(factors)} averaging times, "
+              f"the data has long gaps. Try a longer --tau0.")
+    return result
+
 def calculate_allan_deviation(times, freqs, tau_max=None):
     """
     Calculate Allan deviation for a time series of frequencies.
-    
+
     Args:
         times: Array of timestamps
         freqs: Array of frequencies
         tau_max: Maximum tau to calculate (in seconds). If None, uses half the total time.
-    
+
     Returns:
         taus: Array of tau values
         allan_dev: Array of Allan deviations
     """
-    # Calculate time differences
-    dt = np.diff(times)
-    if not np.allclose(dt, dt[0]):
-        print("Warning: Non-uniform time steps detected")
-    
-    # Calculate fractional frequency
-    y = np.diff(freqs) / freqs[:-1]
-    
-    # Calculate Allan deviation
     if tau_max is None:
-        tau_max = (times[-1] - times[0]) / 2
-    
-    taus = np.logspace(np.log10(dt[0]), np.log10(tau_max), 100)
-    allan_dev = np.zeros_like(taus)
-    
-    for i, tau in enumerate(taus):
-        m = int(tau / dt[0])
-        if m < 2:
-            continue
-            
-        # Calculate Allan variance
-        var = 0
-        for j in range(len(y) - 2*m + 1):
-            var += (np.sum(y[j:j+m]) - np.sum(y[j+m:j+2*m]))**2
-        var /= (2 * (len(y) - 2*m + 1) * m**2)
-        
-        allan_dev[i] = np.sqrt(var)
-    
-    return taus, allan_dev
-
-def plot_allan_deviation(data_file, modes=None):
+        tau_max = (np.max(times) - np.min(times)) / 2
+    result = calculate_deviations(times, freqs, num_taus=100, tau_max=tau_max)
+    return result['taus'], result['adev']
+
+def plot_allan_deviation(data_file, modes=None, deviations=None, tau0=None):
     """
     Load data and plot Allan deviation for each mode.
-    
+
     Args:
-        data_file: Path to the JSON data file
+        data_file: Path to the JSON data file or a binary .npz log
         modes: List of modes to analyze. If None, analyzes all available modes.
+        deviations: List of 'adev', 'mdev' and 'tdev' to plot. If None, plots 'adev'.
+        tau0: Length of the bins the frequencies are averaged in. If None, uses the
+            90th percentile of the time steps.
     """
-    # Load data
-    with open(data_file, 'r') as f:
-        data = json.load(f)
-    
     plt.figure(figsize=(10, 6))
-    
+
     # If no modes specified, use all available modes
     if modes is None:
         modes = ['mode1', 'mode2', 'single_ion']
-    
+    if deviations is None:
+        deviations = ['adev']
+
     # Process each specified mode
     for mode in modes:
-        if mode in data:
-            times = np.array(data[mode]['times'])
-            freqs = np.array(data[mode]['freqs'])
-
-            plt.plot(times, freqs)
-            plt.show()
-            
-            # Calculate Allan deviation
-            taus, allan_dev = calculate_allan_deviation(times, freqs)
-            
-            # Plot
-            plt.loglog(taus, allan_dev, label=mode)
-        else:
+        times, freqs = load_frequency_log(data_file, mode)
+        if times is None:
             print(f"Warning: Mode '{mode}' not found in data file")
-    
+            continue
+        if len(times) < 4:
+            print(f"Warning: Mode '{mode}' has too few points")
+            continue
+
+        plt.plot(times, freqs)
+        plt.show()
+
+        # Calculate deviations
+        result = calculate_deviations(times, freqs, tau0=tau0)
+
+        # Plot with the confidence intervals as error bars
+        for name in deviations:
+            errors = [result[name] - result[name + '_low'], result[name + '_high'] - result[name]]
+            plt.errorbar(result['taus'], result[name], yerr=errors, fmt='o-', capsize=2,
+                         label=f"{mode} {name}")
+
+    plt.xscale('log')
+    plt.yscale('log')
     plt.xlabel('Averaging Time (s)')
-    plt.ylabel('Allan Deviation')
+    plt.ylabel('Deviation (fractional, s for tdev)')
     plt.title('Allan Deviation vs Averaging Time')
     plt.grid(True)
     plt.legend()
@@ -92,9 +323,13 @@ def plot_allan_deviation(data_file, modes=None):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Calculate and plot Allan deviation for frequency data.')
     parser.add_argument('--data-file', type=str, default="./drift_tracker_motion_20250524_001752.json",
-                      help='Path to the JSON data file')
+                      help='Path to the JSON data file or a binary .npz log')
     parser.add_argument('--modes', type=str, nargs='+', choices=['mode1', 'mode2', 'single_ion'],
                       help='Modes to analyze (e.g., --modes mode1 mode2)')
-    
+    parser.add_argument('--deviation', type=str, nargs='+', choices=DEVIATIONS, default=['adev'],
+                      help='Deviations to plot (e.g., --deviation adev mdev)')
+    parser.add_argument('--tau0', type=float, default=None,
+                      help='Length of the bins in s, the 90th percentile of the time steps by default')
+
     args = parser.parse_args()
-    plot_allan_deviation(args.data_file, args.modes)
+    plot_allan_deviation(args.data_file, args.modes, args.deviation, args.tau0)
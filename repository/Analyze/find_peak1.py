@@ -5,6 +5,7 @@ from acf_config.arguments_definition import argument_manager
 from artiq.experiment import *
 
 from scipy.signal import find_peaks
+from scipy.optimize import curve_fit
 from acf.function.fitting import *
 
 # Function to model a Gaussian
@@ -57,6 +57,7 @@ class FreqScan397(_ACFExperiment):
         # Create datasets
         num_samples = len(self.scan_freq_397.sequence)
         self.experiment_data.set_nd_dataset("pmt_counts", [num_samples, self.samples_per_freq], broadcast=True)
+        self.pmt_counts_buffer = self.experiment_data.buffer_dataset("pmt_counts", dtype=np.int32)
         self.experiment_data.set_list_dataset("pmt_counts_avg", num_samples, broadcast=True)
         self.experiment_data.set_list_dataset("frequencies_MHz", num_samples, broadcast=True)
         self.experiment_data.set_list_dataset('fit_signal', num_samples, broadcast=True)
@@ -110,7 +111,7 @@ class FreqScan397(_ACFExperiment):
                 self.seq.ion_store.run() 
                 delay(5*us)
 
-                self.experiment_data.insert_nd_dataset("pmt_counts", [freq_i, sample_i], num_pmt_pulses)
+                self.pmt_counts_buffer.insert([freq_i, sample_i], num_pmt_pulses)
                 total_pmt_counts += num_pmt_pulses
                 self.core.break_realtime()
                 delay(100*us)
@@ -118,7 +119,8 @@ class FreqScan397(_ACFExperiment):
                 
             pmt_counts_avg = total_pmt_counts / self.samples_per_freq
             
-            # Update the datasets
+            # Update the datasets, pmt_counts as one row per frequency
+            self.pmt_counts_buffer.flush()
             self.experiment_data.append_list_dataset("pmt_counts_avg", pmt_counts_avg)
             self.experiment_data.append_list_dataset("frequencies_MHz", freq_397/MHz)
             
@@ -128,7 +130,7 @@ class FreqScan397(_ACFExperiment):
         
         self.seq.ion_store.run()
     def analyze(self):
-
+        self.experiment_data.close()
             
         freq=self.get_dataset("frequencies_MHz")
         PMT_count=self.get_dataset('pmt_counts_avg')
@@ -222,7 +222,7 @@ class FreqScan854(_ACFExperiment):
             freq=self.get_dataset("frequencies_MHz")
             PMT_count=self.get_dataset('pmt_counts_avg')
 
-            self.fitting_func.fit(freq, PMT_count)
+            self.fitting_func.fit(freq, PMT_count, dataset="pmt_counts_avg")
 
     
 
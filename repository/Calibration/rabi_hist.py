@@ -6,6 +6,7 @@ from acf_sequences.sequences import sequences
 
 import numpy as np
 from utils_func.otsu import otsu_threshold_manual
+from utils_func.poisson_readout import PoissonReadout
 
 class HistScan(_ACFExperiment):
 
@@ -134,3 +135,24 @@ class HistScan(_ACFExperiment):
             print("Failed to find threshold")
         
         
+
+        # The first half of the shots is bright, the second half read out with the 866 off
+        try:
+            raw_data = np.array(self.raw_data, dtype=np.float64)
+            bright_counts = raw_data[:self.samples]
+            dark_counts = raw_data[self.samples:]
+            readout = PoissonReadout.from_labeled(dark_counts[~np.isnan(dark_counts)],
+                                                  bright_counts[~np.isnan(bright_counts)])
+        except ValueError as e:
+            print("Failed to fit the readout model: ", e)
+            return
+
+        print(readout)
+        print("Maximum-likelihood threshold: ", readout.thresholds()[0],
+              " error dark, bright: ", readout.error_rates())
+        mean_time, error = readout.early_termination_performance(*readout.early_termination(10))
+        print("Early termination in 10 slices, mean readout time dark, bright: ", mean_time,
+              " error: ", error)
+        self.experiment_data.set_list_dataset("readout_model", 2, broadcast=True)
+        self.experiment_data.append_list_dataset("readout_model", readout.background)
+        self.experiment_data.append_list_dataset("readout_model", readout.ion_rate)
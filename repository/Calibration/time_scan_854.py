@@ -199,7 +199,7 @@ class TimeScan854(_ACFExperiment):
             freq=self.get_dataset("time")
             PMT_count=self.get_dataset('pmt_counts_avg')
 
-            self.fitting_func.fit(freq, PMT_count)
+            self.fitting_func.fit(freq, PMT_count, dataset="pmt_counts_avg")
 
     
 
@@ -1,10 +1,13 @@
 from acf.experiment import _ACFExperiment
+from acf.scan import Scan, add_scan_arguments
+from acf.adaptive_frequency_scan import AdaptiveFrequencyScan
 from acf_sequences.sequences import sequences
 from acf_config.arguments_definition import argument_manager
 
 from artiq.experiment import *
 
 from acf.function.fitting import *
+import numpy as np
 
 
 class RabiFreqScan(_ACFExperiment):
@@ -78,6 +81,30 @@ class RabiFreqScan(_ACFExperiment):
         )
         
         self.setattr_argument("enable_sideband_cool", BooleanValue(False))
+        add_scan_arguments(self)
+        self.setattr_argument(
+            "adaptive_frequency_scan", BooleanValue(False),
+            tooltip="Refine the scan around the fitted resonance after the coarse scan",
+            group="Adaptive frequency scan"
+        )
+        self.setattr_argument(
+            "target_center_uncertainty",
+            NumberValue(default=1*kHz, min=0*kHz, unit="kHz", precision=3),
+            tooltip="Standard error of the fitted center at which the scan stops",
+            group="Adaptive frequency scan"
+        )
+        self.setattr_argument(
+            "points_per_pass",
+            NumberValue(default=10, precision=0, step=1, min=2),
+            tooltip="Number of frequencies added by every refining pass",
+            group="Adaptive frequency scan"
+        )
+        self.setattr_argument(
+            "max_passes",
+            NumberValue(default=5, precision=0, step=1, min=0),
+            tooltip="Maximum number of refining passes",
+            group="Adaptive frequency scan"
+        )
         self.setattr_argument("enable_collision_detection", BooleanValue(True))  
         self.setattr_argument("enable_thresholding", BooleanValue(True))
         self.setattr_argument(
@@ -144,13 +171,32 @@ class RabiFreqScan(_ACFExperiment):
     def prepare(self):
          # Create datasets
         num_freq_samples = len(self.scan_freq_729_dp.sequence)
-        self.experiment_data.set_nd_dataset("pmt_counts", [num_freq_samples, self.samples_per_freq], broadcast=True)
-        
-        # Dataset mainly for plotting
-        self.experiment_data.set_list_dataset("pmt_counts_avg", num_freq_samples, broadcast=True)
-        self.experiment_data.set_list_dataset("frequencies_MHz", num_freq_samples, broadcast=True)
-
-        self.experiment_data.set_list_dataset('fit_signal', num_freq_samples, broadcast=True)
+        scan_options = dict(
+            result_name="pmt_counts_avg",
+            order=self.scan_order,
+            target_width=self.target_width if self.adaptive_sampling else None,
+            interval=self.confidence_interval,
+            thresholding=self.enable_thresholding,
+            negate_mean=True,
+            collision_detection=self.enable_collision_detection,
+            track_threshold=self.track_threshold
+        )
+        if self.adaptive_frequency_scan:
+            self.scan = AdaptiveFrequencyScan(
+                self, "frequencies_MHz", self.scan_freq_729_dp.sequence,
+                self.samples_per_freq, self.threshold_pmt_count, self.target_center_uncertainty,
+                points_per_pass=int(self.points_per_pass),
+                max_passes=int(self.max_passes),
+                **scan_options
+            )
+        else:
+            self.scan = Scan(
+                self, [("frequencies_MHz", self.scan_freq_729_dp.sequence, MHz)],
+                self.samples_per_freq, self.threshold_pmt_count,
+                **scan_options
+            )
+            self.experiment_data.set_list_dataset('fit_signal', num_freq_samples, broadcast=True)
+            self.fitting_func.enable_online("frequencies_MHz", "pmt_counts_avg")
 
         # Enable live plotting
         self.experiment_data.enable_experiment_monitor(
@@ -162,6 +208,46 @@ class RabiFreqScan(_ACFExperiment):
 
 
 
+    @kernel
+    def scan_shot(self, point) -> TInt32:
+        freq_729_dp = point[0]
+
+        # #line trigger
+        # if self.seq.ac_trigger.run(self.core, self.core.seconds_to_mu(5*ms), self.core.seconds_to_mu(2*ms) ) <0 : 
+        #     return -1
+
+        # Ensure timeline is safely ahead before SPI-heavy repump sequence
+        self.core.break_realtime()
+        delay(1*ms)
+        #854 repump
+        self.seq.repump_854.run()
+        # Cool
+        self.seq.doppler_cool.run()
+
+        # if self.enable_sideband_cool:
+        #     self.seq.sideband_cool.run()
+        # else:
+        #     self.seq.op_pump.run()
+        # delay(5*us)
+
+        # if self.enable_pi_pulse:
+        #     #self.rabi(self.PI_drive_time, self.freq_729_pi,0.0)
+        #     self.seq.rabi.run(self.PI_drive_time,
+        #                     self.freq_729_dp_pi,
+        #                     self.att_729_dp_pi,
+        #         )
+
+        # Attempt Rabi flop
+        self.seq.rabi.run(self.rabi_t,
+                        freq_729_dp,
+                        self.att_729_dp
+        )
+
+        #qubit readout
+        num_pmt_pulses=self.seq.readout_397.run()
+        delay(2*ms)
+        return num_pmt_pulses
+
     @kernel
     def run(self):
         print("Running the script")
@@ -169,125 +255,29 @@ class RabiFreqScan(_ACFExperiment):
         self.seq.ion_store.run()
         delay(50*us)
 
-        freq_i = 0
-        while freq_i < len(self.scan_freq_729_dp.sequence):
-
-            freq_729_dp=self.scan_freq_729_dp.sequence[freq_i]
-            self.core.break_realtime()
-            delay(100*us)
-            self.dds_729_dp.set(freq_729_dp)
-
-            #PMT
-            total_thresh_count = 0
-            total_pmt_counts = 0
-            sample_num=0
-
-            self.seq.ion_store.run()
-            # Collision Detection
-            is_ion_good = True
-            num_try_save_ion = 0 
-            delay(200*us)
-
-            while sample_num<self.samples_per_freq:
-                if is_ion_good:
-                    # #line trigger
-                    # if self.seq.ac_trigger.run(self.core, self.core.seconds_to_mu(5*ms), self.core.seconds_to_mu(2*ms) ) <0 : 
-                    #     continue
-                    
-                    # Ensure timeline is safely ahead before SPI-heavy repump sequence
-                    self.core.break_realtime()
-                    delay(1*ms)
-                    #854 repump
-                    self.seq.repump_854.run()
-                    # Cool
-                    self.seq.doppler_cool.run()
-
-                    # if self.enable_sideband_cool:
-                    #     self.seq.sideband_cool.run()
-                    # else:
-                    #     self.seq.op_pump.run()
-                    # delay(5*us)
-                    
-                    # if self.enable_pi_pulse:
-                    #     #self.rabi(self.PI_drive_time, self.freq_729_pi,0.0)
-                    #     self.seq.rabi.run(self.PI_drive_time,
-                    #                     self.freq_729_dp_pi,
-                    #                     self.att_729_dp_pi,
-                    #         )
-
-                    # Attempt Rabi flop
-                    self.seq.rabi.run(self.rabi_t,
-                                    freq_729_dp,
-                                    self.att_729_dp
-                    )
-
-                    #qubit readout
-                    num_pmt_pulses=self.seq.readout_397.run()
-
-                    if num_pmt_pulses < self.threshold_pmt_count and self.enable_collision_detection:
-
-                        # collision detection
-                        self.seq.repump_854.run()
-                        self.seq.doppler_cool.run()
-                        num_pmt_pulses_detect=self.seq.readout_397.run()
-                        self.seq.ion_store.run()
-                        delay(20*us)
-
-                        if num_pmt_pulses_detect < self.threshold_pmt_count:
-                            is_ion_good = False
-                            
-                    if is_ion_good:
-                        sample_num+=1
-                        # Update dataset
-                        self.experiment_data.insert_nd_dataset("pmt_counts",
-                                                    [freq_i, sample_num],
-                                                    num_pmt_pulses)
-                        
-                        if num_pmt_pulses < self.threshold_pmt_count:
-                            total_thresh_count += 1
-
-                        total_pmt_counts += num_pmt_pulses
-
-                        delay(2*ms)
-                else:
-                    self.seq.ion_store.run()
-                    delay(0.2*s)
-                    self.seq.doppler_cool.run()
-                    num_pmt_pulses_detect=self.seq.readout_397.run()
-                    if num_pmt_pulses_detect >= self.threshold_pmt_count:
-                        is_ion_good = True
-                        num_try_save_ion = 0
-                    else:
-                        num_try_save_ion += 1
-                    
-                    if(num_try_save_ion>60):
-                        print("Ion Lost!!!")
-                        time_i=len(self.scan_freq_729_dp.sequence)+100
-                        sample_num+=10000
-                        break
-                     
-            
-            self.experiment_data.append_list_dataset("frequencies_MHz", freq_729_dp / MHz)
-            if not self.enable_thresholding:
-                self.experiment_data.append_list_dataset("pmt_counts_avg",
-                                          -float(total_pmt_counts) / self.samples_per_freq)
-            else:
-                self.experiment_data.append_list_dataset("pmt_counts_avg",
-                                          float(total_thresh_count) / self.samples_per_freq)
-            freq_i += 1
-            
-            delay(5*ms)
+        self.scan.run()
 
         self.seq.ion_store.run()
 
     def analyze(self):
-
+        self.experiment_data.close()
             
-        freq=self.get_dataset("frequencies_MHz")
-        PMT_count=self.get_dataset('pmt_counts_avg')
-
-        peak=self.fitting_func.fit(freq, PMT_count)[1]
-
+        if self.adaptive_frequency_scan:
+            # Fitted after every pass while scanning
+            peak=self.get_dataset("frequencies_MHz_center")
+        else:
+            freq=self.get_dataset("frequencies_MHz")
+            PMT_count=self.get_dataset('pmt_counts_avg')
+
+            # Start from the last fit, or the stored line frequency on the first run
+            params=self.fitting_func.fit(freq, PMT_count, dataset="pmt_counts_avg",
+                                         param="qubit/S1_2_D3_2", param_scale=MHz)
+            peak=np.nan if params is None else params[1]
+
+        # No fit, ex. the fit failed or the ion was lost before the first pass
+        if not np.isfinite(peak):
+            print("No fitted line center, not updating the line frequency")
+            return
 
         with self.interactive("Ca+ line") as inter:
             inter.setattr_argument(
@@ -1,4 +1,5 @@
 from acf.experiment import _ACFExperiment
+from acf.scan import Scan, add_scan_arguments
 from acf_sequences.sequences import sequences
 from acf_config.arguments_definition import argument_manager
 
@@ -94,6 +95,7 @@ class RabiTimeScan(_ACFExperiment):
         )
 
         self.setattr_argument("cooling_option", EnumerationValue(["sidebandcool", "opticalpumping"], default="opticalpumping"))
+        add_scan_arguments(self)
         self.setattr_argument("enable_collision_detection", BooleanValue(True))     
         self.setattr_argument("enable_thresholding", BooleanValue(True))
         self.setattr_argument(
@@ -239,11 +241,19 @@ class RabiTimeScan(_ACFExperiment):
     def prepare(self):
         self.fitting_func.setup(len(self.scan_rabi_t.sequence))
         # Create datasets
-        num_freq_samples = len(self.scan_rabi_t.sequence)
-        self.experiment_data.set_nd_dataset("pmt_counts", [num_freq_samples, self.samples_per_time], broadcast=True)
-        self.experiment_data.set_list_dataset("pmt_counts_avg_thresholded", num_freq_samples, broadcast=True)
-        self.experiment_data.set_list_dataset("rabi_t", num_freq_samples, broadcast=True)
+        self.scan = Scan(
+            self, [("rabi_t", self.scan_rabi_t.sequence, us)],
+            self.samples_per_time, self.threshold_pmt_count,
+            result_name="pmt_counts_avg_thresholded",
+            order=self.scan_order,
+            target_width=self.target_width if self.adaptive_sampling else None,
+            interval=self.confidence_interval,
+            thresholding=self.enable_thresholding,
+            collision_detection=self.enable_collision_detection,
+            track_threshold=self.track_threshold
+        )
         #self.experiment_data.set_list_dataset('fit_signal', num_freq_samples, broadcast=True)
+        self.fitting_func.enable_online("rabi_t", "pmt_counts_avg_thresholded")
 
         # Enable live plotting
         self.experiment_data.enable_experiment_monitor(
@@ -257,6 +267,51 @@ class RabiTimeScan(_ACFExperiment):
 
         print(stark_shift(self.parameter_manager, self.freq_729_dp, self.Rabi_freq)/2.0)
 
+    @kernel
+    def scan_shot(self, point) -> TInt32:
+        rabi_t = point[0]
+
+        # #line trigger
+        # if self.seq.ac_trigger.run(self.core, self.core.seconds_to_mu(25*ms), self.core.seconds_to_mu(50*us) ) <0 : 
+        #     return -1
+
+        delay(500*us)
+
+        #854 repump
+        self.seq.repump_854.run()
+
+        # #  Cool
+        # # self.seq.doppler_cool.run()
+        # self.seq.doppler_cool.run()
+        # if self.cooling_option == "sidebandcool":
+        #     self.seq.sideband_cool.run()
+        # else:
+        #     self.seq.op_pump.run()
+        # # delay(100*ms)
+        # self.core.break_realtime()
+
+        # Apply pi pulse after sideband cooling to get the initial state |1>
+        # if self.enable_pi_pulse:
+        #     #self.rabi(self.PI_drive_time, self.freq_729_pi,0.0)
+        #     self.seq.rabi.run(self.PI_drive_time,
+        #                 self.freq_729_dp_pi,
+        #                 self.att_729_dp_pi,
+        #     )
+        #self.ttl_shuttling_awg_trigger.pulse(1*us)
+        #delay(300*us)
+
+        self.core.break_realtime()
+
+        self.seq.rabi.run(
+            rabi_t,
+            self.freq_729_dp,
+            self.att_729_dp
+        )
+
+        #qubit readout
+        num_pmt_pulses=self.seq.readout_397.run()
+        delay(2*ms)
+        return num_pmt_pulses
 
     @kernel
     def run(self):
@@ -266,124 +321,16 @@ class RabiTimeScan(_ACFExperiment):
         self.seq.ion_store.run()
         self.core.break_realtime()
 
-        time_i = 0
-        delay(50*us)
-        
-        while time_i < len(self.scan_rabi_t.sequence):
-            
-            rabi_t=self.scan_rabi_t.sequence[time_i]
-            total_thresh_count = 0
-            total_pmt_counts = 0
-            sample_num=0
-
-            # Cool
-            self.seq.ion_store.run()
-
-            # Collision Detection
-            is_ion_good = True
-            num_try_save_ion = 0 
-            delay(2*us)
-
-            while sample_num<self.samples_per_time:
-                if is_ion_good:
-                    # #line trigger
-                    # if self.seq.ac_trigger.run(self.core, self.core.seconds_to_mu(25*ms), self.core.seconds_to_mu(50*us) ) <0 : 
-                    #     continue
-                
-                    delay(500*us)
-
-                    #854 repump
-                    self.seq.repump_854.run()
-                    
-                    # #  Cool
-                    # # self.seq.doppler_cool.run()
-                    # self.seq.doppler_cool.run()
-                    # if self.cooling_option == "sidebandcool":
-                    #     self.seq.sideband_cool.run()
-                    # else:
-                    #     self.seq.op_pump.run()
-                    # # delay(100*ms)
-                    # self.core.break_realtime()
-
-                    # Apply pi pulse after sideband cooling to get the initial state |1>
-                    # if self.enable_pi_pulse:
-                    #     #self.rabi(self.PI_drive_time, self.freq_729_pi,0.0)
-                    #     self.seq.rabi.run(self.PI_drive_time,
-                    #                 self.freq_729_dp_pi,
-                    #                 self.att_729_dp_pi,
-                    #     )
-                    #self.ttl_shuttling_awg_trigger.pulse(1*us)
-                    #delay(300*us)
-
-                    self.core.break_realtime()
-
-                    self.seq.rabi.run(
-                        rabi_t,
-                        self.freq_729_dp,
-                        self.att_729_dp
-                    )
-
-                    #qubit readout
-                    num_pmt_pulses=self.seq.readout_397.run()
-                    
-
-                    if num_pmt_pulses < self.threshold_pmt_count and self.enable_collision_detection:
-
-                        # collision detection
-                        self.seq.repump_854.run()
-                        self.seq.doppler_cool.run()
-                        num_pmt_pulses_detect=self.seq.readout_397.run()
-                        self.seq.ion_store.run()
-                        delay(20*us)
-
-                        if num_pmt_pulses_detect < self.threshold_pmt_count:
-                            is_ion_good = False
-                            
-                    if is_ion_good:
-                        sample_num+=1
-                        # Update dataset
-                        self.experiment_data.insert_nd_dataset("pmt_counts",
-                                                    [time_i, sample_num],
-                                                    num_pmt_pulses)
-                        
-                        if num_pmt_pulses < self.threshold_pmt_count:
-                            total_thresh_count += 1
-
-                        total_pmt_counts += num_pmt_pulses
-
-                        delay(2*ms)
-                else:
-                    self.seq.ion_store.run()
-                    delay(0.2*s)
-                    self.seq.doppler_cool.run()
-                    num_pmt_pulses_detect=self.seq.readout_397.run()
-                    if num_pmt_pulses_detect >= self.threshold_pmt_count:
-                        is_ion_good = True
-                        num_try_save_ion = 0
-                    else:
-                        num_try_save_ion += 1
-                    
-                    if(num_try_save_ion>60):
-                        print("Ion Lost!!!")
-                        time_i=len(self.scan_rabi_t.sequence)+100
-                        sample_num+=10000
-                        break
-                     
-            
-            self.experiment_data.append_list_dataset("rabi_t", rabi_t / us)
-
-            if self.enable_thresholding:
-                self.experiment_data.append_list_dataset("pmt_counts_avg_thresholded",
-                                          float(total_thresh_count) / self.samples_per_time)
-            else:
-                self.experiment_data.append_list_dataset("pmt_counts_avg_thresholded",
-                                          float(total_pmt_counts) / self.samples_per_time)
-            time_i+=1
-            delay(1*ms)
+        self.scan.run()
 
         self.seq.ion_store.run()
         self.core.break_realtime()
 
+    def analyze(self):
+        # Publish the fit of the last points
+        self.experiment_data.close()
+        self.fitting_func.stop_online()
+
     # def analyze(self):
     #     rabi_time=self.get_dataset("rabi_t")
     #     rabi_PMT=self.get_dataset('pmt_counts_avg_thresholded')
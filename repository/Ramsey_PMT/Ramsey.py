@@ -1,4 +1,5 @@
 from acf.experiment import _ACFExperiment
+from acf.scan import Scan, add_scan_arguments
 from acf_sequences.sequences import sequences
 from acf_config.arguments_definition import argument_manager
 
@@ -50,6 +51,7 @@ class Ramsey_Scan(_ACFExperiment):
             NumberValue(default=50, precision=0, step=1),
             tooltip="Number of samples to take for each scan configuration",
         )
+        add_scan_arguments(self)
         self.setattr_argument("enable_thresholding", BooleanValue(True))
         self.setattr_argument(
             "threshold_pmt_count",
@@ -131,57 +133,42 @@ class Ramsey_Scan(_ACFExperiment):
         self.scan_name='Ramsey_wait_time_(us)'
 
     def prepare(self):
-        scan_length=max(len(self.Ramsey_wait_time.sequence), max(len(self.Ramsey_pulse_time.sequence),len(self.Ramsey_phase.sequence)))
-       
-        
-        self.scan_param0 =[0.0 *us for i in range(scan_length)] 
-        self.scan_param1 =[0.0 *us for i in range(scan_length)]
-        self.scan_param2 =[0.0 for i in range(scan_length)]        
-        self.scan_axis=[0.0 for i in range(scan_length)]   
-        self.num_scan_samples = 0
-
         if self.Scan_Type == "Ramsey_wait_time":
-            for i in range(len(self.Ramsey_wait_time.sequence)):
-                self.scan_param0[i]=self.Ramsey_wait_time.sequence[i]
-                self.scan_param1[i]=self.Ramsey_pulse_time_single
-                self.scan_param2[i]=self.Ramsey_phase_single
-
-                self.scan_axis[i]=self.Ramsey_wait_time.sequence[i]/us
-            self.num_scan_samples=len(self.Ramsey_wait_time.sequence)
+            scan_length=len(self.Ramsey_wait_time.sequence)
+            wait_times=self.Ramsey_wait_time.sequence
+            pulse_times=np.full(scan_length, self.Ramsey_pulse_time_single)
+            phases=np.full(scan_length, self.Ramsey_phase_single)
             self.scan_name='Ramsey_wait_time_(us)'
 
-
         elif self.Scan_Type == "Ramsey_pulse_time":
-            for i in range(len(self.Ramsey_pulse_time.sequence)):
-                self.scan_param0[i]=self.Ramsey_wait_time_single
-                self.scan_param1[i]=self.Ramsey_pulse_time.sequence[i]
-                self.scan_param2[i]=self.Ramsey_phase_single
-
-                self.scan_axis[i]=self.Ramsey_pulse_time.sequence[i]/us
-            self.num_scan_samples=len(self.Ramsey_pulse_time.sequence)
+            scan_length=len(self.Ramsey_pulse_time.sequence)
+            wait_times=np.full(scan_length, self.Ramsey_wait_time_single)
+            pulse_times=self.Ramsey_pulse_time.sequence
+            phases=np.full(scan_length, self.Ramsey_phase_single)
             self.scan_name='Ramsey_pulse_time_(us)'
 
-
-        
         else: #"Ramsey_phase"
-            for i in range(len(self.Ramsey_phase.sequence)):
-                self.scan_param0[i]=self.Ramsey_wait_time_single
-                self.scan_param1[i]=self.Ramsey_pulse_time_single
-                self.scan_param2[i]=self.Ramsey_phase.sequence[i]
-
-                self.scan_axis[i]=self.Ramsey_phase.sequence[i]
-            self.num_scan_samples=len(self.Ramsey_phase.sequence)
+            scan_length=len(self.Ramsey_phase.sequence)
+            wait_times=np.full(scan_length, self.Ramsey_wait_time_single)
+            pulse_times=np.full(scan_length, self.Ramsey_pulse_time_single)
+            phases=self.Ramsey_phase.sequence
             self.scan_name='Ramsey_phase_(turns)'
 
-
-
-
-        # create datasets
-        self.experiment_data.set_nd_dataset("pmt_counts", [scan_length, self.samples_per_scan], broadcast=True)
-        
-        # Dataset mainly for plotting
-        self.experiment_data.set_list_dataset("pmt_counts_avg", scan_length, broadcast=True)
-        self.experiment_data.set_list_dataset(self.scan_name, scan_length, broadcast=True)
+        # create datasets, the parameters are scanned together
+        self.scan = Scan(
+            self,
+            [('Ramsey_wait_time_(us)', wait_times, us),
+             ('Ramsey_pulse_time_(us)', pulse_times, us),
+             ('Ramsey_phase_(turns)', phases)],
+            self.samples_per_scan, self.threshold_pmt_count,
+            result_name="pmt_counts_avg",
+            grid=False,
+            order=self.scan_order,
+            target_width=self.target_width if self.adaptive_sampling else None,
+            interval=self.confidence_interval,
+            thresholding=self.enable_thresholding,
+            track_threshold=self.track_threshold
+        )
 
         # # Enable live plotting
         self.experiment_data.enable_experiment_monitor(
@@ -240,6 +227,42 @@ class Ramsey_Scan(_ACFExperiment):
 
         self.rabi(pulse_time,phase)
 
+    @kernel
+    def scan_shot(self, point) -> TInt32:
+
+        #the parameter for scanning in this shot
+        wait_time_here=point[0]
+        pulse_time_here=point[1]
+        phase_here=point[2]
+
+        #line trigger
+        if self.seq.ac_trigger.run(self.core, self.core.seconds_to_mu(25*ms), self.core.seconds_to_mu(50*us) ) <0 : 
+            return -1
+        delay(100*us)
+
+        #854 repump
+        self.seq.repump_854.run()
+        # Cool
+        self.seq.doppler_cool.run()
+        self.seq.sideband_cool.run()
+
+        if self.Motional_Ramsey:
+            self.Ramsey_Motion(pulse_time=pulse_time_here, wait_time=wait_time_here, phase=phase_here)
+        else:
+            self.Ramsey(pulse_time=pulse_time_here, wait_time=wait_time_here, phase=phase_here)
+
+         #qubit readout
+        num_pmt_pulses=self.seq.readout_397.run()
+
+        # 854 repump
+        self.seq.repump_854.run()
+
+        #protect ion
+        self.seq.ion_store.run()
+
+        delay(1*ms)
+        return num_pmt_pulses
+
     @kernel
     def run(self):
 
@@ -248,69 +271,7 @@ class Ramsey_Scan(_ACFExperiment):
         self.seq.ion_store.run()
         delay(1*ms)
 
-        for iter in range(self.num_scan_samples): # scan the frequency
-            
-            #the parameter for scanning in this iteration
-            phase_here=self.scan_param2[iter]
-            wait_time_here=self.scan_param0[iter]
-            pulse_time_here=self.scan_param1[iter]
-
-            total_thresh_count = 0
-            total_pmt_counts = 0
-
-            sample_num=0
-
-            self.seq.ion_store.run()
-            delay(500*us)
-
-            while sample_num<self.samples_per_scan:
-
-                #line trigger
-                if self.seq.ac_trigger.run(self.core, self.core.seconds_to_mu(25*ms), self.core.seconds_to_mu(50*us) ) <0 : 
-                    continue
-                sample_num+=1
-                delay(100*us)
-
-                #854 repump
-                self.seq.repump_854.run()
-                # Cool
-                self.seq.doppler_cool.run()
-                self.seq.sideband_cool.run()
-
-                if self.Motional_Ramsey:
-                    self.Ramsey_Motion(pulse_time=pulse_time_here, wait_time=wait_time_here, phase=phase_here)
-                else:
-                    self.Ramsey(pulse_time=pulse_time_here, wait_time=wait_time_here, phase=phase_here)
-                
-                 #qubit readout
-                num_pmt_pulses=self.seq.readout_397.run()
-
-                # 854 repump
-                self.seq.repump_854.run()
-                
-                #protect ion
-                self.seq.ion_store.run()
-
-                #Update dataset
-                self.experiment_data.insert_nd_dataset("pmt_counts",
-                                            [iter, sample_num],
-                                            num_pmt_pulses)
-                                            
-                #update the total count & thresholded events
-                total_pmt_counts += num_pmt_pulses
-                if num_pmt_pulses < self.threshold_pmt_count:
-                    total_thresh_count += 1
-
-                delay(1*ms)
-                
-            self.experiment_data.append_list_dataset(self.scan_name, self.scan_axis[iter])
-
-            if not self.enable_thresholding:
-            	self.experiment_data.append_list_dataset("pmt_counts_avg", float(total_pmt_counts) / self.samples_per_scan)
-            else:
-            	self.experiment_data.append_list_dataset("pmt_counts_avg", float(total_thresh_count) / self.samples_per_scan)
-            
-            delay(5*ms)
+        self.scan.run()
 
         self.seq.ion_store.run()
         
@@ -0,0 +1,99 @@
+from acf.experiment import _ACFExperiment
+from acf_sequences.sequences import sequences
+
+from artiq.experiment import *
+
+import numpy as np
+
+
+class ReadoutRateBenchmark(_ACFExperiment):
+    """Measure the shot rate of a threshold scan shot.
+
+    Every shot is the part of a threshold scan that repeats per sample: 854 repump,
+    optional Doppler cooling and the 397 readout. The same shots are timed twice, once
+    with the previous readout that synchronized with the RTIO counter four times per
+    shot, and once with ReadOut397.run. Shots per second and the smallest slack seen by
+    the sequences are printed and stored in datasets.
+    """
+
+    def build(self):
+        self.setup(sequences)
+
+        self.seq.readout_397.add_arguments_to_gui()
+        self.seq.repump_854.add_arguments_to_gui()
+
+        self.setattr_argument(
+            "num_shots",
+            NumberValue(default=1000, precision=0, step=1, min=1),
+            tooltip="Number of shots timed for each readout"
+        )
+        self.setattr_argument(
+            "enable_doppler_cool",
+            BooleanValue(False),
+            tooltip="Doppler cool in every shot"
+        )
+
+    def prepare(self):
+        self.experiment_data.set_list_dataset("benchmark_shots_per_s", 2, broadcast=True)
+        self.durations_mu = np.zeros(2, dtype=np.int64)
+
+    @kernel
+    def legacy_readout(self) -> TInt32:
+        # Readout as it was before ReadOut397.run used ensure_slack
+        readout = self.seq.readout_397
+
+        self.core.break_realtime()
+        delay(10*us)
+        self.dds_397_dp.set_att(readout.attenuation_397)
+        self.dds_397_dp.set(readout.frequency_397_resonance)
+        self.core.break_realtime()
+        delay(10*us)
+        self.dds_866_dp.set(readout.frequency_866_cooling)
+        self.dds_866_dp.set_att(readout.attenuation_866)
+        self.core.break_realtime()
+        delay(10*us)
+        self.dds_729_dp.sw.off()
+        self.dds_397_dp.sw.on()
+        self.dds_866_dp.sw.on()
+        self.core.break_realtime()
+        delay(10*us)
+
+        num_pmt_pulses = self.ttl_pmt_input.count(
+            self.ttl_pmt_input.gate_rising(readout.readout_pmt_sampling_time)
+        )
+        delay(20*us)
+        self.dds_397_dp.sw.off()
+        self.dds_866_dp.sw.off()
+        delay(20*us)
+        return num_pmt_pulses
+
+    @kernel
+    def time_shots(self, legacy) -> TInt64:
+        self.core.break_realtime()
+        delay(1*ms)
+        start = self.core.get_rtio_counter_mu()
+        for i in range(self.num_shots):
+            self.seq.repump_854.run()
+            if self.enable_doppler_cool:
+                self.seq.doppler_cool.run()
+            if legacy:
+                self.legacy_readout()
+            else:
+                self.seq.readout_397.run()
+        self.core.wait_until_mu(now_mu())
+        return self.core.get_rtio_counter_mu() - start
+
+    @kernel
+    def run(self):
+        self.setup_run()
+        self.durations_mu[0] = self.time_shots(True)
+        self.durations_mu[1] = self.time_shots(False)
+        self.seq.ion_store.run()
+
+    def analyze(self):
+        for name, duration_mu in zip(["legacy", "ensure_slack"], self.durations_mu):
+            shots_per_s = self.num_shots / self.core.mu_to_seconds(duration_mu)
+            self.experiment_data.append_list_dataset("benchmark_shots_per_s", shots_per_s)
+            print(f"{name}: {shots_per_s:.1f} shots/s")
+        print(f"Smallest slack in readout: {self.core.mu_to_seconds(self.seq.readout_397.min_slack_mu)*1e6:.1f} us, "
+              f"timeline moved {self.seq.readout_397.slack_resyncs} times")
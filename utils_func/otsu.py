@@ -2,12 +2,65 @@
 Thresholding algorithms for image processing and data analysis.
 This module provides implementations of Otsu's method and Kapur's entropy thresholding
 for finding optimal threshold values in data distributions.
+
+Every method is computed from a histogram with cumulative sums, so all two-class
+thresholds are evaluated in O(nbins) after the histogram is built. The *_hist functions
+take a histogram directly, ex. one accumulated on the core device.
 """
 
 from typing import Optional, Union, List
+import logging
 import numpy as np
 import numpy.typing as npt
 
+logger = logging.getLogger(__name__)
+
+
+def histogram(data: Union[List[float], npt.ArrayLike], nbins: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the histogram used by the thresholding methods.
+    
+    Parameters:
+    -----------
+    data : array-like
+        Input 1D array of numerical data.
+    nbins : int
+        Number of bins spanning the range of the data.
+        
+    Returns:
+    --------
+    tuple
+        (counts, bin_edges)
+    """
+    data = np.array(data, dtype=np.float32)
+    return np.histogram(data, bins=nbins, range=(data.min(), data.max()))
+
+
+def plateau_center(values: np.ndarray) -> int:
+    """
+    Find the index of the maximum of a criterion, centered on its plateau.
+    
+    Empty bins between two occupied bins do not change any class, so the criterion
+    is flat over them and the maximum is a run of values equal up to rounding.
+    The center of the run is the threshold halfway between the occupied bins.
+    
+    Parameters:
+    -----------
+    values : np.ndarray
+        Criterion for each threshold, -inf where not valid.
+        
+    Returns:
+    --------
+    int
+        Index of the center of the first run of maximal values.
+    """
+    start = np.argmax(values)
+    tolerance = 1e-9 * abs(values[start])
+    stop = start + 1
+    while stop < len(values) and abs(values[stop] - values[start]) <= tolerance:
+        stop += 1
+    return (start + stop - 1) // 2
+
 
 def otsu_threshold_manual(data: Union[List[float], npt.ArrayLike], mid: Optional[float] = None) -> float:
     """
@@ -33,46 +86,55 @@ def otsu_threshold_manual(data: Union[List[float], npt.ArrayLike], mid: Optional
     - The function uses 512 bins for histogram calculation
     - Handles edge cases where probabilities sum to zero
     """
-    # Convert to NumPy array if not already
-    data = np.array(data, dtype=np.float32)
-    
-    # Number of bins for histogram
-    bins_num = 512
-    
-    # Compute histogram and probabilities
-    hist, bin_edges = np.histogram(data, bins=bins_num, range=(data.min(), data.max()))
-    probabilities = hist / hist.sum()  # Normalize to probabilities
-    
-    # Compute bin midpoints
-    bin_mids = (bin_edges[:-1] + bin_edges[1:]) / 2
+    hist, bin_edges = histogram(data, 512)
+    return otsu_threshold_hist(hist, bin_edges)
+
+
+def otsu_threshold_hist(hist: npt.ArrayLike, bin_edges: npt.ArrayLike) -> float:
+    """
+    Compute the Otsu threshold of a histogram.
     
-    # Initialize variables for tracking the optimal threshold
-    max_variance = 0
-    optimal_threshold = 0
+    The threshold is the midpoint of the last bin of the lower class, 0 if no
+    threshold separates the data.
     
-    # Iterate over possible thresholds
-    for threshold in bin_mids:
-        # Class 1 (below threshold)
-        weight1 = probabilities[bin_mids <= threshold].sum()
-        if weight1 == 0:  # Avoid division by zero
-            continue
-        mean1 = (bin_mids[bin_mids <= threshold] * probabilities[bin_mids <= threshold]).sum() / weight1
-        
-        # Class 2 (above threshold)
-        weight2 = probabilities[bin_mids > threshold].sum()
-        if weight2 == 0:  # Avoid division by zero
-            continue
-        mean2 = (bin_mids[bin_mids > threshold] * probabilities[bin_mids > threshold]).sum() / weight2
-        
-        # Inter-class variance
-        variance_between = weight1 * weight2 * (mean1 - mean2) ** 2
+    Parameters:
+    -----------
+    hist : array-like
+        Counts of each bin.
+    bin_edges : array-like
+        Bin edges, one more than bins.
         
-        # Update the maximum variance and threshold
-        if variance_between > max_variance:
-            max_variance = variance_between
-            optimal_threshold = threshold
-    
-    return optimal_threshold
+    Returns:
+    --------
+    float
+        Optimal threshold value that maximizes inter-class variance.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    bin_edges = np.asarray(bin_edges)
+    probabilities = hist / hist.sum()
+    bin_mids = (bin_edges[:-1] + bin_edges[1:]) / 2
+    weighted = bin_mids * probabilities
+
+    # Class 1 holds bins [0, t], class 2 bins [t+1, nbins-1]. Class 2 is summed
+    # from the top so its weight does not suffer from cancellation.
+    weight1 = np.cumsum(probabilities)
+    sum1 = np.cumsum(weighted)
+    weight2 = np.append(np.cumsum(probabilities[::-1])[::-1][1:], 0)
+    sum2 = np.append(np.cumsum(weighted[::-1])[::-1][1:], 0)
+
+    valid = (weight1 != 0) & (weight2 != 0)
+    if not np.any(valid):
+        return 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance_between = weight1 * weight2 * (sum1 / weight1 - sum2 / weight2) ** 2
+    variance_between[~valid] = 0
+
+    # 0 if no threshold gives a positive variance
+    t = plateau_center(variance_between)
+    if variance_between[t] <= 0:
+        return 0
+    return bin_mids[t]
 
 
 def kapur_entropy_thresholding(data: Union[List[float], npt.ArrayLike], nbins: int = 256) -> Optional[float]:
@@ -100,55 +162,291 @@ def kapur_entropy_thresholding(data: Union[List[float], npt.ArrayLike], nbins: i
     - Uses a small epsilon (1e-12) to avoid numerical issues with log(0)
     - Handles edge cases where probabilities are too close to zero
     """
-    # Convert to NumPy array if not already
-    data = np.array(data, dtype=np.float32)
-    
-    # Compute histogram and bin edges
-    hist, bin_edges = np.histogram(data, bins=nbins, range=(np.min(data), np.max(data)))
+    hist, bin_edges = histogram(data, nbins)
+    return kapur_threshold_hist(hist, bin_edges)
+
+
+def kapur_threshold_hist(hist: npt.ArrayLike, bin_edges: npt.ArrayLike) -> Optional[float]:
+    """
+    Compute the Kapur entropy threshold of a histogram.
     
-    # Convert histogram to probability distribution
-    hist = hist.astype(float)
+    Parameters:
+    -----------
+    hist : array-like
+        Counts of each bin.
+    bin_edges : array-like
+        Bin edges, one more than bins.
+        
+    Returns:
+    --------
+    float or None
+        The midpoint of the last bin of the lower class, None if no valid
+        threshold is found.
+    """
+    hist = np.asarray(hist, dtype=float)
+    bin_edges = np.asarray(bin_edges)
     p = hist / hist.sum()
+    eps = 1e-12
+
+    # Background class: [0, t], foreground class: [t+1, nbins-1]
+    pb = np.cumsum(p)[:-1]
+    pf = 1 - pb
+    p_log_p = p * np.log(p + eps)
+    background_sum = np.cumsum(p_log_p)[:-1]
+    foreground_sum = np.cumsum(p_log_p[::-1])[::-1][1:]
+
+    valid = (pb >= eps) & (pf >= eps)
+    if not np.any(valid):
+        return None
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        background_entropy = background_sum / pb - np.log(pb + eps)
+        foreground_entropy = foreground_sum / pf - np.log(pf + eps)
+    total_entropy = np.where(valid, background_entropy + foreground_entropy, -np.inf)
+
+    t = plateau_center(total_entropy)
+    return 0.5 * (bin_edges[t] + bin_edges[t + 1])
+
+
+def multi_otsu_thresholds(data: Union[List[float], npt.ArrayLike], classes: int = 3,
+                          nbins: int = 128) -> np.ndarray:
+    """
+    Compute the thresholds separating data into several classes with Otsu's method.
     
-    # Compute cumulative sums
-    cdf = np.cumsum(p)
+    For a chain of N ions the PMT counts fall into N + 1 classes, zero to N bright
+    ions, separated by N thresholds.
     
-    # Small epsilon to avoid numerical issues
-    eps = 1e-12
+    Parameters:
+    -----------
+    data : array-like
+        Input 1D array of numerical data.
+    classes : int, optional
+        Number of classes. Default is 3.
+    nbins : int, optional
+        Number of histogram bins to use. Default is 128.
+        
+    Returns:
+    --------
+    np.ndarray
+        The classes - 1 thresholds in increasing order.
+    """
+    hist, bin_edges = histogram(data, nbins)
+    return multi_otsu_thresholds_hist(hist, bin_edges, classes)
+
+
+def multi_otsu_thresholds_hist(hist: npt.ArrayLike, bin_edges: npt.ArrayLike, classes: int = 3) -> np.ndarray:
+    """
+    Compute the multi-class Otsu thresholds of a histogram.
+    
+    Maximizing the inter-class variance is maximizing the sum over classes of
+    weight * mean ** 2. With cumulative sums the term of any range of bins costs
+    O(1), and the best split into classes is found by dynamic programming over
+    the last bin of each class in O(classes * nbins ** 2).
     
-    # Precompute partial sums for efficiency
-    p_log_p = p * np.log(p + eps)  # p*log(p)
+    Parameters:
+    -----------
+    hist : array-like
+        Counts of each bin.
+    bin_edges : array-like
+        Bin edges, one more than bins.
+    classes : int, optional
+        Number of classes. Default is 3.
+        
+    Returns:
+    --------
+    np.ndarray
+        The classes - 1 thresholds in increasing order, each the midpoint of the
+        last bin of a class.
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    bin_edges = np.asarray(bin_edges)
+    nbins = len(hist)
+    if classes < 2 or classes > nbins:
+        raise ValueError(f"classes must be between 2 and the number of bins {nbins}")
+
+    probabilities = hist / hist.sum()
+    bin_mids = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    # Weight and first moment of bins [i, j) from cumulative sums
+    cum_weight = np.concatenate(([0], np.cumsum(probabilities)))
+    cum_sum = np.concatenate(([0], np.cumsum(bin_mids * probabilities)))
+    weight = cum_weight[None, :] - cum_weight[:, None]
+    moment = cum_sum[None, :] - cum_sum[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = np.where(weight > 0, moment ** 2 / weight, 0)
+    # Empty or reversed ranges are not classes
+    score[np.tril_indices(nbins + 1)] = -np.inf
+
+    # best[j]: best score of the classes so far covering bins [0, j)
+    best = score[0]
+    splits = []
+    for _ in range(classes - 1):
+        total = best[:, None] + score
+        splits.append(np.argmax(total, axis=0))
+        best = total[splits[-1], np.arange(nbins + 1)]
+
+    # Walk back from the last class, which ends after the last bin
+    thresholds = []
+    end = nbins
+    for split in reversed(splits):
+        end = split[end]
+        thresholds.append(bin_mids[end - 1])
+    return np.array(thresholds[::-1])
+
+
+class StreamingThreshold:
+    """
+    Threshold of PMT counts, updated as shots arrive.
     
-    # Initialize variables for finding optimal threshold
-    max_entropy = -np.inf
-    optimal_threshold = None
+    Counts are added to a fixed-bin histogram, either as histograms, ex. those of a
+    CountAccumulator, or as raw counts. Each update recomputes the threshold from the
+    histogram in O(nbins), independent of the number of shots. Optionally, the
+    readout/threshold parameter is set when the threshold moved by more than the
+    tolerance, so the next experiments use it.
     
-    # Try every bin as a potential threshold
-    for t in range(nbins - 1):
-        # Background class: [0, t]
-        # Foreground class: [t+1, nbins-1]
+    The estimator can be fed by dataset writes of a running scan:
+        estimator = StreamingThreshold(50, parameter_manager=self.parameter_manager)
+        estimator.watch_histograms(self.experiment_data, "pmt_counts_hist")
+
+    When watching a scan, the parameter is set from the dataset writer while the scan
+    runs. The scan itself keeps the threshold it read at the start; only experiments
+    submitted afterwards use the updated parameter.
+    """
+
+    def __init__(self, num_bins: int, bin_width: int = 1, method: str = "otsu",
+                 parameter_manager=None, param_name: str = "readout/threshold",
+                 tolerance: float = 1.0, min_shots: int = 1000):
+        """
+        Create a StreamingThreshold with an empty histogram.
         
-        # Probability of background and foreground classes
-        pb = cdf[t]
-        pf = 1 - pb
+        Parameters:
+        -----------
+        num_bins : int
+            Number of bins. Counts above the last bin are added to the last bin,
+            as done by CountAccumulator.
+        bin_width : int, optional
+            Width of a bin in counts. Default is 1.
+        method : str, optional
+            "otsu" or "kapur". Default is "otsu".
+        parameter_manager : ParameterManager, optional
+            Set to write the threshold back to the parameter param_name.
+        param_name : str, optional
+            Parameter holding the threshold. Default is "readout/threshold".
+        tolerance : float, optional
+            Change in counts from the parameter at which it is written. Default is 1.
+        min_shots : int, optional
+            Number of shots before the parameter is written. Default is 1000.
+        """
+        if method not in ("otsu", "kapur"):
+            raise ValueError(f"Unknown thresholding method {method}")
+
+        self.hist = np.zeros(num_bins, dtype=np.int64)
+        self.bin_edges = np.arange(num_bins + 1) * bin_width
+        self.bin_width = bin_width
+        self.method = method
+        self.parameter_manager = parameter_manager
+        self.param_name = param_name
+        self.tolerance = tolerance
+        self.min_shots = min_shots
+        self.threshold = None
+
+    @property
+    def shots(self) -> int:
+        """Number of shots added so far."""
+        return int(self.hist.sum())
+
+    def add_histogram(self, hist: npt.ArrayLike) -> Optional[float]:
+        """
+        Add one or more histograms with the bins of this estimator and update.
+        
+        Parameters:
+        -----------
+        hist : array-like
+            Counts of each bin, or an array of histograms with bins along the last axis.
+            Rows that were not taken yet (nan) are skipped.
+            
+        Returns:
+        --------
+        float or None
+            The updated threshold.
+        """
+        hist = np.asarray(hist, dtype=np.float64).reshape(-1, len(self.hist))
+        hist = hist[~np.any(np.isnan(hist), axis=1)]
+        self.hist += hist.sum(axis=0).astype(np.int64)
+        return self.update()
+
+    def add_counts(self, counts: npt.ArrayLike) -> Optional[float]:
+        """
+        Add the counts of single shots and update.
         
-        # Skip invalid thresholds
-        if pb < eps or pf < eps:
-            continue
+        Parameters:
+        -----------
+        counts : array-like
+            PMT counts, nan entries are skipped.
+            
+        Returns:
+        --------
+        float or None
+            The updated threshold.
+        """
+        counts = np.asarray(counts, dtype=np.float64).ravel()
+        counts = counts[~np.isnan(counts)]
+        bins = np.clip(counts // self.bin_width, 0, len(self.hist) - 1).astype(np.int64)
+        self.hist += np.bincount(bins, minlength=len(self.hist))
+        return self.update()
+
+    def update(self) -> Optional[float]:
+        """
+        Recompute the threshold and write it back if it moved beyond the tolerance.
         
-        # Calculate background entropy
-        background_entropy = (p_log_p[:t+1].sum() / pb) - np.log(pb + eps)
+        Called for every batch of shots, ex. from a dataset watcher in the writer path of
+        a running scan. The parameter is written then, but the running scan does not read
+        it again. Changes are logged at INFO level.
         
-        # Calculate foreground entropy
-        foreground_entropy = (p_log_p[t+1:].sum() / pf) - np.log(pf + eps)
+        Returns:
+        --------
+        float or None
+            The threshold, None while the histogram is empty or has no threshold.
+        """
+        if self.shots == 0:
+            return self.threshold
+
+        if self.method == "otsu":
+            self.threshold = otsu_threshold_hist(self.hist, self.bin_edges)
+        else:
+            self.threshold = kapur_threshold_hist(self.hist, self.bin_edges)
+
+        if self.parameter_manager is not None and self.threshold is not None and self.shots >= self.min_shots:
+            current = self.parameter_manager.get_param(self.param_name)
+            if abs(self.threshold - current) > self.tolerance:
+                logger.info("Threshold moved from %s to %s, updating %s",
+                            current, self.threshold, self.param_name)
+                self.parameter_manager.set_param(self.param_name, float(self.threshold))
+
+        return self.threshold
+
+    def watch_histograms(self, experiment_data, name: str):
+        """
+        Add every histogram written to a dataset, ex. <name>_hist of a CountAccumulator.
         
-        # Total entropy is the sum of both class entropies
-        total_entropy = background_entropy + foreground_entropy
+        Parameters:
+        -----------
+        experiment_data : ExperimentData
+            The ExperimentData writing the dataset.
+        name : str
+            Name of the dataset of histograms, bins along the last axis.
+        """
+        experiment_data.watch(name, lambda index_mut, data: self.add_histogram(data))
+
+    def watch_counts(self, experiment_data, name: str):
+        """
+        Add every count written to a dataset of raw counts.
         
-        # Update max entropy and threshold
-        if total_entropy > max_entropy:
-            max_entropy = total_entropy
-            # Use midpoint of bin edges for threshold value
-            optimal_threshold = 0.5 * (bin_edges[t] + bin_edges[t+1])
-    
-    return optimal_threshold
\ No newline at end of file
+        Parameters:
+        -----------
+        experiment_data : ExperimentData
+            The ExperimentData writing the dataset.
+        name : str
+            Name of the dataset of single-shot counts.
+        """
+        experiment_data.watch(name, lambda index_mut, data: self.add_counts(data))
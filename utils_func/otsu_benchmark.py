@@ -0,0 +1,123 @@
+"""
+Benchmark of the cumulative-sum thresholding methods in otsu.py.
+
+The loop implementations the module used before are kept here as references. For
+histograms of PMT counts of one to three ions, each method is timed on the histogram
+alone and on the raw shots, and checked to split the histogram into the same classes
+as its reference. Thresholds may differ inside a run of empty bins, where every
+threshold gives the same classes.
+
+Example:
+    python -m utils_func.otsu_benchmark --shots 100000 1000000
+"""
+
+import argparse
+import time
+import numpy as np
+
+from utils_func.otsu import (
+    histogram, otsu_threshold_hist, kapur_threshold_hist, multi_otsu_thresholds_hist,
+    otsu_threshold_manual, kapur_entropy_thresholding
+)
+
+
+def otsu_threshold_loop(hist, bin_edges):
+    """Reference Otsu threshold, testing every bin with masks over the histogram."""
+    probabilities = hist / hist.sum()
+    bin_mids = (bin_edges[:-1] + bin_edges[1:]) / 2
+    max_variance = 0
+    optimal_threshold = 0
+    for threshold in bin_mids:
+        weight1 = probabilities[bin_mids <= threshold].sum()
+        if weight1 == 0:
+            continue
+        mean1 = (bin_mids[bin_mids <= threshold] * probabilities[bin_mids <= threshold]).sum() / weight1
+        weight2 = probabilities[bin_mids > threshold].sum()
+        if weight2 == 0:
+            continue
+        mean2 = (bin_mids[bin_mids > threshold] * probabilities[bin_mids > threshold]).sum() / weight2
+        variance_between = weight1 * weight2 * (mean1 - mean2) ** 2
+        if variance_between > max_variance:
+            max_variance = variance_between
+            optimal_threshold = threshold
+    return optimal_threshold
+
+
+def kapur_threshold_loop(hist, bin_edges):
+    """Reference Kapur threshold, summing both classes for every bin."""
+    p = hist.astype(float) / hist.sum()
+    cdf = np.cumsum(p)
+    eps = 1e-12
+    p_log_p = p * np.log(p + eps)
+    max_entropy = -np.inf
+    optimal_threshold = None
+    for t in range(len(p) - 1):
+        pb = cdf[t]
+        pf = 1 - pb
+        if pb < eps or pf < eps:
+            continue
+        total_entropy = (p_log_p[:t+1].sum() / pb) - np.log(pb + eps) + (p_log_p[t+1:].sum() / pf) - np.log(pf + eps)
+        if total_entropy > max_entropy:
+            max_entropy = total_entropy
+            optimal_threshold = 0.5 * (bin_edges[t] + bin_edges[t+1])
+    return optimal_threshold
+
+
+def pmt_counts(num_shots, num_ions, rng):
+    """Simulate PMT counts of a chain of ions, each bright with probability 1/2."""
+    bright_ions = rng.binomial(num_ions, 0.5, num_shots)
+    return rng.poisson(1.5 + 12 * bright_ions)
+
+
+def timed(function, *args, repeat=5):
+    """Get the result and the best time of several calls in s."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def same_classes(hist, bin_edges, threshold1, threshold2):
+    """Check that two thresholds put the same bins of a histogram in the lower class."""
+    bin_mids = (bin_edges[:-1] + bin_edges[1:]) / 2
+    return hist[bin_mids <= threshold1].sum() == hist[bin_mids <= threshold2].sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the thresholding methods of otsu.py.")
+    parser.add_argument("--shots", type=int, nargs="+", default=[100000, 1000000],
+                        help="Number of shots of each histogram")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'shots':>8} {'ions':>4} {'method':<24}{'loop (ms)':>10}{'cumsum (ms)':>12}"
+          f"{'speedup':>9}{'from shots (ms)':>16}  same classes")
+    for num_shots in args.shots:
+        for num_ions in [1, 2, 3]:
+            counts = pmt_counts(num_shots, num_ions, rng)
+            methods = [
+                ("otsu (512 bins)", 512, otsu_threshold_loop, otsu_threshold_hist, otsu_threshold_manual, (counts,)),
+                ("kapur (256 bins)", 256, kapur_threshold_loop, kapur_threshold_hist,
+                 kapur_entropy_thresholding, (counts, 256)),
+            ]
+            for name, nbins, reference, method, from_shots, shot_args in methods:
+                hist, bin_edges = histogram(counts, nbins)
+                expected, loop_time = timed(reference, hist, bin_edges, repeat=1)
+                threshold, cumsum_time = timed(method, hist, bin_edges)
+                _, shots_time = timed(from_shots, *shot_args)
+                print(f"{num_shots:>8} {num_ions:>4} {name:<24}{1e3 * loop_time:>10.2f}{1e3 * cumsum_time:>12.3f}"
+                      f"{loop_time / cumsum_time:>9.0f}{1e3 * shots_time:>16.2f}  "
+                      f"{same_classes(hist, bin_edges, expected, threshold)}")
+
+            if num_ions > 1:
+                hist, bin_edges = histogram(counts, 128)
+                thresholds, multi_time = timed(multi_otsu_thresholds_hist, hist, bin_edges, num_ions + 1)
+                print(f"{num_shots:>8} {num_ions:>4} {'multi-otsu (128 bins)':<24}{'':>10}{1e3 * multi_time:>12.3f}"
+                      f"{'':>9}{'':>16}  thresholds {np.round(thresholds, 2)}")
+
+
+if __name__ == "__main__":
+    main()
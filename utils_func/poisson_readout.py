@@ -0,0 +1,433 @@
+"""
+Maximum-likelihood state discrimination of PMT counts.
+
+The counts of a readout window are modeled as Poisson distributed, with the mean
+    rate(k) = background + k * ion_rate
+for a chain with k of num_ions ions bright. The model is fitted to the counts of all
+shots, or to a histogram of them, by expectation maximization, without knowing the
+state of any shot. Compared to a count threshold, it gives the probability of every
+state for each shot, and the error of a decision.
+
+Since the likelihood ratio of bright and dark after n counts in a part t of the window,
+    n * log(rate(1) / rate(0)) - (rate(1) - rate(0)) * t,
+only depends on n and t, the readout of a single ion can stop as soon as it is decisive.
+early_termination computes the count boundaries for a window split into slices, which
+ReadOut397.run_early_termination checks after every slice.
+"""
+
+from typing import Optional, Union, List
+import numpy as np
+import numpy.typing as npt
+
+
+def log_factorial(max_count: int) -> np.ndarray:
+    """
+    Compute log(n!) for n from 0 to max_count.
+
+    Parameters:
+    -----------
+    max_count : int
+        Largest count.
+
+    Returns:
+    --------
+    np.ndarray
+        log(n!) for every n.
+    """
+    return np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, max_count + 1)))))
+
+
+def poisson_log_pmf(counts: np.ndarray, rates: npt.ArrayLike) -> np.ndarray:
+    """
+    Compute the log probabilities of non-negative integer counts for several rates.
+
+    Parameters:
+    -----------
+    counts : np.ndarray
+        1D array of counts.
+    rates : array-like
+        Mean counts of each distribution.
+
+    Returns:
+    --------
+    np.ndarray
+        Log probabilities of shape [len(counts), len(rates)].
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    rates = np.maximum(np.asarray(rates, dtype=np.float64), 1e-300)
+    log_fact = log_factorial(int(counts.max(initial=0)))[counts]
+    return counts[:, None] * np.log(rates)[None, :] - rates[None, :] - log_fact[:, None]
+
+
+class PoissonReadout:
+    """
+    Poisson count distributions of the states of a chain of ions.
+
+    State k has k bright ions and the mean count background + k * ion_rate in the
+    full readout window, and is prepared with probability weights[k]. The weights
+    are the prior of the state probabilities, fit the model to shots of the same
+    experiment or pass the weights expected there.
+
+    Fit the model to the shots of a scan and classify them:
+        readout = fit_poisson_mixture(counts)
+        probabilities = readout.state_probabilities(counts)[:, 1]
+    """
+
+    def __init__(self, background: float, ion_rate: float, weights: Optional[npt.ArrayLike] = None,
+                 num_ions: int = 1):
+        """
+        Create a PoissonReadout.
+
+        Parameters:
+        -----------
+        background : float
+            Mean count of the dark state in the readout window.
+        ion_rate : float
+            Mean count added by each bright ion in the readout window.
+        weights : array-like, optional
+            Probability of each number of bright ions. Default is uniform.
+        num_ions : int, optional
+            Number of ions. Default is 1.
+        """
+        if background < 0 or ion_rate <= 0:
+            raise ValueError(f"Invalid rates: background {background}, ion rate {ion_rate}")
+
+        self.background = float(background)
+        self.ion_rate = float(ion_rate)
+        self.num_ions = int(num_ions)
+        if weights is None:
+            weights = np.ones(self.num_ions + 1)
+        weights = np.asarray(weights, dtype=np.float64)
+        if len(weights) != self.num_ions + 1:
+            raise ValueError(f"Expected {self.num_ions + 1} weights, got {len(weights)}")
+        self.weights = weights / weights.sum()
+
+    def __repr__(self) -> str:
+        return (f"PoissonReadout(background={self.background:.4g}, ion_rate={self.ion_rate:.4g}, "
+                f"weights={np.round(self.weights, 4).tolist()}, num_ions={self.num_ions})")
+
+    @property
+    def rates(self) -> np.ndarray:
+        """Mean count of each number of bright ions."""
+        return self.background + self.ion_rate * np.arange(self.num_ions + 1)
+
+    @classmethod
+    def from_labeled(cls, dark_counts: npt.ArrayLike, bright_counts: npt.ArrayLike) -> "PoissonReadout":
+        """
+        Create the model of a single ion from shots of known state.
+
+        Parameters:
+        -----------
+        dark_counts : array-like
+            Counts of shots with the ion dark, ex. with the 866 turned off.
+        bright_counts : array-like
+            Counts of shots with the ion bright.
+
+        Returns:
+        --------
+        PoissonReadout
+            The model with the maximum-likelihood rates and uniform weights.
+
+        Raises:
+        -------
+        ValueError
+            If a set of counts is empty or not finite, or the bright rate is not larger.
+        """
+        dark = np.mean(dark_counts) if len(dark_counts) else np.nan
+        bright = np.mean(bright_counts) if len(bright_counts) else np.nan
+        if not (np.isfinite(dark) and np.isfinite(bright)):
+            raise ValueError(f"Invalid labeled counts: dark mean {dark}, bright mean {bright}")
+        return cls(dark, bright - dark)
+
+    def log_likelihoods(self, counts: npt.ArrayLike) -> np.ndarray:
+        """
+        Compute log(weights[k] * P(count | k)) of each shot and state.
+
+        Parameters:
+        -----------
+        counts : array-like
+            PMT counts of the full readout window.
+
+        Returns:
+        --------
+        np.ndarray
+            Array of shape [len(counts), num_ions + 1].
+        """
+        counts = np.asarray(counts).ravel()
+        return poisson_log_pmf(counts, self.rates) + np.log(np.maximum(self.weights, 1e-300))[None, :]
+
+    def state_probabilities(self, counts: npt.ArrayLike) -> np.ndarray:
+        """
+        Compute the probability of each number of bright ions for every shot.
+
+        Parameters:
+        -----------
+        counts : array-like
+            PMT counts of the full readout window.
+
+        Returns:
+        --------
+        np.ndarray
+            Array of shape [len(counts), num_ions + 1], each row sums to 1.
+        """
+        log_l = self.log_likelihoods(counts)
+        log_l -= log_l.max(axis=1, keepdims=True)
+        probabilities = np.exp(log_l)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def discriminate(self, counts: npt.ArrayLike) -> np.ndarray:
+        """
+        Get the most likely number of bright ions of every shot.
+
+        Parameters:
+        -----------
+        counts : array-like
+            PMT counts of the full readout window.
+
+        Returns:
+        --------
+        np.ndarray
+            Number of bright ions of each shot.
+        """
+        return np.argmax(self.log_likelihoods(counts), axis=1)
+
+    def thresholds(self) -> np.ndarray:
+        """
+        Get the count thresholds equivalent to discriminate.
+
+        Since the rates increase with the number of bright ions, the most likely state
+        increases with the count. Shots with threshold[k - 1] <= count < threshold[k]
+        have k bright ions, thresholds[0] is used like readout/threshold.
+
+        Returns:
+        --------
+        np.ndarray
+            The smallest count of each state with at least one bright ion.
+        """
+        counts = np.arange(int(self.rates[-1] + 10 * np.sqrt(self.rates[-1]) + 10))
+        states = self.discriminate(counts)
+        return np.array([np.argmax(states >= k) for k in range(1, self.num_ions + 1)])
+
+    def error_rates(self) -> np.ndarray:
+        """
+        Compute the probability of assigning a wrong number of bright ions.
+
+        Returns:
+        --------
+        np.ndarray
+            Error probability of each state, when shots are assigned with discriminate.
+        """
+        counts = np.arange(int(self.rates[-1] + 10 * np.sqrt(self.rates[-1]) + 10))
+        pmf = np.exp(poisson_log_pmf(counts, self.rates))
+        states = self.discriminate(counts)
+        return np.array([pmf[states != k, k].sum() + max(0.0, 1 - pmf[:, k].sum())
+                         for k in range(self.num_ions + 1)])
+
+    def log_likelihood_hist(self, hist: npt.ArrayLike) -> float:
+        """
+        Compute the log likelihood of a histogram of counts with bins of width 1.
+
+        Parameters:
+        -----------
+        hist : array-like
+            Number of shots with each count, starting at 0.
+
+        Returns:
+        --------
+        float
+            The log likelihood.
+        """
+        hist = np.asarray(hist, dtype=np.float64)
+        log_l = self.log_likelihoods(np.arange(len(hist)))
+        peak = log_l.max(axis=1)
+        return float(np.sum(hist * (peak + np.log(np.exp(log_l - peak[:, None]).sum(axis=1)))))
+
+    def early_termination(self, num_slices: int, error: float = 1e-3) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the count boundaries at which the readout of a single ion can stop.
+
+        The window is split into num_slices slices of equal length. After slice i,
+        with n counts so far, the ion is bright if n >= bright_from[i] and dark if
+        n <= dark_upto[i], both when the probability of the other state is at most
+        error. Otherwise the next slice is read. After the last slice, the boundaries
+        are those of discriminate, so every shot is decided.
+
+        Parameters:
+        -----------
+        num_slices : int
+            Number of slices of the readout window.
+        error : float, optional
+            Largest probability of the other state at which a slice decides.
+            Default is 1e-3.
+
+        Returns:
+        --------
+        tuple
+            (dark_upto, bright_from), int32 arrays of length num_slices.
+            dark_upto is -1 where no count decides dark.
+        """
+        if self.num_ions != 1:
+            raise ValueError("Early termination is only supported for a single ion")
+        if num_slices < 1 or not 0 < error < 0.5:
+            raise ValueError(f"Invalid early termination settings: {num_slices} slices, error {error}")
+
+        dark_rate, bright_rate = self.rates
+        log_ratio = np.log(bright_rate / max(dark_rate, 1e-300))
+        log_prior = np.log(self.weights[1] / self.weights[0])
+        decisive = np.log((1 - error) / error)
+
+        # The log likelihood ratio n * log_ratio - (bright_rate - dark_rate) * t + log_prior
+        # crosses +decisive at bright_from and -decisive above dark_upto
+        t = np.arange(1, num_slices + 1) / num_slices
+        offset = (bright_rate - dark_rate) * t - log_prior
+        bright_from = np.ceil((decisive + offset) / log_ratio)
+        dark_upto = np.floor((offset - decisive) / log_ratio)
+
+        bright_from[-1] = self.thresholds()[0]
+        dark_upto[-1] = bright_from[-1] - 1
+        bright_from = np.maximum(bright_from, 0)
+        dark_upto = np.maximum(dark_upto, -1)
+        return dark_upto.astype(np.int32), bright_from.astype(np.int32)
+
+    def early_termination_performance(self, dark_upto: npt.ArrayLike,
+                                      bright_from: npt.ArrayLike) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the mean readout time and the error of early termination.
+
+        The distribution of the counts of undecided shots is propagated through the
+        slices exactly, the counts of a slice being Poisson with 1 / num_slices of the
+        rate of the window.
+
+        Parameters:
+        -----------
+        dark_upto, bright_from : array-like
+            Boundaries returned by early_termination.
+
+        Returns:
+        --------
+        tuple
+            (mean_time, error), arrays of the dark and the bright state. mean_time is
+            the mean fraction of the window read before the shot is decided.
+        """
+        dark_upto = np.asarray(dark_upto)
+        bright_from = np.asarray(bright_from)
+        num_slices = len(bright_from)
+        max_count = int(bright_from.max()) + 1
+
+        mean_time = np.zeros(2)
+        errors = np.zeros(2)
+        for state, rate in enumerate(self.rates):
+            # Probability of each count below max_count, of shots not decided yet
+            undecided = np.zeros(max_count)
+            undecided[0] = 1
+            slice_pmf = np.exp(poisson_log_pmf(np.arange(max_count), [rate / num_slices]))[:, 0]
+            for i in range(num_slices):
+                pmf = np.convolve(undecided, slice_pmf)[:max_count]
+                # Counts at or above max_count are all above every bright boundary
+                p_above = undecided.sum() - pmf.sum()
+                p_bright = pmf[bright_from[i]:].sum() + p_above
+                p_dark = pmf[:dark_upto[i] + 1].sum()
+                mean_time[state] += (p_bright + p_dark) * (i + 1) / num_slices
+                errors[state] += p_dark if state == 1 else p_bright
+                undecided = pmf.copy()
+                undecided[bright_from[i]:] = 0
+                undecided[:dark_upto[i] + 1] = 0
+        return mean_time, errors
+
+
+def fit_poisson_mixture_hist(hist: npt.ArrayLike, num_ions: int = 1, max_iterations: int = 1000,
+                             tolerance: float = 1e-10) -> PoissonReadout:
+    """
+    Fit a PoissonReadout to a histogram of counts by expectation maximization.
+
+    Each iteration computes the probability of every state for every bin and then
+    the background, ion rate and weights maximizing the expected log likelihood. The
+    counts of a shot are split into background and ion counts in proportion to their
+    rates, which makes the maximization step closed form for any number of ions.
+    Every iteration costs O(nbins * num_ions).
+
+    Parameters:
+    -----------
+    hist : array-like
+        Number of shots with each count, starting at 0 with bins of width 1, ex. the
+        <name>_hist_total dataset of a CountAccumulator. Counts in an overflow bin are
+        taken as the count of the bin.
+    num_ions : int, optional
+        Number of ions. Default is 1.
+    max_iterations : int, optional
+        Largest number of iterations. Default is 1000.
+    tolerance : float, optional
+        Change of the log likelihood per shot at which the fit stops. Default is 1e-10.
+
+    Returns:
+    --------
+    PoissonReadout
+        The fitted model.
+
+    Raises:
+    -------
+    ValueError
+        If fewer than two bins hold shots, the states cannot be told apart.
+    """
+    hist = np.nan_to_num(np.asarray(hist, dtype=np.float64).ravel())
+    num_shots = hist.sum()
+    if np.count_nonzero(hist) < 2:
+        raise ValueError("Cannot fit a histogram with fewer than two occupied bins")
+    counts = np.arange(len(hist))
+    ions = np.arange(num_ions + 1)
+
+    # Start with the dark state below and the others above the Otsu threshold
+    from utils_func.otsu import otsu_threshold_hist
+    threshold = otsu_threshold_hist(hist, np.arange(len(hist) + 1) - 0.5)
+    dark = hist[counts <= threshold]
+    bright = hist[counts > threshold]
+    background = max(np.dot(counts[counts <= threshold], dark) / max(dark.sum(), 1), 0.1)
+    ion_rate = max(np.dot(counts[counts > threshold], bright) / max(bright.sum(), 1) - background, 1.0)
+    # The bright shots have (num_ions + 1) / 2 bright ions on average
+    readout = PoissonReadout(background, 2 * ion_rate / (num_ions + 1), num_ions=num_ions)
+
+    last_log_likelihood = -np.inf
+    for _ in range(max_iterations):
+        # Expectation: probability of each state for each bin, weighted by the bin
+        responsibilities = readout.state_probabilities(counts) * hist[:, None]
+        shots = responsibilities.sum(axis=0)
+        total_counts = responsibilities.T @ counts
+
+        # Maximization: the expected counts of state k are split into background and
+        # ion counts in the ratio background : k * ion_rate
+        rates = readout.rates
+        background_counts = np.sum(total_counts * readout.background / rates)
+        ion_counts = np.sum(total_counts * ions * readout.ion_rate / rates)
+        # A background of 0 would make the responsibilities of the dark state 0 / 0
+        background = max(background_counts / num_shots, 1e-9)
+        ion_rate = ion_counts / max(np.dot(shots, ions), 1e-300)
+        readout = PoissonReadout(background, max(ion_rate, 1e-9), shots / num_shots, num_ions)
+
+        log_likelihood = readout.log_likelihood_hist(hist)
+        if abs(log_likelihood - last_log_likelihood) < tolerance * num_shots:
+            break
+        last_log_likelihood = log_likelihood
+    return readout
+
+
+def fit_poisson_mixture(counts: Union[List[int], npt.ArrayLike], num_ions: int = 1, **kwargs) -> PoissonReadout:
+    """
+    Fit a PoissonReadout to the counts of single shots.
+
+    Parameters:
+    -----------
+    counts : array-like
+        PMT counts, nan entries are skipped.
+    num_ions : int, optional
+        Number of ions. Default is 1.
+    **kwargs
+        Passed to fit_poisson_mixture_hist.
+
+    Returns:
+    --------
+    PoissonReadout
+        The fitted model.
+    """
+    counts = np.asarray(counts, dtype=np.float64).ravel()
+    counts = counts[~np.isnan(counts)]
+    return fit_poisson_mixture_hist(np.bincount(counts.astype(np.int64)), num_ions, **kwargs)